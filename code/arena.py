@@ -0,0 +1,172 @@
+""" ===========================================================================
+File   : arena.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Defines ASTArena; a compact AST store that keeps a whole tree in parallel
+arrays (opcode, left, right, interned value index), with nodes referred to by
+small integer handles instead of one AST object each
+
+ArenaAST adapts a handle to the AST interface (getID, getLeft, getRight,
+getValue), so arena trees work wherever AST objects do (e.g. get_CFG,
+visualize_ast)
+=========================================================================== """
+from lib import *
+from ast import *
+from ast import _generate_AST
+from ast import _load
+from array import array
+
+
+""" ======================================================================= """
+""" ==================     MACROS       =================================== """
+""" ======================================================================= """
+
+# Handle of a missing child
+NIL      = -1
+
+# Opcode of a node is the index of its value in AST_NODES; or OP_VALUE for
+# variables and constants
+OP_VALUE = len(AST_NODES)
+_OPCODES = dict((value, op) for op, value in enumerate(AST_NODES))
+
+""" ======================================================================= """
+""" ==================      CLASSES               ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define an arena of AST nodes; node h is (opcode[h], left[h], right[h],
+value[h]), with value[h] an index into the table of interned values
+--------------------------------------------------------------------------- '''
+class ASTArena():
+    def __init__(self):
+        self._opcodes = array('b')
+        self._lefts   = array('i')
+        self._rights  = array('i')
+        self._values  = array('i')
+
+        self._value_table = [] # Value index -> value
+        self._value_index = {} # Value -> value index
+
+    def __len__(self):
+        return len(self._opcodes)
+
+    # Append a node; return its handle
+    def add(self, value, left=NIL, right=NIL):
+        index = self._value_index.get(value)
+        if index is None:
+            index = len(self._value_table)
+            self._value_table.append(value)
+            self._value_index[value] = index
+
+        self._opcodes.append(_OPCODES.get(value, OP_VALUE))
+        self._lefts.append(left)
+        self._rights.append(right)
+        self._values.append(index)
+        return len(self._opcodes) - 1
+
+    # Append a node; return it as an ArenaAST (e.g. as make for _generate_AST)
+    def newNode(self, value):
+        return ArenaAST(self, self.add(value))
+
+    # Return node with handle as an ArenaAST; None for NIL
+    def getNode(self, handle):
+        if handle == NIL:
+            return None
+        return ArenaAST(self, handle)
+
+    def getOpcode(self, handle):
+        return self._opcodes[handle]
+
+    def getLeft(self, handle):
+        return self._lefts[handle]
+
+    def getRight(self, handle):
+        return self._rights[handle]
+
+    def getValue(self, handle):
+        return self._value_table[self._values[handle]]
+
+    def setLeft(self, handle, left):
+        self._lefts[handle] = left
+
+    def setRight(self, handle, right):
+        self._rights[handle] = right
+
+''' ---------------------------------------------------------------------------
+Define a handle to a node in an ASTArena, with the interface of an AST; these
+are created on demand, and equal when they refer to the same node
+--------------------------------------------------------------------------- '''
+class ArenaAST():
+    __slots__ = ["_arena", "_handle"]
+
+    def __init__(self, arena, handle):
+        self._arena  = arena
+        self._handle = handle
+
+    def getArena(self):
+        return self._arena
+
+    def getHandle(self):
+        return self._handle
+
+    def getID(self):
+        return str(self._handle)
+
+    def getLeft(self):
+        return self._arena.getNode(self._arena.getLeft(self._handle))
+
+    def getRight(self):
+        return self._arena.getNode(self._arena.getRight(self._handle))
+
+    def getValue(self):
+        return self._arena.getValue(self._handle)
+
+    def setLeft(self, ast):
+        self._arena.setLeft(self._handle, NIL if ast is None else ast.getHandle())
+
+    def setRight(self, ast):
+        self._arena.setRight(self._handle, NIL if ast is None else ast.getHandle())
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaAST) and \
+               self._arena is other._arena and self._handle == other._handle
+
+    def __hash__(self):
+        return hash((id(self._arena), self._handle))
+
+    __str__ = AST.__str__
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return AST of while program defined in file at path (or given as bytes/
+memoryview, as for get_AST), stored in a new ASTArena; returns root ArenaAST
+--------------------------------------------------------------------------- '''
+def get_compact_AST(path):
+    arena = ASTArena()
+    with _load(path) as wp:
+        return _generate_AST(wp, arena.newNode)
+
+''' ---------------------------------------------------------------------------
+Return copy of AST (object tree) stored in a new ASTArena, as root ArenaAST;
+handles are in preorder, so a copy of a fresh get_AST tree has its node IDs
+--------------------------------------------------------------------------- '''
+def pack_AST(ast):
+    arena = ASTArena()
+
+    # Add node before its children (so handles are numbered as get_AST numbers
+    # node IDs), then link it to them
+    def _add(node):
+        return arena.add(node.getValue())
+
+    def _link(node, handle, handles):
+        if node.getLeft():
+            arena.setLeft(handle, handles.pop(0))
+        if node.getRight():
+            arena.setRight(handle, handles.pop(0))
+        return handle
+
+    return arena.getNode(walk(ast, ast_children, _add, _link))
@@ -9,6 +9,8 @@ Provides functionality for converting from an CFG (as defined in cfg.py)
 to an AST
 =========================================================================== """
 from lib import *
+from contextlib import contextmanager
+import mmap
 
 
 """ ======================================================================= """
@@ -44,79 +46,176 @@ class AST():
         self._right = ast
 
     def __str__(self, depth=0):
-        ret = ""
-
-        # Print right AST
-        if self._right != None:
-            ret += self._right.__str__(depth + 1)
-
-        # Print own value
-        ret += "\n" + ("         "*depth) + str(self._value)
-
-        # Print left AST
-        if self._left != None:
-            ret += self._left.__str__(depth + 1)
-
-        return ret
+        ret = []
+
+        # Right AST, own value, then left AST; explicit stack (deep ASTs)
+        stack = [(self, depth, False)]
+        while stack:
+            ast, depth, printed_children = stack.pop()
+            if printed_children:
+                # Print own value
+                ret.append("\n" + ("         "*depth) + str(ast.getValue()))
+                continue
+
+            # Pushed in reverse: right AST is popped (printed) first
+            if ast.getLeft() != None:
+                stack.append((ast.getLeft(), depth + 1, False))
+            stack.append((ast, depth, True))
+            if ast.getRight() != None:
+                stack.append((ast.getRight(), depth + 1, False))
+
+        return "".join(ret)
 
 ''' ---------------------------------------------------------------------------
-Return flattened string of while program defined in file at path f
+Yield read-only buffer of while program source; source is either a file path,
+which is memory-mapped (never read into memory as a whole), or a bytes-like
+object (bytes, bytearray, memoryview), which is used as is
 --------------------------------------------------------------------------- '''
-def _flatten(path):
-    return ''.join(open(path, 'r').read().split())
+@contextmanager
+def _load(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield source
+        return
+
+    with open(source, 'rb') as f:
+        # Empty files cannot be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
 
 ''' ---------------------------------------------------------------------------
-Return AST object defined by well-formed while program in while_str
---------------------------------------------------------------------------- '''
-def _generate_AST(wp):
-    val = header(wp)
-    ast = AST(val)
-
-    # LOOP(STMT)
-    if (val == LOOP):
-        ast.setLeft(_generate_AST(body(wp)))
-    
-    # AMB(LSTMT, RSTMT) / SEQ(LSTMT, RSTMT)
-    elif (val in [AMB, SEQ]):
-        ast.setLeft(_generate_AST(lbody(wp)))
-        ast.setRight(_generate_AST(rbody(wp)))
+Return AST object defined by the statement at the head of token stream toks;
+consumes exactly the tokens of that statement (e.g. SEQ(...)) - O(n) overall
 
-    # ASSUME(EXPR)
-    elif (val == ASSUME):
-        ast.setLeft(_EXPR_to_AST(body(wp)))
+Statements are nested with an explicit stack of open SEQ/ AMB/ LOOP nodes
+(not recursion), so nesting depth is bounded only by memory
 
-    # ASSIGN(VAR, EXPR)
-    elif (val == ASSIGN):
-        ast.setLeft(_EXPR_to_AST(lbody(wp)))
-        ast.setRight(_EXPR_to_AST(rbody(wp)))
+Nodes are created by make(value) (AST by default), and linked with their
+setLeft/ setRight
+--------------------------------------------------------------------------- '''
+def _parse_stmt(toks, make=AST):
+    root  = None
+    stack = [] # [ast, number of children, children parsed] per open statement
+
+    while True:
+        val = toks.expect(TOK_ATOM)
+        ast = make(val)
+        toks.expect(TOK_LPAREN)
+
+        # Attach to the open parent statement as its next child
+        if stack:
+            parent = stack[-1]
+            if parent[2] == 0:
+                parent[0].setLeft(ast)
+            else:
+                parent[0].setRight(ast)
+            parent[2] += 1
+        else:
+            root = ast
+
+        # LOOP(STMT); parse STMT next
+        if (val == LOOP):
+            stack.append([ast, 1, 0])
+            continue
+
+        # AMB(LSTMT, RSTMT) / SEQ(LSTMT, RSTMT); parse LSTMT next
+        elif (val in [AMB, SEQ]):
+            stack.append([ast, 2, 0])
+            continue
+
+        # ASSUME(EXPR)
+        elif (val == ASSUME):
+            ast.setLeft(_parse_expr(toks, make))
+
+        # ASSIGN(VAR, EXPR)
+        elif (val == ASSIGN):
+            ast.setLeft(_parse_expr(toks, make))
+            toks.expect(TOK_COMMA)
+            ast.setRight(_parse_expr(toks, make))
+
+        else:
+            raise ValueError("Encountered unsupported atom: " + val)
+
+        # Close this statement, and every open parent that is now complete
+        toks.expect(TOK_RPAREN)
+        while stack and stack[-1][2] == stack[-1][1]:
+            stack.pop()
+            toks.expect(TOK_RPAREN)
+
+        if not stack:
+            return root
+
+        # Parent still needs RSTMT
+        toks.expect(TOK_COMMA)
 
+''' ---------------------------------------------------------------------------
+Return AST object defined by the expression at the head of token stream toks:
+    NOT(EXPR) | (EXPR) | ATOM | ATOM BI_EXPR ATOM
+Nodes are created by make(value), as in _parse_stmt
+--------------------------------------------------------------------------- '''
+def _parse_expr(toks, make=AST):
+    root   = None
+    parent = None # Innermost NOT
+    groups = 0    # Number of open parentheses to close after the atoms
+
+    # NOT(...) and (...) wrappers; e.g. "(b == c)" from get_assignment_stmt
+    while True:
+        kind, val, _ = toks.peek()
+        if kind == TOK_ATOM and val == NOT:
+            toks.next()
+            toks.expect(TOK_LPAREN)
+            ast = make(NOT)
+        elif kind == TOK_LPAREN:
+            toks.next()
+            groups += 1
+            continue
+        else:
+            break
+
+        if parent:
+            parent.setLeft(ast)
+        else:
+            root = ast
+        parent = ast
+        groups += 1
+
+    # Sub expressions of a BI_EXPR are atomic (e.g. a==b)
+    lhs = toks.expect(TOK_ATOM)
+    if toks.peek()[0] != TOK_OP:
+        ast = make(lhs) # Constant or TRUE/ FALSE
     else:
-        raise ValueError("Encountered unsupported atom: " + val)
+        ast = make(toks.expect(TOK_OP))
+        ast.setLeft(make(lhs))
+        ast.setRight(make(toks.expect(TOK_ATOM)))
+
+    for _ in range(groups):
+        toks.expect(TOK_RPAREN)
 
+    if parent:
+        parent.setLeft(ast)
+        return root
     return ast
 
+''' ---------------------------------------------------------------------------
+Return AST object defined by well-formed while program wp (str or bytes-like);
+nodes are created by make(value), as in _parse_stmt
+--------------------------------------------------------------------------- '''
+def _generate_AST(wp, make=AST):
+    toks = TokenStream(wp)
+    ast  = _parse_stmt(toks, make)
+    toks.expect(TOK_EOF)
+    return ast
 
 ''' ---------------------------------------------------------------------------
 Return AST object defined by well-formed expression (e.g. a==b)
 --------------------------------------------------------------------------- '''
 def _EXPR_to_AST(expr):
-
-    # Check if it's just NOT
-    if (header(expr) == NOT):
-        ast = AST(header(expr))
-        ast.setLeft(_EXPR_to_AST(body(expr)))
-        return ast
-
-    # Try splitting by all BI_EXPRS; MUST BE A SIMPLE EXPRESSION (e.g. a==b)
-    for bexp in BI_EXPRS:
-        sides = expr.split(bexp)
-        if (len(sides) == 2):
-            ast = AST(bexp)
-            ast.setLeft(_EXPR_to_AST(sides[0]))
-            ast.setRight(_EXPR_to_AST(sides[1]))
-            return ast
-    
-    return AST(expr) # Constant or TRUE/ FALSE
+    toks = TokenStream(expr)
+    ast  = _parse_expr(toks)
+    toks.expect(TOK_EOF)
+    return ast
 
 
 """ ======================================================================= """
@@ -168,19 +267,21 @@ Given ASSUME AST; return assumption string "EXPR"
 def get_assumption_stmt(ast):
     assert ast.getValue() in [ASSUME, NOT]
 
+    # ASSUME(NOT(...)) <=> NOT(ASSUME(...))
+    nots     = 0
     expr_ast = ast.getLeft()
+    while expr_ast.getValue() == NOT:
+        nots    += 1
+        expr_ast = expr_ast.getLeft()
     expr     = expr_ast.getValue() 
 
-    if expr == NOT:
-        # ASSUME(NOT(...)) <=> NOT(ASSUME(...))
-        return expr + "(" + get_assumption_stmt(expr_ast) + ")"
-
-    elif expr in BI_EXPRS:
+    if expr in BI_EXPRS:
         # Sub expressions a,b (e.g. a == b) must be atomic
         # ... (e.g. { NOT(a) == b } should be rewritten to { a != b })
-        return expr_ast.getLeft().getValue() + " " + expr + " " + expr_ast.getRight().getValue() 
+        expr = expr_ast.getLeft().getValue() + " " + expr + " " + expr_ast.getRight().getValue() 
 
-    return expr # TRUE | FALSE | Boolean var
+    # TRUE | FALSE | Boolean var | a == b
+    return (NOT + "(") * nots + expr + ")" * nots
 
 ''' ---------------------------------------------------------------------------
 Given assumption string "EXPR"; return ASSUME AST
@@ -191,8 +292,36 @@ def get_assumption_ast(stmt):
     return ast
 
 ''' ---------------------------------------------------------------------------
-Return AST of while program defined in file at path f
+Return ast with structurally equal sub-trees shared (hash-consing): each is
+replaced by one canonical node from table (value, left, right) -> AST, so the
+result is a DAG; nodes are relinked in place, so do not modify ast afterwards
+--------------------------------------------------------------------------- '''
+def hash_cons(ast, table=None):
+    if table is None:
+        table = {}
+
+    # Children are canonical by now; so are compared by identity
+    def _intern(node, state, children):
+        left  = children.pop(0) if node.getLeft()  else None
+        right = children.pop(0) if node.getRight() else None
+        key   = (node.getValue(), left, right)
+        canon = table.get(key)
+        if canon is None:
+            node.setLeft(left)
+            node.setRight(right)
+            canon = table[key] = node
+        return canon
+
+    return walk(ast, ast_children, leave=_intern)
+
+''' ---------------------------------------------------------------------------
+Return AST of while program defined in file at path; path may instead be the
+program source itself, as bytes/ memoryview
+
+Node IDs come from context ctx (see PipelineContext); by default the shared
+context, reset first
 --------------------------------------------------------------------------- '''
-def get_AST(path):
-    resetNodeID() # Ensure unique node ID for each node
-    return _generate_AST(_flatten(path))
\ No newline at end of file
+def get_AST(path, ctx=None):
+    with pipeline_stage(ctx, reset_ids=True): # Ensure unique node ID for each node
+        with _load(path) as wp:
+            return _generate_AST(wp)
\ No newline at end of file
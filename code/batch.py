@@ -0,0 +1,370 @@
+""" ===========================================================================
+File   : batch.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Runs the pipeline (get_AST -> get_CFG -> normalize_ast) over a corpus of While
+program files, in parallel:
+    - Inputs are found by glob pattern (** recurses), or listed in manifest
+      files (@manifest; one path or pattern per line, relative to it)
+    - Programs are sent to a pool of processes in chunks; each is parsed once,
+      and its AST reused by the later stages (in its own PipelineContext)
+    - One JSON line per program is written as its chunk completes; its path
+      (absolute, and relative to the corpus root), stage times, sizes and a
+      digest of the normalized AST, or the failing stage and its error
+    - Throughput and p50/ p99 latency per stage are reported at the end
+
+A corpus can be split across machines (sharing only a filesystem): with
+--shard i/N, a run takes only the programs whose stable hash (of their path
+relative to the corpus root, so the same wherever the corpus is mounted; or of
+their content) is i mod N, and writes results.shard-i-of-N.jsonl (and its
+.stats.json); --merge N then combines the N shards into one result file and
+report, matching programs by path relative to the corpus root
+
+Usage:
+> python3 batch.py [-o results.jsonl] [-j workers] [--chunk-size n]
+                   [--shard i/N [--shard-by path|content]] inputs...
+> python3 batch.py -o results.jsonl --merge N
+=========================================================================== """
+from lib import *
+from ast import *
+from cfg import *
+from norm import *
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+import argparse
+import glob
+import hashlib
+import json
+import re
+import time
+
+
+# Pipeline stages timed for each program, in order
+STAGES = ["parse", "cfg", "normalize"]
+
+# Program keys to shard by
+SHARD_KEYS = ["path", "content"]
+
+# Glob wildcards
+GLOB_MAGIC = re.compile("[*?[]")
+
+""" ======================================================================= """
+""" ==================     PRIVATE FUNCTIONS      ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return paths matched by glob pattern (** recurses); a pattern starting with
+@ names a manifest, whose lines (blank lines and # comments skipped) are
+patterns relative to the manifest's folder
+--------------------------------------------------------------------------- '''
+def _expand(pattern):
+    if not pattern.startswith("@"):
+        return [p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)]
+
+    manifest = pattern[1:]
+    folder   = os.path.dirname(manifest)
+    paths    = []
+    with open(manifest) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.extend(_expand(os.path.join(folder, line)))
+    return paths
+
+''' ---------------------------------------------------------------------------
+Return (absolute) folder pattern is relative to; the manifest's folder for
+@manifest, else the longest prefix of the glob pattern without wildcards
+--------------------------------------------------------------------------- '''
+def _pattern_root(pattern):
+    if pattern.startswith("@"):
+        return os.path.dirname(os.path.abspath(pattern[1:]))
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if GLOB_MAGIC.search(part):
+            break
+        parts.append(part)
+    return os.path.abspath(os.sep.join(parts) or os.curdir)
+
+''' ---------------------------------------------------------------------------
+Return digest of (normalized) AST; of its printed form, so independent of
+node IDs
+--------------------------------------------------------------------------- '''
+def _digest(ast):
+    return hashlib.sha1(str(ast).encode("utf-8")).hexdigest()
+
+''' ---------------------------------------------------------------------------
+Run the pipeline on program file path; return its result record, keyed by
+its path (and by its path relative to folder root; see _relative_path). A
+failure (of any kind) is recorded with the stage it happened in, and does not
+stop the batch
+--------------------------------------------------------------------------- '''
+def _run_program(path, emit_ast=False, root=os.sep):
+    ctx    = PipelineContext(verbose=False)
+    record = {"path": path, "relpath": _relative_path(path, root), "ok": True, "times": {}}
+    times  = record["times"]
+    stage  = STAGES[0]
+    try:
+        start = time.perf_counter()
+        ast = get_AST(path, ctx)
+
+        stage = "cfg"
+        times["parse"] = time.perf_counter() - start
+        start = time.perf_counter()
+        cfg = get_CFG(ast, ctx=ctx)
+
+        stage = "normalize"
+        times["cfg"] = time.perf_counter() - start
+        start = time.perf_counter()
+        n_ast = normalize_ast(ast, ctx=ctx)
+        times["normalize"] = time.perf_counter() - start
+
+        record["cfg_nodes"] = len(cfg.getNodes())
+        record["cfg_edges"] = len(cfg.getEdgeSet())
+        record["digest"]    = _digest(n_ast)
+        if emit_ast:
+            record["normalized"] = str(n_ast)
+    except Exception as e:
+        record["ok"]    = False
+        record["stage"] = stage
+        record["error"] = type(e).__name__ + ": " + str(e)
+    return record
+
+''' ---------------------------------------------------------------------------
+Run the pipeline on each program file in paths (one chunk); return their
+result records, in order
+--------------------------------------------------------------------------- '''
+def _run_chunk(paths, emit_ast=False, root=os.sep):
+    return [_run_program(path, emit_ast, root) for path in paths]
+
+# Return path relative to folder root, with / separators; the same wherever
+# the corpus is mounted, and on every OS
+def _relative_path(path, root):
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+# Return default corpus root of paths; their common folder
+def _common_root(paths):
+    return os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else os.sep
+
+''' ---------------------------------------------------------------------------
+Return stable hash (int) of program file path; of the path relative to folder
+root (see _relative_path), or (by content) of the file's bytes. Unlike hash,
+the same on every machine and run
+--------------------------------------------------------------------------- '''
+def _shard_hash(path, by="path", root=os.sep):
+    h = hashlib.sha1()
+    if by == "path":
+        h.update(_relative_path(path, root).encode("utf-8"))
+    elif by == "content":
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                h.update(block)
+    else:
+        raise ValueError("Unsupported shard key: " + str(by))
+    return int(h.hexdigest()[:16], 16)
+
+# Return statistics file path of result file out_path
+def _stats_path(out_path):
+    return os.path.splitext(out_path)[0] + ".stats.json"
+
+''' ---------------------------------------------------------------------------
+Return q-th percentile (0 - 100) of sorted values; nearest rank
+--------------------------------------------------------------------------- '''
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    rank = max(1, -(-q * len(values) // 100)) # ceil(q/100 * n)
+    return values[int(rank) - 1]
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return sorted, de-duplicated (absolute) program paths matched by given
+patterns (see _expand)
+--------------------------------------------------------------------------- '''
+def discover(patterns):
+    return sorted(set(os.path.abspath(p) for pattern in patterns for p in _expand(pattern)))
+
+''' ---------------------------------------------------------------------------
+Return corpus root of given patterns (see discover); the common folder of
+their globs' fixed prefixes and manifests' folders. Sharding by path hashes
+paths relative to it
+--------------------------------------------------------------------------- '''
+def corpus_root(patterns):
+    return os.path.commonpath([_pattern_root(pattern) for pattern in patterns])
+
+''' ---------------------------------------------------------------------------
+Return (i, N) of shard spec "i/N"; 0 <= i < N
+--------------------------------------------------------------------------- '''
+def parse_shard(spec):
+    try:
+        shard, num_shards = [int(part) for part in spec.split("/")]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N: " + spec)
+    if not 0 <= shard < num_shards:
+        raise ValueError("Shard index must be in [0, N): " + spec)
+    return shard, num_shards
+
+''' ---------------------------------------------------------------------------
+Return paths (in order) assigned to shard i of num_shards, by stable hash of
+their key (see _shard_hash); every path is in exactly one shard. Paths are
+keyed relative to folder root (e.g. corpus_root of the patterns that found
+them); by default, their common folder
+--------------------------------------------------------------------------- '''
+def select_shard(paths, shard, num_shards, by="path", root=None):
+    if root is None:
+        root = _common_root(paths)
+    return [p for p in paths if _shard_hash(p, by, root) % num_shards == shard]
+
+''' ---------------------------------------------------------------------------
+Return result file path of shard i of num_shards, for result file out_path
+(e.g. results.jsonl -> results.shard-0-of-4.jsonl)
+--------------------------------------------------------------------------- '''
+def shard_path(out_path, shard, num_shards):
+    root, ext = os.path.splitext(out_path)
+    return root + ".shard-" + str(shard) + "-of-" + str(num_shards) + ext
+
+''' ---------------------------------------------------------------------------
+Return batch statistics of result records, over elapsed seconds (wall):
+throughput, and p50/ p99 latency (ms) of each stage, over programs that
+reached it
+--------------------------------------------------------------------------- '''
+def summarize(records, elapsed):
+    times = {stage: [] for stage in STAGES}
+    failed = 0
+    for record in records:
+        failed += not record["ok"]
+        for stage, t in record["times"].items():
+            times[stage].append(t * 1000)
+
+    stats = {"programs": len(records), "failed": failed, "seconds": elapsed,
+             "programs_per_sec": len(records) / elapsed if elapsed > 0 else 0.0,
+             "stages": {}}
+    for stage in STAGES:
+        values = sorted(times[stage])
+        stats["stages"][stage] = {"count": len(values),
+                                  "p50_ms": _percentile(values, 50),
+                                  "p99_ms": _percentile(values, 99)}
+    return stats
+
+''' ---------------------------------------------------------------------------
+Run the pipeline on each program file in paths, with a pool of workers
+processes (None: one per CPU; 1: in this process), chunk_size programs at a
+time; write a JSON line per program to out_path as results arrive (in
+completion order). Records hold each path relative to folder root (e.g.
+corpus_root of the patterns that found them; by default, their common folder)
+as "relpath". With emit_ast, records hold the normalized AST as printed.
+Return batch statistics (see summarize)
+--------------------------------------------------------------------------- '''
+def run_batch(paths, out_path, workers=None, chunk_size=16, emit_ast=False, root=None):
+    root    = _common_root(paths) if root is None else root
+    chunks  = [paths[i : i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    summary = [] # Records without their (large) results, for the statistics
+    start   = time.perf_counter()
+
+    with open(out_path, "w") as out:
+        def _write(records):
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+                summary.append({"ok": record["ok"], "times": record["times"]})
+            out.flush()
+
+        if workers == 1:
+            for chunk in chunks:
+                _write(_run_chunk(chunk, emit_ast, root))
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(_run_chunk, chunk, emit_ast, root) for chunk in chunks]
+                for future in as_completed(futures):
+                    _write(future.result())
+
+    stats = summarize(summary, time.perf_counter() - start)
+    with open(_stats_path(out_path), "w") as f:
+        json.dump(stats, f)
+    return stats
+
+''' ---------------------------------------------------------------------------
+Combine the result files of all num_shards shards of out_path (see
+shard_path) into out_path; return statistics of the whole batch. The shards
+are taken to have run side by side, so its time is that of the slowest one.
+Programs are matched across shards by corpus-relative path ("relpath"), as
+machines may mount the corpus at different folders
+--------------------------------------------------------------------------- '''
+def merge_shards(out_path, num_shards):
+    shards = [shard_path(out_path, i, num_shards) for i in range(num_shards)]
+    missing = [p for p in shards if not os.path.exists(_stats_path(p))]
+    if missing:
+        raise ValueError("Missing shard results: " + ", ".join(missing))
+
+    summary = []
+    seen    = set()
+    elapsed = 0.0
+    with open(out_path, "w") as out:
+        for path in shards:
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["relpath"] in seen:
+                        raise ValueError("Program in more than one shard: " + record["relpath"])
+                    seen.add(record["relpath"])
+                    out.write(line)
+                    summary.append({"ok": record["ok"], "times": record["times"]})
+            with open(_stats_path(path)) as f:
+                elapsed = max(elapsed, json.load(f)["seconds"])
+
+    stats = summarize(summary, elapsed)
+    stats["shards"] = num_shards
+    with open(_stats_path(out_path), "w") as f:
+        json.dump(stats, f)
+    return stats
+
+''' ---------------------------------------------------------------------------
+Print batch statistics (see summarize)
+--------------------------------------------------------------------------- '''
+def print_report(stats):
+    print("\nPrograms: %d (%d failed) in %.2f s; %.1f programs/s" % \
+          (stats["programs"], stats["failed"], stats["seconds"], stats["programs_per_sec"]))
+    if "shards" in stats:
+        print("Merged from %d shards" % stats["shards"])
+    print("%10s %10s %10s %10s" % ("stage", "count", "p50 ms", "p99 ms"))
+    for stage in STAGES:
+        s = stats["stages"][stage]
+        print("%10s %10d %10.3f %10.3f" % (stage, s["count"], s["p50_ms"], s["p99_ms"]))
+
+''' ---------------------------------------------------------------------------
+Run batch command with given arguments (see header); return exit status
+--------------------------------------------------------------------------- '''
+def main(argv):
+    parser = argparse.ArgumentParser(description="Normalize a corpus of While programs")
+    parser.add_argument("inputs", nargs="*", help="glob patterns, or @manifest files")
+    parser.add_argument("-o", "--output", default="batch.jsonl", help="JSON lines result file")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="programs per task")
+    parser.add_argument("--emit-ast", action="store_true", help="write normalized ASTs to results")
+    parser.add_argument("--shard", help="run only shard i of N (i/N)")
+    parser.add_argument("--shard-by", choices=SHARD_KEYS, default="path", help="program key to shard by")
+    parser.add_argument("--merge", type=int, metavar="N", help="merge the results of N shards")
+    args = parser.parse_args(argv)
+
+    out_path = args.output
+    if args.merge:
+        stats = merge_shards(out_path, args.merge)
+    else:
+        paths = discover(args.inputs)
+        if not paths:
+            print("No programs found")
+            return 1
+        root = corpus_root(args.inputs)
+        if args.shard: # Run (and record) the shard, even if it is left empty
+            shard, num_shards = parse_shard(args.shard)
+            paths    = select_shard(paths, shard, num_shards, args.shard_by, root)
+            out_path = shard_path(out_path, shard, num_shards)
+        stats = run_batch(paths, out_path, args.workers, args.chunk_size, args.emit_ast, root)
+    print_report(stats)
+    print("\nResults saved to " + out_path)
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,393 @@
+""" ===========================================================================
+File   : bench.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Benchmarks the pipeline on generated While programs of growing size:
+- Parsing : time per statement should stay flat as programs grow (linear)
+- Loading : extra memory to scan a program file should not grow with its size
+- Pipeline: per-stage time on deeply nested (SEQ chain) programs
+- AST size: memory held by an AST object tree vs. an ASTArena
+- Sharing : AST memory and CFG build time, with and without hash-consing
+- CFG     : CFG build and normalization time per edge should stay flat
+- Sites   : normalization time per nested LOOP block should stay flat
+- Direct  : normalization via the CFG vs. directly on the AST
+- Frozen  : reachability and SCCs on a FrozenCFG vs. walking CFG Node objects
+- Dominators: dominator/ post-dominator trees and loop forest time per edge
+  should stay flat, up to ~10^6 edges
+=========================================================================== """
+from lib import *
+from ast import *
+from ast import _generate_AST
+from ast import _load
+from cfg import *
+from conv import *
+from norm import *
+from arena import *
+from csr import *
+from dom import *
+import contextlib
+import io
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+""" ======================================================================= """
+""" ==================     PROGRAM GENERATION     ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return i-th generated atomic statement; alternates ASSIGN and ASSUME
+--------------------------------------------------------------------------- '''
+def _gen_stmt(i):
+    if i % 2 == 0:
+        return "ASSIGN(v" + str(i % 7) + ", " + str(i) + ")"
+    return "ASSUME(v" + str(i % 7) + " != " + str(i) + ")"
+
+''' ---------------------------------------------------------------------------
+Return while program string with n statements, nested as a right-leaning SEQ
+chain (depth n); every loop_every-th statement is a LOOP, and every
+amb_every-th an AMB (0 for none)
+--------------------------------------------------------------------------- '''
+def gen_chain_program(n, loop_every=0, amb_every=0):
+    stmts = []
+    for i in range(n):
+        if loop_every and i % loop_every == loop_every // 2:
+            stmts.append("LOOP(SEQ(ASSUME(a != " + str(i) + "), " + _gen_stmt(i) + "))")
+        elif amb_every and i % amb_every == amb_every - 1:
+            stmts.append("AMB(" + _gen_stmt(i) + ", " + _gen_stmt(i + 1) + ")")
+        else:
+            stmts.append(_gen_stmt(i))
+    return "".join("SEQ(" + stmt + ",\n" for stmt in stmts[:-1]) + stmts[-1] + \
+           ")" * (n - 1)
+
+''' ---------------------------------------------------------------------------
+Return while program string of n LOOPs in a SEQ chain, whose bodies are drawn
+from a pool of only `distinct` (guard, assignments) subprograms
+--------------------------------------------------------------------------- '''
+def gen_repetitive_program(n, distinct=4):
+    stmts = ["ASSIGN(a, 0)"] # LOOP nodes need a predecessor
+    for i in range(n):
+        k = str(i % distinct)
+        stmts.append("LOOP(SEQ(ASSUME(a != " + k + "), SEQ(ASSIGN(b, " + k + \
+                     "), SEQ(ASSIGN(c, b), AMB(ASSIGN(d, " + k + "), ASSUME(d == c))))))")
+    return "".join("SEQ(" + stmt + ",\n" for stmt in stmts[:-1]) + stmts[-1] + \
+           ")" * n
+
+''' ---------------------------------------------------------------------------
+Return while program string of n blocks in a SEQ chain; each block is LOOPs
+nested depth deep, with statements before and after each inner LOOP
+--------------------------------------------------------------------------- '''
+def gen_nested_loop_program(n, depth=2):
+    stmts = ["ASSIGN(a, 0)"] # LOOP nodes need a predecessor
+    for i in range(n):
+        k     = str(i)
+        block = "ASSIGN(c, " + k + ")"
+        for d in range(depth):
+            block = "LOOP(SEQ(ASSUME(a != " + str(d) + "), SEQ(ASSIGN(b, " + k + \
+                    "), SEQ(" + block + ", ASSIGN(d, " + k + ")))))"
+        stmts.extend([block, "ASSIGN(g, " + k + ")"]) # LOOPs need a successor
+    return "".join("SEQ(" + stmt + ",\n" for stmt in stmts[:-1]) + stmts[-1] + \
+           ")" * (len(stmts) - 1)
+
+''' ---------------------------------------------------------------------------
+Return while program string nested depth deep, alternating LOOPs (with the
+rest nested between two statements) and AMBs (with the rest on one branch
+only, so that branch alone holds LOOPs)
+--------------------------------------------------------------------------- '''
+def gen_mixed_nesting_program(depth):
+    stmt = "ASSIGN(c, 0)"
+    for d in range(depth):
+        k = str(d)
+        if d % 2 == 0:
+            stmt = "LOOP(SEQ(ASSUME(a != " + k + "), SEQ(" + stmt + ", ASSIGN(b, " + k + "))))"
+        else:
+            stmt = "AMB(SEQ(ASSIGN(a, " + k + "), " + stmt + "), ASSUME(b == " + k + "))"
+    return "SEQ(ASSIGN(a, 0), SEQ(" + stmt + ", ASSIGN(e, 0)))"
+
+''' ---------------------------------------------------------------------------
+Return while program string with n statements, nested as a balanced SEQ tree
+(depth log n)
+--------------------------------------------------------------------------- '''
+def gen_balanced_program(n, start=0):
+    if n == 1:
+        return _gen_stmt(start)
+    half = n // 2
+    return "SEQ(" + gen_balanced_program(half, start) + ",\n" + \
+           gen_balanced_program(n - half, start + half) + ")"
+
+''' ---------------------------------------------------------------------------
+Return random while program string (choices from rng, a random.Random) nested
+at most depth deep; over variables a, b, c and constants 0 to 2, so it has
+few reachable states
+--------------------------------------------------------------------------- '''
+def gen_random_program(rng, depth):
+    if depth == 0 or rng.random() < 0.25:
+        var = rng.choice("abc")
+        val = rng.choice(["0", "1", "2", rng.choice("abc")])
+        if rng.random() < 0.5:
+            return "ASSIGN(" + var + ", " + val + ")"
+        return "ASSUME(" + var + " " + rng.choice([EQ, NEQ, LT, GEQ]) + " " + val + ")"
+
+    stmt = rng.choice([SEQ, SEQ, AMB, LOOP])
+    if stmt == LOOP:
+        return "LOOP(" + gen_random_program(rng, depth - 1) + ")"
+    return stmt + "(" + gen_random_program(rng, depth - 1) + ", " + \
+           gen_random_program(rng, depth - 1) + ")"
+
+""" ======================================================================= """
+""" ==================     BENCHMARKS             ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return best wall time (seconds) of repeat calls to fn(); like timeit, the
+cyclic garbage collector is paused so it does not skew large runs
+--------------------------------------------------------------------------- '''
+def _time(fn, repeat=3):
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best
+
+''' ---------------------------------------------------------------------------
+Parse generated programs of doubling size; print time per statement
+--------------------------------------------------------------------------- '''
+def bench_parse(sizes=[1000, 2000, 4000, 8000, 16000, 32000, 64000]):
+    print("\nParse time [_generate_AST]")
+    print("%10s %12s %14s" % ("stmts", "seconds", "us/stmt"))
+    for n in sizes:
+        wp = gen_balanced_program(n)
+        t  = _time(lambda: _generate_AST(wp))
+        print("%10d %12.4f %14.3f" % (n, t, t * 1e6 / n))
+
+''' ---------------------------------------------------------------------------
+Tokenize generated program files of doubling size straight from disk; print
+peak memory allocated while scanning, which should stay flat
+--------------------------------------------------------------------------- '''
+def bench_load(sizes=[10000, 40000, 160000, 640000]):
+    print("\nLoad + tokenize peak memory [_load, tokenize]")
+    print("%10s %12s %14s" % ("stmts", "file KiB", "peak KiB"))
+    for n in sizes:
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(gen_balanced_program(n))
+
+            tracemalloc.start()
+            with _load(path) as wp:
+                for _ in tokenize(wp):
+                    pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print("%10d %12d %14.1f" % (n, os.path.getsize(path) // 1024, peak / 1024))
+        finally:
+            os.remove(path)
+
+''' ---------------------------------------------------------------------------
+Run each pipeline stage on SEQ chains of doubling depth; print time per
+statement for each stage
+--------------------------------------------------------------------------- '''
+def bench_pipeline(sizes=[2000, 8000, 32000, 128000]):
+    print("\nPipeline time per stmt (us) on SEQ chains [get_AST, get_CFG, to_ast]")
+    print("%10s %10s %10s %10s" % ("stmts", "parse", "cfg", "to_ast"))
+    for n in sizes:
+        wp   = gen_chain_program(n, loop_every=100, amb_every=50).encode()
+        ast  = get_AST(wp)
+        cfg  = get_CFG(ast)
+        t_parse = _time(lambda: get_AST(wp))
+        t_cfg   = _time(lambda: get_CFG(ast))
+        t_conv  = _time(lambda: to_ast(cfg))
+        print("%10d %10.2f %10.2f %10.2f" % \
+              (n, t_parse * 1e6 / n, t_cfg * 1e6 / n, t_conv * 1e6 / n))
+
+''' ---------------------------------------------------------------------------
+Return (result of fn(), bytes allocated by fn() that are still held)
+--------------------------------------------------------------------------- '''
+def _retained(fn):
+    tracemalloc.start()
+    result = fn()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held
+
+''' ---------------------------------------------------------------------------
+Parse generated programs into AST objects and into an ASTArena; print memory
+held per AST node by each
+--------------------------------------------------------------------------- '''
+def bench_ast_memory(sizes=[10000, 40000, 160000]):
+    print("\nAST memory per node (bytes) [get_AST vs get_compact_AST]")
+    print("%10s %10s %10s %10s" % ("stmts", "nodes", "AST", "arena"))
+    for n in sizes:
+        wp = gen_balanced_program(n).encode()
+        root, tree_bytes = _retained(lambda: get_AST(wp))
+        del root
+        root, arena_bytes = _retained(lambda: get_compact_AST(wp))
+        nodes = len(root.getArena())
+        print("%10d %10d %10.1f %10.1f" % \
+              (n, nodes, tree_bytes / nodes, arena_bytes / nodes))
+
+''' ---------------------------------------------------------------------------
+Parse repetitive programs; print memory held by the AST before and after
+hash-consing, and CFG build time without and with memoized sub-CFGs; check the
+memoized build is at least min_speedup times faster (copying a template must
+beat rebuilding the sub-CFG)
+--------------------------------------------------------------------------- '''
+def bench_hash_cons(sizes=[1000, 4000, 16000], min_speedup=1.1):
+    print("\nRepetitive programs [hash_cons, get_CFG(memoize=True)]")
+    print("%10s %12s %12s %12s %12s %8s" % \
+          ("loops", "AST KiB", "shared KiB", "cfg s", "memo cfg s", "speedup"))
+    for n in sizes:
+        wp = gen_repetitive_program(n).encode()
+        ast, tree_bytes = _retained(lambda: get_AST(wp))
+        del ast
+        ast, dag_bytes  = _retained(lambda: hash_cons(get_AST(wp)))
+        t_cfg  = _time(lambda: get_CFG(ast))
+        t_memo = _time(lambda: get_CFG(ast, memoize=True))
+        print("%10d %12d %12d %12.4f %12.4f %8.2f" % \
+              (n, tree_bytes // 1024, dag_bytes // 1024, t_cfg, t_memo, t_cfg / t_memo))
+        assert t_cfg >= min_speedup * t_memo, "Memoized CFG build is no faster than a rebuild"
+
+''' ---------------------------------------------------------------------------
+Build and normalize CFGs of SEQ chains of doubling length (with a fixed number
+of LOOPs); print time per edge of each
+--------------------------------------------------------------------------- '''
+def bench_cfg_scaling(sizes=[4000, 16000, 64000], num_loops=8):
+    print("\nCFG time per edge (us) [get_CFG, normalize_ast]")
+    print("%10s %10s %10s %10s" % ("stmts", "edges", "cfg", "normalize"))
+    for n in sizes:
+        ast   = get_AST(gen_chain_program(n, loop_every=n // num_loops).encode())
+        edges = len(get_CFG(ast).getEdgeSet())
+        t_cfg = _time(lambda: get_CFG(ast))
+        with contextlib.redirect_stdout(io.StringIO()): # Silence progress
+            t_norm = _time(lambda: normalize_ast(ast), repeat=1)
+        print("%10d %10d %10.2f %10.2f" % \
+              (n, edges, t_cfg * 1e6 / edges, t_norm * 1e6 / edges))
+
+''' ---------------------------------------------------------------------------
+Return set of CFG nodes reachable from cfg's entry, following Node objects
+--------------------------------------------------------------------------- '''
+def _reachable_nodes(cfg):
+    seen  = set([cfg.getEntryNode()])
+    stack = [cfg.getEntryNode()]
+    while stack:
+        for e in stack.pop().getOutgoingEdges():
+            if e.getEndpoint() not in seen:
+                seen.add(e.getEndpoint())
+                stack.append(e.getEndpoint())
+    return seen
+
+''' ---------------------------------------------------------------------------
+Freeze CFGs of SEQ chains of doubling length; print freeze time, and
+reachability time on the CFG objects vs. the snapshot, and SCC time
+--------------------------------------------------------------------------- '''
+def bench_frozen_cfg(sizes=[4000, 16000, 64000]):
+    print("\nFrozen CFG time (s) [freeze_CFG, FrozenCFG.reachable/ sccs]")
+    print("%10s %10s %10s %10s %10s %10s" % \
+          ("stmts", "edges", "freeze", "reach CFG", "reach CSR", "sccs"))
+    for n in sizes:
+        cfg    = get_CFG(get_AST(gen_chain_program(n, loop_every=100, amb_every=50).encode()))
+        frozen = freeze_CFG(cfg)
+        t_freeze = _time(lambda: freeze_CFG(cfg))
+        t_walk   = _time(lambda: _reachable_nodes(cfg))
+        t_reach  = _time(lambda: frozen.reachable())
+        t_sccs   = _time(lambda: frozen.sccs())
+        print("%10d %10d %10.4f %10.4f %10.4f %10.4f" % \
+              (n, frozen.numEdges(), t_freeze, t_walk, t_reach, t_sccs))
+
+''' ---------------------------------------------------------------------------
+Normalize programs with a growing number of nested LOOP blocks; print time per
+block, which should stay flat (each rewrite site is visited once)
+--------------------------------------------------------------------------- '''
+def bench_normalize_sites(sizes=[25, 100, 400]):
+    print("\nNormalization time per nested LOOP block [normalize_ast]")
+    print("%10s %10s %12s %12s" % ("blocks", "edges", "seconds", "ms/block"))
+    for n in sizes:
+        ast   = get_AST(gen_nested_loop_program(n).encode())
+        edges = len(get_CFG(ast).getEdgeSet())
+        with contextlib.redirect_stdout(io.StringIO()): # Silence progress
+            t = _time(lambda: normalize_ast(ast), repeat=1)
+        print("%10d %10d %12.4f %12.3f" % (n, edges, t, t * 1e3 / n))
+
+''' ---------------------------------------------------------------------------
+Normalize programs through the CFG (normalize_ast) and directly on the AST
+(normalize_ast_direct); print time of each, for programs with many LOOP
+blocks, deeply nested LOOPs, and a single LOOP (already normal)
+--------------------------------------------------------------------------- '''
+def bench_normalize_direct(sizes=[100, 400, 1600]):
+    print("\nNormalization time (s) via CFG vs direct [normalize_ast, normalize_ast_direct]")
+    print("%-14s %8s %10s %10s %10s" % ("program", "size", "via CFG", "direct", "speedup"))
+    programs = [("LOOP blocks", n, gen_nested_loop_program(n)) for n in sizes] + \
+               [("nesting depth", n // 8, gen_nested_loop_program(1, n // 8)) for n in sizes] + \
+               [("single LOOP", n * 10, gen_chain_program(n * 10, loop_every=n * 10)) for n in sizes]
+    for name, n, wp in programs:
+        ast = get_AST(wp.encode())
+        with contextlib.redirect_stdout(io.StringIO()): # Silence progress
+            t_cfg = _time(lambda: normalize_ast(ast), repeat=1)
+        t_direct = _time(lambda: normalize_ast_direct(ast))
+        print("%-14s %8d %10.4f %10.4f %9.1fx" % (name, n, t_cfg, t_direct, t_cfg / t_direct))
+
+''' ---------------------------------------------------------------------------
+Normalize single LOOP nests of doubling depth; print CFG nodes and time per
+nesting level, and check both stay flat (at most max_growth times that of the
+shallowest nest), i.e. normalization is linear in the depth
+--------------------------------------------------------------------------- '''
+def bench_normalize_depth(depths=[50, 100, 200, 400], max_growth=3.0):
+    print("\nNormalization cost per nesting level [normalize_ast]")
+    print("%10s %10s %12s %12s" % ("depth", "nodes", "seconds", "ms/level"))
+    per_level = []
+    for depth in depths:
+        ast = get_AST(gen_nested_loop_program(1, depth).encode())
+        with contextlib.redirect_stdout(io.StringIO()): # Silence progress
+            t   = _time(lambda: normalize_ast(ast), repeat=1)
+            cfg = normalize_ast(ast, ret_norm_cfg=True)[1]
+        nodes = len(cfg.getNodes())
+        per_level.append((nodes / depth, t / depth))
+        print("%10d %10d %12.4f %12.3f" % (depth, nodes, t, t * 1e3 / depth))
+    for nodes, t in per_level[1:]:
+        assert nodes <= max_growth * per_level[0][0], "CFG size grows faster than depth"
+        assert t <= max_growth * per_level[0][1], "Normalization time grows faster than depth"
+
+''' ---------------------------------------------------------------------------
+Analyze CFGs of SEQ chains of growing length (to ~10^6 edges); print time per
+edge for dominators, post-dominators and the loop forest, which should stay
+flat
+--------------------------------------------------------------------------- '''
+def bench_dominators(sizes=[10000, 40000, 160000, 400000]):
+    print("\nDominator analysis time per edge (us) [DominatorTree, LoopForest]")
+    print("%10s %10s %10s %10s %10s %8s" % \
+          ("stmts", "edges", "dom", "post-dom", "loops", "headers"))
+    for n in sizes:
+        frozen = freeze_CFG(get_CFG(get_AST(gen_chain_program(n, loop_every=100, amb_every=50).encode())))
+        m      = frozen.numEdges()
+        t_dom  = _time(lambda: DominatorTree(frozen), repeat=1)
+        t_post = _time(lambda: DominatorTree(frozen, post=True), repeat=1)
+        dom    = DominatorTree(frozen)
+        t_loop = _time(lambda: LoopForest(frozen, dom), repeat=1)
+        print("%10d %10d %10.2f %10.2f %10.2f %8d" % \
+              (n, m, t_dom * 1e6 / m, t_post * 1e6 / m, t_loop * 1e6 / m, \
+               LoopForest(frozen, dom).numLoops()))
+
+# Run benchmarks
+if __name__=='__main__':
+    bench_parse()
+    bench_load()
+    bench_pipeline()
+    bench_ast_memory()
+    bench_hash_cons()
+    bench_cfg_scaling()
+    bench_normalize_sites()
+    bench_normalize_direct()
+    bench_normalize_depth()
+    bench_frozen_cfg()
+    bench_dominators()
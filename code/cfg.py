@@ -10,24 +10,102 @@ to a CFG
 =========================================================================== """
 from lib import *
 from ast import *
-import copy
+from collections import deque
 
 
 """ ======================================================================= """
 """ ==================      CLASSES               ========================= """
 """ ======================================================================= """
 
+''' ---------------------------------------------------------------------------
+Define a set of edges, bucketed by edge type:
+    - One bucket per EdgeType; LABELED for labeled edges
+    - Insert/ remove are O(1); the count of each type is kept live, so
+      e.g. "number of LOOP_BACK edges" is O(1), and "all AMB_SPLIT edges" O(k)
+    - Iterable and sized like a set (for the edge set of a CFG)
+    - Keeps a registry of the nodes the edges touch, with the number of edge
+      ends at each; updated with every insert/ remove, so listing the nodes
+      never rescans the edges
+--------------------------------------------------------------------------- '''
+class EdgeIndex():
+    def __init__(self, edges=()):
+        self._buckets = dict((t, set()) for t in EdgeType)
+        self._size    = 0
+        self._nodes   = {} # Node -> number of edge ends at node
+        self.update(edges)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for bucket in self._buckets.values():
+            for e in bucket:
+                yield e
+
+    def __contains__(self, edge):
+        return edge in self._buckets[edge.getType()]
+
+    def add(self, edge):
+        bucket = self._buckets[edge.getType()]
+        if edge not in bucket:
+            bucket.add(edge)
+            self._size += 1
+            for n in (edge.getSource(), edge.getEndpoint()):
+                self._nodes[n] = self._nodes.get(n, 0) + 1
+
+    def remove(self, edge):
+        self._buckets[edge.getType()].remove(edge)
+        self._size -= 1
+        for n in (edge.getSource(), edge.getEndpoint()):
+            self._nodes[n] -= 1
+            if self._nodes[n] == 0:
+                del self._nodes[n]
+
+    def discard(self, edge):
+        if edge in self:
+            self.remove(edge)
+
+    def update(self, edges):
+        for e in edges:
+            self.add(e)
+
+    def difference_update(self, edges):
+        for e in edges:
+            self.discard(e)
+
+    # Return number of edges of edge_type (LABELED, or None, for labeled edges)
+    def count(self, edge_type):
+        return len(self._buckets[_edge_type(edge_type)])
+
+    # Return set of edges of edge_type (LABELED, or None, for labeled edges); do
+    # not modify
+    def ofType(self, edge_type):
+        return self._buckets[_edge_type(edge_type)]
+
+    # Return number of nodes touched by an edge
+    def nodeCount(self):
+        return len(self._nodes)
+
+    # Yield each node touched by an edge; do not add/ remove edges meanwhile
+    def iterNodes(self):
+        return iter(self._nodes)
+
 ''' ---------------------------------------------------------------------------
 Define an CFG (Control Flow Graph) for While Programs:
     - A wrapper around a singleton Entry and singleton Exit node
     - Forwards and Backwards traversable (entry->exit and also exit->entry)
-    - Holds edge set for easy visualization
+    - Holds edge set for easy visualization; updated in place (O(1) per edge),
+      and may be shared by sub-CFGs of one graph (e.g. while building it)
+    - Edge set is an EdgeIndex; edges can be counted/ listed by type, and
+      nodes listed without rescanning edges
+    - Nodes/ edges can be streamed lazily (iterNodes, iterEdges, iterDFS,
+      iterBFS) rather than collected into sets
 --------------------------------------------------------------------------- '''
 class CFG():
-    def __init__(self):
+    def __init__(self, edges=None):
         self._entryNode = None
         self._exitNode  = None
-        self._edgeSet   = set() # Complete set of edges in CFG
+        self._edgeSet   = EdgeIndex() if edges is None else edges # Complete set of edges in CFG
 
     def getEntryNode(self):
         return self._entryNode
@@ -38,35 +116,108 @@ class CFG():
     def getEdgeSet(self):
         return self._edgeSet
 
+    # Return number of edges of edge_type (LABELED, or None, for labeled edges); O(1)
+    def getEdgeCount(self, edge_type):
+        return self._edgeSet.count(edge_type)
+
+    # Return edges of edge_type (LABELED, or None, for labeled edges); do not modify
+    def getEdgesOfType(self, edge_type):
+        return self._edgeSet.ofType(edge_type)
+
     def setEntryNode(self, node):
         self._entryNode = node
 
     def setExitNode(self, node):
         self._exitNode = node
 
+    def addEdge(self, edge):
+        self._edgeSet.add(edge)
+
+    def removeEdge(self, edge):
+        self._edgeSet.remove(edge)
+
     def unionEdges(self, edges):
-        self._edgeSet = self._edgeSet | edges
+        self._edgeSet.update(edges)
 
     def removeEdges(self, edges):
-        self._edgeSet = self._edgeSet - edges
+        self._edgeSet.difference_update(edges)
 
+    # Return set of nodes touched by an edge; O(V), from the node registry
     def getNodes(self):
-        nodes = set()
-        for e in self.getEdgeSet():
-            nodes = nodes | set([e.getSource()])
-            nodes = nodes | set([e.getEndpoint()])
-        return nodes
-
+        return set(self._edgeSet.iterNodes())
+
+    # Return number of nodes touched by an edge; O(1)
+    def getNodeCount(self):
+        return self._edgeSet.nodeCount()
+
+    # Yield each node touched by an edge, without building a set; do not
+    # add/ remove edges while iterating
+    def iterNodes(self):
+        return self._edgeSet.iterNodes()
+
+    # Yield each edge, without building a set; do not add/ remove edges while
+    # iterating
+    def iterEdges(self):
+        return iter(self._edgeSet)
+
+    # Yield nodes reachable from entry depth-first (preorder), following only
+    # edges in this CFG's edge set; lazy, so a caller may stop early
+    def iterDFS(self):
+        if self._entryNode is None:
+            return
+        seen  = set([self._entryNode])
+        stack = [self._entryNode]
+        while stack:
+            n = stack.pop()
+            yield n
+            for e in n.getOutgoingEdges():
+                if e.getEndpoint() not in seen and e in self._edgeSet:
+                    seen.add(e.getEndpoint())
+                    stack.append(e.getEndpoint())
+
+    # Yield nodes reachable from entry breadth-first, following only edges in
+    # this CFG's edge set; lazy, so a caller may stop early
+    def iterBFS(self):
+        if self._entryNode is None:
+            return
+        seen  = set([self._entryNode])
+        queue = deque([self._entryNode])
+        while queue:
+            n = queue.popleft()
+            yield n
+            for e in n.getOutgoingEdges():
+                if e.getEndpoint() not in seen and e in self._edgeSet:
+                    seen.add(e.getEndpoint())
+                    queue.append(e.getEndpoint())
+
+    ''' -----------------------------------------------------------------------
+    Copy this CFG (every edge in its edge set, and the nodes they link) with
+    fresh node IDs, into a new edge set; this CFG is left as is
+    Return CFG of the copy
+    ----------------------------------------------------------------------- '''
     def getCopy(self):
-        copy_cfg = copy.deepcopy(self)
-        for n in self.getNodes():
-            # Update node's ID
-            n.setNewID()
-        return copy_cfg
+        return _copy_edges(self._edgeSet, self._entryNode, self._exitNode, EdgeIndex())[0]
+
+    ''' -----------------------------------------------------------------------
+    Copy the single-entry/ single-exit region from entryNode to exitNode (the
+    nodes reachable from entryNode, by edges in this CFG's edge set, without
+    passing exitNode; a LOOP node as exitNode is copied with its body) with
+    fresh node IDs; cost is proportional to the region, not the whole graph
+    Copied edges are added to edge set edges; by default a new one, so this
+    CFG is left as is (pass its own, getEdgeSet(), to copy a region within a
+    graph being built or rewritten)
+    Return (CFG of the copy, edge map); edge map is original -> copy
+    ----------------------------------------------------------------------- '''
+    def getRegionCopy(self, entryNode, exitNode, edges=None):
+        return _copy_edges(_region_edges(entryNode, exitNode, self._edgeSet), \
+                           entryNode, exitNode, EdgeIndex() if edges is None else edges)
 
 ''' ---------------------------------------------------------------------------
 Define a node in the CFG:
     - A wrapper around sets of Incoming and Outgoing edges
+    - Holds its structural edges in named ports (LOOP entry/ out/ back/ in,
+      AMB splits, AMB join, SEQ next), kept by add/ del*Edge; so structural
+      lookups read a port rather than scan the edge sets
 --------------------------------------------------------------------------- '''
 class Node():
     def __init__(self, atomic_type=None, exit_node=None):
@@ -86,6 +237,16 @@ class Node():
         self._incoming = set()
         self._outgoing = set()
 
+        # Edge ports; None if no such edge
+        self._loop_entry = None # LOOP node: LOOP_ENTRY edge into body
+        self._loop_out   = None # LOOP node: edge leaving the LOOP (not LOOP_ENTRY)
+        self._loop_back  = None # LOOP node: LOOP_BACK edge from body
+        self._loop_in    = None # LOOP node: edge entering the LOOP (not LOOP_BACK)
+        self._amb_left   = None # AMB node: AMB_SPLIT edge added first
+        self._amb_right  = None # AMB node: AMB_SPLIT edge added second
+        self._amb_join   = None # AMB_JOIN edge out of the end of a branch
+        self._seq_next   = None # SEQ_TRANS edge to next node in SEQ
+
     def getID(self):
         return self._id
 
@@ -93,6 +254,10 @@ class Node():
         assert self.getType() == AMB
         return self._amb_exit
 
+    def setAMBExit(self, exit_node):
+        assert self.getType() == AMB
+        self._amb_exit = exit_node
+
     def getIncomingEdges(self):
         return self._incoming
 
@@ -102,27 +267,90 @@ class Node():
     def getType(self):
         return self._type
 
+    def getLoopEntryEdge(self):
+        return self._loop_entry
+
+    def getLoopOutEdge(self):
+        return self._loop_out
+
+    def getLoopBackEdge(self):
+        return self._loop_back
+
+    def getLoopInEdge(self):
+        return self._loop_in
+
+    # Return AMB_SPLIT edges, left first
+    def getAMBSplitEdges(self):
+        return [e for e in (self._amb_left, self._amb_right) if e is not None]
+
+    def getAMBJoinEdge(self):
+        return self._amb_join
+
+    def getSeqNextEdge(self):
+        return self._seq_next
+
     def addIncomingEdge(self, edge):
         if not isinstance(edge, Edge):
             print("Warning; adding non-edge to incoming set: " + edge.__str__())
         self._incoming.add(edge)
 
+        if edge.getType() == LOOP_BACK:
+            self._loop_back = edge
+        elif self._type == LOOP:
+            self._loop_in = edge
+
     def addOutgoingEdge(self, edge):
         if not isinstance(edge, Edge):
             print("Warning; adding non-edge to outgoing set: " + edge.__str__())
         self._outgoing.add(edge)
 
+        edge_type = edge.getType()
+        if edge_type == LOOP_ENTRY:
+            self._loop_entry = edge
+            return
+        elif edge_type == AMB_SPLIT:
+            if self._amb_left is None:
+                self._amb_left = edge
+            else:
+                self._amb_right = edge
+            return
+        elif edge_type == AMB_JOIN:
+            self._amb_join = edge
+        elif edge_type == SEQ_TRANS:
+            self._seq_next = edge
+        if self._type == LOOP:
+            self._loop_out = edge
+
     def delIncomingEdge(self, edge):
         if not isinstance(edge, Edge):
             print("Warning; removing non-edge from incoming set: " + edge.__str__())
         self._incoming.remove(edge)
 
+        if self._loop_back is edge:
+            self._loop_back = None
+        elif self._loop_in is edge:
+            self._loop_in = None
+
     def delOutgoingEdge(self, edge):
         if not isinstance(edge, Edge):
             print("Warning; removing non-edge from outgoing set: " + edge.__str__())
         self._outgoing.remove(edge)
 
-    def setType(atomic_type):
+        if self._loop_entry is edge:
+            self._loop_entry = None
+        elif self._amb_left is edge:
+            self._amb_left = None
+        elif self._amb_right is edge:
+            self._amb_right = None
+        else:
+            if self._amb_join is edge:
+                self._amb_join = None
+            elif self._seq_next is edge:
+                self._seq_next = None
+            if self._loop_out is edge:
+                self._loop_out = None
+
+    def setType(self, atomic_type):
         assert atomic_type is None or atomic_type in ATOMS
         self._type = atomic_type 
 
@@ -132,12 +360,12 @@ Define a node in the CFG:
     - Contains edge value (e.g. a=b) and references to source/ target nodes
 --------------------------------------------------------------------------- '''
 class Edge():
-    def __init__(self, data, source, endpoint, edge_type=None):
+    def __init__(self, data, source, endpoint, edge_type=LABELED):
         self._data = data
 
-        # Optionally store special edge type (LOOP_BACK, LOOP_ENTRY, AMB_SPLIT, AMB_JOIN, SEQ_TRANS)
-        assert edge_type is None or edge_type in EDGE_TYPES
-        self._type = edge_type
+        # Optionally store special edge type (LOOP_BACK, LOOP_ENTRY, AMB_SPLIT, AMB_JOIN, SEQ_TRANS);
+        # LABELED (or None) for labeled edges
+        self._type = _edge_type(edge_type)
 
         self._source   = source
         self._endpoint = endpoint
@@ -160,49 +388,260 @@ class Edge():
     def setEndpoint(self, node):
         self._endpoint = node
 
-    def setType(edge_type):
-        assert edge_type is None or edge_type in EDGE_TYPES
-        self._type = edge_type
+    def setType(self, edge_type):
+        self._type = _edge_type(edge_type)
 
 """ ======================================================================= """
 """ ==================     PRIVATE FUNCTIONS      ========================= """
 """ ======================================================================= """
 
+# Return EdgeType of edge_type (an EdgeType, or its int); None is LABELED, as
+# labeled edges were typed None before EdgeType
+def _edge_type(edge_type):
+    if edge_type is None:
+        return LABELED
+    assert edge_type in _EDGE_TYPE_SET
+    return EdgeType(edge_type)
+
+_EDGE_TYPE_SET = frozenset(EdgeType)
+
+''' ---------------------------------------------------------------------------
+Copy edges, and the nodes they link, with fresh node IDs:
+- Copied nodes are linked by the copied edges only
+- Return (node map, edge map); original -> copy
+--------------------------------------------------------------------------- '''
+def _clone_edges(edges):
+    node_copies = {}
+    edge_copies = {}
+
+    def _copy_node(n):
+        if n not in node_copies:
+            node_copies[n] = Node(n.getType())
+        return node_copies[n]
+
+    for e in edges:
+        source   = _copy_node(e.getSource())
+        endpoint = _copy_node(e.getEndpoint())
+        e_copy   = Edge(e.getData(), source, endpoint, e.getType())
+        if e.getType() != AMB_SPLIT:
+            source.addOutgoingEdge(e_copy)
+        endpoint.addIncomingEdge(e_copy)
+        edge_copies[e] = e_copy
+
+    # AMB entry nodes hold their exit node, and their AMB_SPLIT edges in order
+    for n, n_copy in node_copies.items():
+        if n.getType() == AMB:
+            n_copy.setAMBExit(node_copies[n.getAMBExit()])
+            for e in n.getAMBSplitEdges():
+                if e in edge_copies:
+                    n_copy.addOutgoingEdge(edge_copies[e])
+
+    return node_copies, edge_copies
+
+''' ---------------------------------------------------------------------------
+Return (CFG, edge map) of a copy of edges (see _clone_edges) from entryNode to
+exitNode, with the copied edges added to edge set target
+--------------------------------------------------------------------------- '''
+def _copy_edges(edges, entryNode, exitNode, target):
+    node_copies, edge_copies = _clone_edges(edges)
+
+    # Entry/ exit without edges (e.g. entryNode is exitNode)
+    for n in (entryNode, exitNode):
+        if n is not None and n not in node_copies:
+            node_copies[n] = Node(n.getType())
+
+    cfg = CFG(target)
+    cfg.setEntryNode(node_copies.get(entryNode))
+    cfg.setExitNode(node_copies.get(exitNode))
+    cfg.unionEdges(edge_copies.values())
+    return cfg, edge_copies
+
+''' ---------------------------------------------------------------------------
+Return list of edges of the region from entryNode to exitNode: all edges in
+edge set edge_set reachable from entryNode, except those leaving exitNode (a
+LOOP's body is inside it; so if exitNode is a LOOP, its body is in the region)
+--------------------------------------------------------------------------- '''
+def _region_edges(entryNode, exitNode, edge_set):
+    edges = []
+    seen  = set([entryNode])
+    stack = [entryNode]
+    while stack:
+        n   = stack.pop()
+        out = n.getOutgoingEdges()
+        if n is exitNode:
+            out = [e for e in [n.getLoopEntryEdge()] if e is not None]
+        for e in out:
+            if e not in edge_set:
+                continue
+            edges.append(e)
+            if e.getEndpoint() not in seen:
+                seen.add(e.getEndpoint())
+                stack.append(e.getEndpoint())
+    return edges
+
+''' ---------------------------------------------------------------------------
+Return template of a freshly built CFG fragment, for _instantiate_template: its
+edges (those reachable from its entry, which are exactly its own until the
+fragment is linked to others) compiled once to node indices, so copies need no
+node map; a template is immutable, and shared by all copies:
+- types : atomic type of each node
+- ambs  : (AMB entry index, AMB exit index) of each AMB node
+- edges : (data, source index, endpoint index, type) of each edge, AMB_SPLIT
+          edges last and in port order (left first)
+- entry/ exit: indices of entry/ exit nodes
+--------------------------------------------------------------------------- '''
+def _fragment_template(cfg):
+    index = {cfg.getEntryNode(): 0}
+    stack = [cfg.getEntryNode()]
+    edges = []
+    while stack:
+        n = stack.pop()
+        for e in n.getOutgoingEdges():
+            if e.getType() != AMB_SPLIT:
+                edges.append(e)
+            if e.getEndpoint() not in index:
+                index[e.getEndpoint()] = len(index)
+                stack.append(e.getEndpoint())
+    if cfg.getExitNode() not in index:
+        index[cfg.getExitNode()] = len(index)
+
+    nodes = sorted(index, key=index.get)
+    ambs  = [(index[n], index[n.getAMBExit()]) for n in nodes if n.getType() == AMB]
+    edges.extend(e for i, _ in ambs for e in nodes[i].getAMBSplitEdges())
+    return (tuple(n.getType() for n in nodes), tuple(ambs),
+            tuple((e.getData(), index[e.getSource()], index[e.getEndpoint()], e.getType())
+                  for e in edges),
+            0, index[cfg.getExitNode()])
+
+''' ---------------------------------------------------------------------------
+Return a new CFG fragment copied from template (see _fragment_template), with
+its edges added to edge set edges; edge data is shared with the template
+--------------------------------------------------------------------------- '''
+def _instantiate_template(template, edges):
+    types, ambs, template_edges, entry, exit = template
+    nodes = [Node(t) for t in types]
+    for i, j in ambs:
+        nodes[i].setAMBExit(nodes[j])
+
+    for data, i, j, edge_type in template_edges:
+        e = Edge(data, nodes[i], nodes[j], edge_type)
+        nodes[i].addOutgoingEdge(e)
+        nodes[j].addIncomingEdge(e)
+        edges.add(e)
+
+    cfg = CFG(edges)
+    cfg.setEntryNode(nodes[entry])
+    cfg.setExitNode(nodes[exit])
+    return cfg
+
+''' ---------------------------------------------------------------------------
+Return set of statement ASTs with more than one parent in (hash-consed) ast
+--------------------------------------------------------------------------- '''
+def _shared_stmts(ast):
+    parents = {}
+    stack   = [ast]
+    while stack:
+        for child in _stmt_children(stack.pop()):
+            parents[child] = parents.get(child, 0) + 1
+            # Walk each sub-DAG once
+            if parents[child] == 1:
+                stack.append(child)
+    return set(child for child, count in parents.items() if count > 1)
+
 ''' ---------------------------------------------------------------------------
-Return CFG object corresponding to well-formed AST object
+Return child statement ASTs of statement AST (none for ASSIGN/ ASSUME, whose
+children are expressions)
 --------------------------------------------------------------------------- '''
-def _generate_CFG(ast):
+def _stmt_children(ast):
+    if ast.getValue() in [SEQ, AMB]:
+        return [ast.getLeft(), ast.getRight()]
+    elif ast.getValue() == LOOP:
+        return [ast.getLeft()]
+    return []
+
+''' ---------------------------------------------------------------------------
+Allocate the nodes an AST's CFG is built around, before its sub-CFGs (so node
+IDs follow program order); return them as the walk state for _leave_stmt
+--------------------------------------------------------------------------- '''
+def _enter_stmt(ast):
     ast_type = ast.getValue()
 
     # Only ATOMS supported
     if not (ast_type in ATOMS):
         raise ValueError("Attempt to build CFG for non-atom AST type: " + ast_type)
 
+    # AMB entry node (holding its exit node)
+    if ast_type == AMB:
+        exitNode = Node()
+        return Node(AMB, exitNode)
+
+    # LOOP node; both entry and exit
+    elif ast_type == LOOP:
+        return Node(LOOP)
+
+    return None
+
+''' ---------------------------------------------------------------------------
+Return CFG of statement AST, given node from _enter_stmt and its sub-CFGs;
+its edges are added to edge set edges (shared by the sub-CFGs)
+--------------------------------------------------------------------------- '''
+def _leave_stmt(ast, node, sub_cfgs, edges):
+    ast_type = ast.getValue()
+
     # SEQ(LSTMT, RSTMT)
     if ast_type == SEQ:
-        cfg = _generate_SEQ_CFG(ast)
+        cfg = _generate_SEQ_CFG(sub_cfgs[0], sub_cfgs[1], edges)
 
     # ASSIGN(VAR, EXPR)
     elif ast_type == ASSIGN:
-        cfg = _generate_ASSIGN_CFG(ast)
+        cfg = _generate_ASSIGN_CFG(ast, edges)
 
     # ASSUME(EXPR)
     elif ast_type == ASSUME:
-        cfg = _generate_ASSUME_CFG(ast)
+        cfg = _generate_ASSUME_CFG(ast, edges)
 
     # AMB(LSTMT, RSTMT)
     elif ast_type == AMB:
-        cfg = _generate_AMB_CFG(ast)
+        cfg = _generate_AMB_CFG(node, sub_cfgs[0], sub_cfgs[1], edges)
 
     # LOOP(STMT)
     elif ast_type == LOOP:
-        cfg = _generate_LOOP_CFG(ast)
+        cfg = _generate_LOOP_CFG(node, sub_cfgs[0], edges)
 
     else:
         raise ValueError("Attempt to build CFG for unsupported AST atom: " + ast_type)
 
     return cfg
 
+''' ---------------------------------------------------------------------------
+Return CFG object corresponding to well-formed AST object; sub-CFGs are built
+bottom-up by an explicit-stack walk (no recursion), all adding their edges to
+one edge set (so no edges are copied up the tree)
+
+Sub-CFGs of statements in shared (see _shared_stmts) are built once, then
+copied from a template for every other occurrence
+--------------------------------------------------------------------------- '''
+def _generate_CFG(ast, shared=None):
+    edges     = EdgeIndex() # Edge set of the CFG, and all its sub-CFGs
+    shared    = shared or set()
+    templates = {}          # Shared AST -> template of its CFG
+
+    def _children(ast):
+        return [] if ast in templates else _stmt_children(ast)
+
+    def _enter(ast):
+        return None if ast in templates else _enter_stmt(ast)
+
+    def _leave(ast, node, sub_cfgs):
+        if ast in templates:
+            return _instantiate_template(templates[ast], edges)
+        cfg = _leave_stmt(ast, node, sub_cfgs, edges)
+        if ast in shared:
+            templates[ast] = _fragment_template(cfg)
+        return cfg
+
+    return walk(ast, _children, _enter, _leave)
+
 ''' ---------------------------------------------------------------------------
 Return CFG object corresponding to well-formed SEQ AST object
 
@@ -212,12 +651,8 @@ Return CFG object corresponding to well-formed SEQ AST object
 SEQ(L_AST, R_AST) ==> {  CFG(L_AST) ---Epsilon--> CFG(R_AST)  }
                   ==> {  pre        ---Epsilon-->       post  }
 --------------------------------------------------------------------------- '''
-def _generate_SEQ_CFG(ast):
-    cfg = CFG()
-
-    # Recursively generate the two sub-CFGs
-    pre  = _generate_CFG(ast.getLeft())
-    post = _generate_CFG(ast.getRight())
+def _generate_SEQ_CFG(pre, post, edges):
+    cfg = CFG(edges)
 
     # Add null edge from EXIT of pre, to ENTRY of post
     epsilonEdge = Edge(EPS, pre.getExitNode(), post.getEntryNode(), SEQ_TRANS)
@@ -233,8 +668,8 @@ def _generate_SEQ_CFG(ast):
     cfg.setEntryNode(pre.getEntryNode())
     cfg.setExitNode(post.getExitNode())
 
-    # Set of edges in CFG
-    cfg.unionEdges(pre.getEdgeSet() | post.getEdgeSet() | set([epsilonEdge]))
+    # Set of edges in CFG; pre's and post's are already in edges
+    cfg.addEdge(epsilonEdge)
 
     return cfg
 
@@ -243,8 +678,8 @@ Return CFG object corresponding to well-formed ASSIGN AST object
 
 ASSIGN(VAR, EXPR) ==> {  ( ) --- VAR=EXPR --> ( )  }
 --------------------------------------------------------------------------- '''
-def _generate_ASSIGN_CFG(ast):
-    cfg = CFG()
+def _generate_ASSIGN_CFG(ast, edges):
+    cfg = CFG(edges)
     entryNode = Node(ASSIGN)
     exitNode  = Node()
 
@@ -261,7 +696,7 @@ def _generate_ASSIGN_CFG(ast):
     cfg.setExitNode(exitNode)
 
     # Set of edges in CFG
-    cfg.unionEdges(set([edge]))
+    cfg.addEdge(edge)
 
     return cfg
 
@@ -270,8 +705,8 @@ Return CFG object corresponding to well-formed ASSUME AST object
 
 ASSUME(EXPR) ==> {  ( ) --- EXPR --> ( )  }
 --------------------------------------------------------------------------- '''
-def _generate_ASSUME_CFG(ast):
-    cfg = CFG()
+def _generate_ASSUME_CFG(ast, edges):
+    cfg = CFG(edges)
     entryNode = Node(ASSUME)
     exitNode  = Node()
 
@@ -288,12 +723,13 @@ def _generate_ASSUME_CFG(ast):
     cfg.setExitNode(exitNode)
 
     # Set of edges in CFG
-    cfg.unionEdges(set([edge]))
+    cfg.addEdge(edge)
     
     return cfg
 
 ''' ---------------------------------------------------------------------------
-Return CFG object corresponding to well-formed AMB AST object
+Return CFG object corresponding to well-formed AMB AST object, given its entry
+node (holding its exit node) and the sub-CFGs of LSTMT and RSTMT
 
 AMB(LSTMT, RSTMT) ==> 
                                  -> CFG(LSTMT)
@@ -306,14 +742,9 @@ AMB(LSTMT, RSTMT) ==>
                                 \           /
                                 -> CFG(RSTMT)
 --------------------------------------------------------------------------- '''
-def _generate_AMB_CFG(ast):
-    cfg = CFG()
-    exitNode  = Node() 
-    entryNode = Node(AMB, exitNode)
-    
-    # Recursively generate the two sub-CFGs for LSTMT and RSTMT
-    lcfg = _generate_CFG(ast.getLeft())
-    rcfg = _generate_CFG(ast.getRight())
+def _generate_AMB_CFG(entryNode, lcfg, rcfg, edges):
+    cfg = CFG(edges)
+    exitNode  = entryNode.getAMBExit()
 
     # Epsilon transitions out from entryNode (x2)
     entryLeftOutEdge  = Edge(EPS, entryNode, lcfg.getEntryNode(), AMB_SPLIT)
@@ -335,16 +766,14 @@ def _generate_AMB_CFG(ast):
     cfg.setEntryNode(entryNode)
     cfg.setExitNode(exitNode)
 
-    # Set of edges in CFG
-    cfg.unionEdges(lcfg.getEdgeSet() | rcfg.getEdgeSet() | set([entryLeftOutEdge,  \
-                                                                entryRightOutEdge, \
-                                                                exitLeftInEdge,    \
-                                                                exitRightInEdge]))
+    # Set of edges in CFG; lcfg's and rcfg's are already in edges
+    cfg.unionEdges([entryLeftOutEdge, entryRightOutEdge, exitLeftInEdge, exitRightInEdge])
 
     return cfg
 
 ''' ---------------------------------------------------------------------------
-Return CFG object corresponding to well-formed LOOP AST object
+Return CFG object corresponding to well-formed LOOP AST object, given its
+LOOP node and the sub-CFG of STMT
 
 - ( ) is both entry and exit node
 
@@ -355,12 +784,8 @@ LOOP(STMT) ==>
                       /             |
                 {  ( ) <-------------   }
 --------------------------------------------------------------------------- '''
-def _generate_LOOP_CFG(ast):
-    cfg = CFG()
-    whileNode = Node(LOOP) # Both entry and exit
-
-    # Get CFG that is the body of the LOOP
-    body_cfg = _generate_CFG(ast.getLeft())
+def _generate_LOOP_CFG(whileNode, body_cfg, edges):
+    cfg = CFG(edges) # whileNode is both entry and exit
     
     # Epsilon transition to enter the main LOOP body (from whileNode)
     loopEntryEdge = Edge(EPS, whileNode, body_cfg.getEntryNode(), LOOP_ENTRY)
@@ -376,8 +801,8 @@ def _generate_LOOP_CFG(ast):
     cfg.setEntryNode(whileNode)
     cfg.setExitNode(whileNode)
 
-    # Set of edges in CFG
-    cfg.unionEdges(body_cfg.getEdgeSet() | set([loopEntryEdge, loopBackEdge]))
+    # Set of edges in CFG; body_cfg's are already in edges
+    cfg.unionEdges([loopEntryEdge, loopBackEdge])
 
     return cfg
 
@@ -387,7 +812,16 @@ def _generate_LOOP_CFG(ast):
 
 ''' ---------------------------------------------------------------------------
 Return CFG of while program defined in AST
+
+With memoize, the CFG of each sub-tree shared in ast (e.g. by hash_cons) is
+built once and copied for its other occurrences; if None, the context's
+memoize option (default False)
+
+Node IDs come from context ctx (see PipelineContext); by default the shared
+context, reset first
 --------------------------------------------------------------------------- '''
-def get_CFG(ast):
-    resetNodeID() # Ensure unique node ID for each node
-    return _generate_CFG(ast)
\ No newline at end of file
+def get_CFG(ast, memoize=None, ctx=None):
+    with pipeline_stage(ctx, reset_ids=True) as ctx: # Ensure unique node ID for each node
+        if memoize is None:
+            memoize = ctx.getOption("memoize", False)
+        return _generate_CFG(ast, _shared_stmts(ast) if memoize else None)
\ No newline at end of file
@@ -0,0 +1,209 @@
+""" ===========================================================================
+File   : cluster.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Level-of-detail visualization of CFGs too big for dot to lay out in full (e.g.
+normalized CFGs, with many flag AMBs):
+    - Each LOOP body and AMB branch (a region; see region.py) is drawn as a
+      DOT cluster (subgraph cluster_*), nested as the regions are
+    - A region nested deeper than max_depth, of fewer than min_stmts
+      statements, or past the budget of max_nodes drawn nodes (spent on outer
+      regions first) is collapsed into one summary node, showing the number
+      of statements and back edges in it; edges inside it are hidden, and
+      edges in or out of it drawn to the summary node
+    - Regions are named by their owner's node ID and branch (e.g. R12_0, as
+      shown on summary nodes); regions named in expand (and the regions
+      holding them) are never collapsed, so a region can be opened on demand
+=========================================================================== """
+from lib import *
+from lib import _edge_label
+from lib import _edge_order
+from lib import _visualize
+from cfg import *
+from region import *
+from conv import _get_end_node
+from collections import deque
+
+
+""" ======================================================================= """
+""" ==================     PRIVATE FUNCTIONS      ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return CFG nodes of region itself (not of the regions under it); its
+statement nodes, with the end nodes of ASSIGNs/ ASSUMEs and exits of AMBs
+--------------------------------------------------------------------------- '''
+def _own_nodes(region):
+    nodes = []
+    for n in region.getNodes():
+        nodes.append(n)
+        if n.getType() in [ASSIGN, ASSUME, AMB]:
+            nodes.append(_get_end_node(n, n.getType()))
+    return nodes
+
+""" ======================================================================= """
+""" ==================      CLASSES               ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define a level-of-detail view of a CFG; which regions are drawn as clusters,
+and which collapsed (see header)
+--------------------------------------------------------------------------- '''
+class ClusterView():
+    def __init__(self, cfg, max_depth=None, min_stmts=0, max_nodes=None, expand=()):
+        self._cfg  = cfg
+        self._tree = RegionTree(cfg)
+        root = self._tree.getRoot()
+
+        # Name, title and depth of each region; outer regions first
+        self._name  = {root: "root"}
+        self._title = {root: "program"}
+        order = [(root, 0)]
+        queue = deque(order)
+        while queue:
+            region, depth = queue.popleft()
+            for n in region.getNodes():
+                subs = self._tree.getSubRegions(n)
+                for i, sub in enumerate(subs):
+                    self._name[sub]  = "R" + n.getID() + "_" + str(i)
+                    self._title[sub] = n.getType() + " " + ("body" if n.getType() == LOOP else \
+                                                            ["left", "right"][i])
+                    order.append((sub, depth + 1))
+                    queue.append((sub, depth + 1))
+
+        # Statements in (and under) each region; inner regions first
+        self._stmts = {}
+        for region, _ in reversed(order):
+            self._stmts[region] = len(region.getNodes()) + \
+                sum(self._stmts[sub] for sub in self._tree.getChildren(region))
+
+        # Regions to keep open; those named in expand, and the regions holding them
+        keep = set()
+        for region, _ in order:
+            if self._name[region] in expand:
+                while region is not None and region not in keep:
+                    keep.add(region)
+                    region = region.getParent()
+
+        # Collapse regions, outer first; _collapsed maps each region to the
+        # collapsed region holding it (itself if collapsed), or None if drawn
+        self._collapsed = {root: None}
+        self._region_of = {n: root for n in _own_nodes(root)}
+        self._num_drawn = len(self._region_of)
+        for region, depth in order[1:]:
+            own = _own_nodes(region)
+            for n in own:
+                self._region_of[n] = region
+            holder = self._collapsed[region.getParent()]
+            if holder is not None:
+                self._collapsed[region] = holder
+            elif region not in keep and \
+                 ((max_depth is not None and depth > max_depth) or \
+                  self._stmts[region] < min_stmts or \
+                  (max_nodes is not None and self._num_drawn + len(own) > max_nodes)):
+                self._collapsed[region] = region
+                self._num_drawn += 1
+            else:
+                self._collapsed[region] = None
+                self._num_drawn += len(own)
+
+    def getRegionTree(self):
+        return self._tree
+
+    def getName(self, region):
+        return self._name[region]
+
+    # Return True if region is drawn as a summary node (or within one)
+    def isCollapsed(self, region):
+        return self._collapsed[region] is not None
+
+    # Return number of statements in (and under) region
+    def getStatementCount(self, region):
+        return self._stmts[region]
+
+    # Return number of nodes drawn (CFG nodes and summary nodes)
+    def getDrawnCount(self):
+        return self._num_drawn
+
+    # Return DOT node ID node is drawn as; its own, or its summary node's
+    def _drawnID(self, node):
+        holder = self._collapsed[self._region_of[node]]
+        return node.getID() if holder is None else self._name[holder]
+
+    ''' -----------------------------------------------------------------------
+    Write the view in DOT format to out (see DotWriter); return digest of the
+    text written
+    ----------------------------------------------------------------------- '''
+    def write(self, out, name="cfg", show_epsilons=True, show_node_labels=True):
+        root = self._tree.getRoot()
+
+        # Hide node labels (not those of summary nodes)
+        node_attr = {} if show_node_labels else {"label": ""}
+        with DotWriter(out, comment=name, node_attr=node_attr) as dot:
+            # Nodes, in nested clusters; explicit stack (region, closing)
+            stack = [(root, False)]
+            while stack:
+                region, closing = stack.pop()
+                if closing:
+                    dot.endSubgraph()
+                    continue
+                if self._collapsed[region] is region:
+                    dot.node(self._name[region], \
+                             label=self._title[region] + " " + self._name[region] + "\\n" + \
+                                   str(self._stmts[region]) + " stmts, " + \
+                                   str(region.getLoopCount()) + " back edges", \
+                             attrs={"shape": "box", "style": "dashed"})
+                    continue
+                if region is not root:
+                    dot.beginSubgraph("cluster_" + self._name[region], \
+                                      {"label": self._title[region] + " " + self._name[region]})
+                    stack.append((region, True))
+                for n in _own_nodes(region):
+                    dot.node(n.getID())
+                for sub in reversed(self._tree.getChildren(region)):
+                    stack.append((sub, False))
+
+            # Edges; those inside a summary node hidden, those to/ from one
+            # drawn once (unlabeled)
+            summary_edges = set()
+            for e in sorted(self._cfg.getEdgeSet(), key=_edge_order):
+                src, dst = self._drawnID(e.getSource()), self._drawnID(e.getEndpoint())
+                if src == e.getSource().getID() and dst == e.getEndpoint().getID():
+                    dot.edge(src, dst, label=_edge_label(e, show_epsilons))
+                elif src != dst and (src, dst) not in summary_edges:
+                    summary_edges.add((src, dst))
+                    dot.edge(src, dst)
+        return dot.getDigest()
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Write CFG in DOT format to out with its regions as clusters, collapsed as
+given (see ClusterView); return digest of the text written
+--------------------------------------------------------------------------- '''
+def write_cfg_clustered(cfg, out, name="cfg", show_epsilons=True, show_node_labels=True, \
+                        max_depth=None, min_stmts=0, max_nodes=None, expand=()):
+    view = ClusterView(cfg, max_depth, min_stmts, max_nodes, expand)
+    return view.write(out, name, show_epsilons, show_node_labels)
+
+''' ---------------------------------------------------------------------------
+Use graphViz to render graph cfg, with its regions as clusters, and save in
+folder as name (as visualize_cfg); regions are collapsed as given (see
+ClusterView), by default so that at most ~max_nodes nodes are laid out
+--------------------------------------------------------------------------- '''
+def visualize_cfg_clustered(cfg, name="cfg", folder="cfgs/", \
+                            show_epsilons=True, show_node_labels=True, \
+                            max_depth=None, min_stmts=0, max_nodes=2000, expand=(), \
+                            queue=None, cache=None, render=True):
+    # Write DOT format graph, given cfg's regions, to folder/name/name.gv; and
+    # render it as folder/name/name.gv.pdf
+    options = {"show_epsilons": show_epsilons, "show_node_labels": show_node_labels}
+    result  = _visualize(lambda out: write_cfg_clustered(cfg, out, name, show_epsilons, show_node_labels, \
+                                                         max_depth, min_stmts, max_nodes, expand), \
+                         name, folder + name + "/", options, queue, cache, render)
+    if render and queue is None:
+        print("\nCFG \'" + name + "\' saved to " + result)
+    return result
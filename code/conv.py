@@ -14,41 +14,27 @@ from cfg import *
 """ ======================================================================= """
 
 ''' ---------------------------------------------------------------------------
-Return next node following this one in SEQ; if exists
+Return end node of the sub-CFG headed by node; the node its SEQ edge (if any)
+leaves from
 --------------------------------------------------------------------------- '''
-def _get_next_seq(node, node_type):
-    def _next_seq(ep):
-        next_edge = ep.getOutgoingEdges()
-        # Either has next SEQ, or this is the terminal node
-        #assert len(next_edge) in [0, 1]
-        # No next SEQ
-        if len(next_edge) == 0:
-            return None
-        # Next SEQ
-        elif len(next_edge) == 1:
-            return next(iter(next_edge)).getEndpoint()
-
+def _get_end_node(node, node_type):
     if node_type in [ASSIGN, ASSUME]:
-        return _next_seq(next(iter(node.getOutgoingEdges())).getEndpoint())
-        
+        # End point of the ASSIGN | ASSUME edge
+        return next(iter(node.getOutgoingEdges())).getEndpoint()
     elif node_type == AMB:
-        return _next_seq(node.getAMBExit())
-
+        return node.getAMBExit()
     elif node_type == LOOP:
         # node is it's own end point
-        next_edge = node.getOutgoingEdges()
-        # Either has only LOOP_ENTRY (loop is sub-program's terminal node), 
-        # ... or has a next SEQ
-        assert len(next_edge) in [1, 2]
-        # No next SEQ; only outgoing is LOOP_ENTRY
-        if len(next_edge) == 1:
-            return None
-        # Next SEQ
-        elif len(next_edge) == 2:
-            for e in next_edge:
-                if not e.getType() == LOOP_ENTRY:
-                    return e.getEndpoint()
-            raise ValueError("Encountered LOOP node with two outgoing edges, but no next SEQ edge!")
+        return node
+
+''' ---------------------------------------------------------------------------
+Return next node following this one in SEQ; if exists (read from the SEQ next
+port of the sub-CFG's end; AMB_JOIN and LOOP_BACK edges, which close AMB
+branches and LOOP bodies, are not SEQ edges)
+--------------------------------------------------------------------------- '''
+def _get_next_seq(node, node_type):
+    next_edge = _get_end_node(node, node_type).getSeqNextEdge()
+    return next_edge.getEndpoint() if next_edge else None
 
 ''' ---------------------------------------------------------------------------
 Return AST representation of assign flow {  (node) --- VAR=EXPR --> ( )  }
@@ -71,17 +57,15 @@ def _assume_flow_to_ast(node):
     return get_assumption_ast(next(iter(node.getOutgoingEdges())).getData())
 
 ''' ---------------------------------------------------------------------------
-Build a sequence AST, with left_ast as left and AST defined by CFG at node's
-next_node as right; if node does not have a next_node, then just return left_ast
+Build a sequence AST, with left_ast as left and right_ast (AST of the CFG at
+the next node) as right; if there is no next node, then just return left_ast
 --------------------------------------------------------------------------- '''
-def _build_seq_ast(left_ast, node, node_type):
-    # Check for next SEQ
-    next_node = _get_next_seq(node, node_type)
-    if next_node:
+def _build_seq_ast(left_ast, right_ast):
+    if right_ast:
         # Build the SEQ AST and return
         ast = AST(SEQ)
         ast.setLeft(left_ast)
-        ast.setRight(_cfg_node_to_ast(next_node))
+        ast.setRight(right_ast)
         return ast
 
     # No next SEQ, just return the ASSIGN | ASSUME AST
@@ -89,79 +73,102 @@ def _build_seq_ast(left_ast, node, node_type):
         return left_ast
 
 ''' ---------------------------------------------------------------------------
-Return AST representation of CFG with given root node:
-- Root node is expected to be one of type: ASSIGN, ASSUME, AMB, LOOP
+Check root node of a sub-CFG before conversion (before its children are found);
+the CFG is only read:
+- AMB: must be closed by two AMB_JOIN edges (where each branch's SEQ stops)
+- LOOP: must be closed by a LOOP_BACK edge (where the loop body's SEQ stops)
 --------------------------------------------------------------------------- '''
-def _cfg_node_to_ast(node):
+def _enter_cfg_node(node):
     node_type = node.getType()
     assert node_type in ATOMS # [ASSIGN, ASSUME, AMB, LOOP]
 
-    if node_type in [ASSIGN, ASSUME]:
-        # Get the ASSIGN | ASSUME AST
-        if node_type == ASSIGN:
-            ast = _assign_flow_to_ast(node)
-        elif node_type == ASSUME:
-            ast = _assume_flow_to_ast(node)
-
-    elif node_type == AMB:        
-        # Snip AMB_JOIN edges (that close AMB) to form a sub-CFG for each branch
+    if node_type == AMB:
         amb_join_edges = node.getAMBExit().getIncomingEdges()
         assert len(amb_join_edges) == 2
         for e in amb_join_edges:
             assert e.getType() == AMB_JOIN
-            e.getSource().delOutgoingEdge(e)
 
-        # Get each of AMB path's head nodes
-        amb_split_edges = node.getOutgoingEdges()
+    elif node_type == LOOP:
+        assert node.getLoopBackEdge()
+
+    elif node_type not in [ASSIGN, ASSUME]:
+        raise ValueError("Unsupported node type encountered during CFG to AST conversion: " + node_type)
+
+''' ---------------------------------------------------------------------------
+Return head nodes of the sub-CFGs nested in node (AMB branches, LOOP body),
+followed by the next node in SEQ; if exists
+--------------------------------------------------------------------------- '''
+def _cfg_node_children(node):
+    node_type = node.getType()
+    children  = []
+
+    if node_type == AMB:
+        # Get each of AMB path's head nodes; left first
+        amb_split_edges = node.getAMBSplitEdges()
         assert len(amb_split_edges) == 2
-        branch_nodes = []
         for e in amb_split_edges:
-            assert e.getType() == AMB_SPLIT
-            branch_nodes.append(e.getEndpoint())
-        assert len(branch_nodes) == 2
+            children.append(e.getEndpoint())
 
-        # Recursively build the AMB child paths
+    elif node_type == LOOP:
+        # Get the LOOP_ENTRY edge and loop body entry Node
+        loop_entry_edge = node.getLoopEntryEdge()
+        assert loop_entry_edge
+        children.append(loop_entry_edge.getEndpoint())
+
+    # Check for next SEQ
+    next_node = _get_next_seq(node, node_type)
+    if next_node:
+        children.append(next_node)
+    return children
+
+''' ---------------------------------------------------------------------------
+Return AST of the sub-CFG at node, given the ASTs of its children (as found by
+_cfg_node_children)
+--------------------------------------------------------------------------- '''
+def _leave_cfg_node(node, state, child_asts):
+    node_type = node.getType()
+
+    if node_type in [ASSIGN, ASSUME]:
+        # Get the ASSIGN | ASSUME AST
+        if node_type == ASSIGN:
+            ast = _assign_flow_to_ast(node)
+        elif node_type == ASSUME:
+            ast = _assume_flow_to_ast(node)
+        seq_asts = child_asts
+
+    elif node_type == AMB:
+        # Build the AMB from its child paths
         ast = AST(AMB)
-        ast.setLeft(_cfg_node_to_ast(branch_nodes[0]))
-        ast.setRight(_cfg_node_to_ast(branch_nodes[1]))
+        ast.setLeft(child_asts[0])
+        ast.setRight(child_asts[1])
+        seq_asts = child_asts[2:]
 
     elif node_type == LOOP:
-        # Snip LOOP_BACK edge (incoming to node) to form a sub-CFG for loop body
-        loop_in_edges = node.getIncomingEdges()
-        assert len(loop_in_edges) == 2
-        snipped = False
-        for e in loop_in_edges:
-            if e.getType() == LOOP_BACK:
-                e.getSource().delOutgoingEdge(e)
-                snipped = True
-        assert snipped
-
-        # Get the LOOP_ENTRY edge and loop body entry Node
-        loop_out_edges = node.getOutgoingEdges()
-        assert len(loop_out_edges) in [1, 2]
-        loop_entry_node = None
-        for e in loop_out_edges:
-            if e.getType() == LOOP_ENTRY:
-                loop_entry_node = e.getEndpoint()
-        assert loop_entry_node
-
-        # Recursively build the LOOP body AST
+        # Build the LOOP from its body
         ast = AST(LOOP)
-        ast.setLeft(_cfg_node_to_ast(loop_entry_node))
+        ast.setLeft(child_asts[0])
+        seq_asts = child_asts[1:]
 
-    else:
-        raise ValueError("Unsupported node type encountered during CFG to AST conversion: " + node_type)
-    
     # Build SEQ, if necessary, and return result
-    return _build_seq_ast(ast, node, node_type)
+    return _build_seq_ast(ast, seq_asts[0] if seq_asts else None)
+
+''' ---------------------------------------------------------------------------
+Return AST representation of CFG with given root node:
+- Root node is expected to be one of type: ASSIGN, ASSUME, AMB, LOOP
+- Sub-CFGs are converted bottom-up by an explicit-stack walk (no recursion)
+--------------------------------------------------------------------------- '''
+def _cfg_node_to_ast(node):
+    return walk(node, _cfg_node_children, _enter_cfg_node, _leave_cfg_node)
 
 """ ======================================================================= """
 """ ================== PUBLIC INTERFACE =================================== """
 """ ======================================================================= """
 
 ''' ---------------------------------------------------------------------------
-Return AST representation of given CFG; warning: CFG will be modified - either
-save it first or pass in a deep copy
+Return AST representation of given CFG; the CFG is left as is (it may still be
+visualized, or converted again). Node IDs come from context ctx; by default
+the current context
 --------------------------------------------------------------------------- '''
-def to_ast(cfg):
-    return _cfg_node_to_ast(cfg.getEntryNode())
\ No newline at end of file
+def to_ast(cfg, ctx=None):
+    with pipeline_stage(ctx):
+        return _cfg_node_to_ast(cfg.getEntryNode())
\ No newline at end of file
@@ -0,0 +1,287 @@
+""" ===========================================================================
+File   : csr.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Defines FrozenCFG; an immutable, compact snapshot of a finished CFG for
+analysis:
+    - Nodes are renumbered densely (0 .. n-1; entry is 0)
+    - Successors/ predecessors are stored as CSR (offsets, targets) arrays
+    - Edge kinds are small ints, edge labels index an interned label table
+
+Requires numpy; scipy is only needed for FrozenCFG.toSciPy
+=========================================================================== """
+from lib import *
+from cfg import *
+from cfg import _edge_type
+with stdlib_imports():
+    import numpy as np
+
+
+""" ======================================================================= """
+""" ==================     MACROS       =================================== """
+""" ======================================================================= """
+
+# Node kind k is the atomic type NODE_KINDS[k]; 0 for untyped nodes
+NODE_KINDS = [None] + ATOMS
+
+""" ======================================================================= """
+""" ==================     PRIVATE FUNCTIONS      ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return read-only copy of array (of given dtype)
+--------------------------------------------------------------------------- '''
+def _frozen(array, dtype):
+    array = np.array(array, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+''' ---------------------------------------------------------------------------
+Return CSR (offsets, targets, edge ids) of edges (sources -> targets) grouped
+by source, for num_nodes nodes
+--------------------------------------------------------------------------- '''
+def _csr(sources, targets, num_nodes):
+    order   = np.argsort(sources, kind="stable")
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=offsets[1:])
+    return _frozen(offsets, np.int64), _frozen(targets[order], np.int32), \
+           _frozen(order, np.int32)
+
+""" ======================================================================= """
+""" ==================      CLASSES               ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define an immutable CSR snapshot of a CFG; later changes to the CFG are not
+reflected. Node i has successors succ_targets[succ_offsets[i] :
+succ_offsets[i+1]], through edges succ_edges[...] (and likewise for pred_*)
+--------------------------------------------------------------------------- '''
+class FrozenCFG():
+    def __init__(self, cfg):
+        # Number nodes densely; entry node first, then in order of first use
+        index = {}
+        nodes = []
+        def _number(node):
+            if node not in index:
+                index[node] = len(nodes)
+                nodes.append(node)
+            return index[node]
+
+        if cfg.getEntryNode() is not None:
+            _number(cfg.getEntryNode())
+
+        # Edge arrays, with labels interned
+        label_index = {}
+        self._labels = []
+        sources, targets, kinds, labels = [], [], [], []
+        for e in cfg.getEdgeSet():
+            sources.append(_number(e.getSource()))
+            targets.append(_number(e.getEndpoint()))
+            kinds.append(e.getType())
+            if e.getData() not in label_index:
+                label_index[e.getData()] = len(self._labels)
+                self._labels.append(e.getData())
+            labels.append(label_index[e.getData()])
+
+        if cfg.getExitNode() is not None:
+            _number(cfg.getExitNode())
+
+        num_nodes        = len(nodes)
+        self._entry      = index.get(cfg.getEntryNode(), -1)
+        self._exit       = index.get(cfg.getExitNode(), -1)
+        self._node_ids   = [n.getID() for n in nodes]
+        self._id_index   = dict((n.getID(), i) for i, n in enumerate(nodes))
+        self._node_kinds = _frozen([NODE_KINDS.index(n.getType()) for n in nodes], np.int8)
+
+        self._sources     = _frozen(sources, np.int32)
+        self._targets     = _frozen(targets, np.int32)
+        self._edge_kinds  = _frozen(kinds, np.int8)
+        self._edge_labels = _frozen(labels, np.int32)
+
+        self._succ_offsets, self._succ_targets, self._succ_edges = \
+            _csr(self._sources, self._targets, num_nodes)
+        self._pred_offsets, self._pred_targets, self._pred_edges = \
+            _csr(self._targets, self._sources, num_nodes)
+
+    def numNodes(self):
+        return len(self._node_ids)
+
+    def numEdges(self):
+        return len(self._sources)
+
+    def getEntry(self):
+        return self._entry
+
+    def getExit(self):
+        return self._exit
+
+    # Return original ID of node i
+    def getNodeID(self, i):
+        return self._node_ids[i]
+
+    # Return index of node with original ID node_id
+    def getIndex(self, node_id):
+        return self._id_index[node_id]
+
+    # Return atomic type of node i (e.g. LOOP); None if untyped
+    def getNodeType(self, i):
+        return NODE_KINDS[self._node_kinds[i]]
+
+    # Return (offsets, targets, edge ids) arrays of successors
+    def getSuccessorCSR(self):
+        return self._succ_offsets, self._succ_targets, self._succ_edges
+
+    # Return (offsets, targets, edge ids) arrays of predecessors
+    def getPredecessorCSR(self):
+        return self._pred_offsets, self._pred_targets, self._pred_edges
+
+    # Return array of successors of node i
+    def getSuccessors(self, i):
+        return self._succ_targets[self._succ_offsets[i] : self._succ_offsets[i+1]]
+
+    # Return array of predecessors of node i
+    def getPredecessors(self, i):
+        return self._pred_targets[self._pred_offsets[i] : self._pred_offsets[i+1]]
+
+    # Return array of ids of edges out of node i
+    def getOutEdges(self, i):
+        return self._succ_edges[self._succ_offsets[i] : self._succ_offsets[i+1]]
+
+    # Return array of ids of edges into node i
+    def getInEdges(self, i):
+        return self._pred_edges[self._pred_offsets[i] : self._pred_offsets[i+1]]
+
+    # Return (sources, targets) arrays of all edges, by edge id
+    def getEdgeArrays(self):
+        return self._sources, self._targets
+
+    # Return (source, target) of edge e
+    def getEdge(self, e):
+        return int(self._sources[e]), int(self._targets[e])
+
+    # Return edge type of edge e (e.g. LOOP_BACK); LABELED for labeled edges
+    def getEdgeType(self, e):
+        return EdgeType(self._edge_kinds[e])
+
+    # Return label (data) of edge e
+    def getEdgeLabel(self, e):
+        return self._labels[self._edge_labels[e]]
+
+    # Return array of edge ids of edge_type (LABELED, or None, for labeled edges)
+    def getEdgesOfType(self, edge_type):
+        return np.flatnonzero(self._edge_kinds == _edge_type(edge_type))
+
+    ''' -----------------------------------------------------------------------
+    Return boolean array; True for nodes reachable from node start (entry by
+    default) following edges forwards, or backwards if reverse
+    ----------------------------------------------------------------------- '''
+    def reachable(self, start=None, reverse=False):
+        offsets, targets, _ = self.getPredecessorCSR() if reverse else \
+                              self.getSuccessorCSR()
+        seen = np.zeros(self.numNodes(), dtype=bool)
+        if self.numNodes() == 0:
+            return seen
+
+        # CFGs are long and narrow, so a plain stack over the CSR lists beats
+        # level-by-level array operations
+        offsets = offsets.tolist()
+        targets = targets.tolist()
+        visited = [False] * self.numNodes()
+        stack   = [self._entry if start is None else start]
+        visited[stack[0]] = True
+        while stack:
+            v = stack.pop()
+            for w in targets[offsets[v] : offsets[v + 1]]:
+                if not visited[w]:
+                    visited[w] = True
+                    stack.append(w)
+
+        seen[:] = visited
+        return seen
+
+    ''' -----------------------------------------------------------------------
+    Return (number of SCCs, array of SCC id per node); iterative Tarjan over
+    the CSR arrays, so nesting depth is not limited by recursion
+    ----------------------------------------------------------------------- '''
+    def sccs(self):
+        offsets = self._succ_offsets.tolist()
+        targets = self._succ_targets.tolist()
+        n       = self.numNodes()
+
+        order    = [-1] * n # DFS discovery order
+        low      = [0] * n
+        comp     = [-1] * n
+        on_stack = [False] * n
+        stack    = []
+        count    = 0
+        counter  = 0
+
+        for root in range(n):
+            if order[root] != -1:
+                continue
+            # Call stack of (node, next successor position)
+            calls = [(root, offsets[root])]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+
+            while calls:
+                v, pos = calls[-1]
+                if pos < offsets[v + 1]:
+                    calls[-1] = (v, pos + 1)
+                    w = targets[pos]
+                    if order[w] == -1:
+                        order[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        calls.append((w, offsets[w]))
+                    elif on_stack[w]:
+                        low[v] = min(low[v], order[w])
+                    continue
+
+                # v is done; pop its SCC if it is the root of one
+                calls.pop()
+                if calls:
+                    parent = calls[-1][0]
+                    low[parent] = min(low[parent], low[v])
+                if low[v] == order[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        comp[w] = count
+                        if w == v:
+                            break
+                    count += 1
+
+        return count, _frozen(comp, np.int32)
+
+    ''' -----------------------------------------------------------------------
+    Return successor adjacency as a scipy.sparse CSR matrix (n x n); entry
+    (i, j) counts the edges i -> j. Requires scipy
+    ----------------------------------------------------------------------- '''
+    def toSciPy(self):
+        try:
+            with stdlib_imports():
+                import scipy.sparse
+        except ImportError:
+            raise ImportError("FrozenCFG.toSciPy requires scipy (pip install scipy)")
+
+        n = self.numNodes()
+        matrix = scipy.sparse.csr_matrix((np.ones(self.numEdges(), dtype=np.int32), \
+                                          self._succ_targets, self._succ_offsets), \
+                                         shape=(n, n))
+        matrix.sum_duplicates()
+        return matrix
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return immutable CSR snapshot (FrozenCFG) of given CFG
+--------------------------------------------------------------------------- '''
+def freeze_CFG(cfg):
+    return FrozenCFG(cfg)
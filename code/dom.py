@@ -0,0 +1,291 @@
+""" ===========================================================================
+File   : dom.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Dominator, post-dominator and loop analysis of a CFG, found from its shape
+alone (edge types, e.g. LOOP_BACK, are not read); so it also works on CFGs
+built by hand or part way through a rewrite:
+    - DominatorTree; immediate dominators by the iterative algorithm of
+      Cooper, Harvey and Kennedy, over reverse post-order
+    - LoopForest; natural loops (one per header) nested into a forest, with
+      each retreating edge classified as a back edge, or irreducible
+
+All run on the CSR arrays of a FrozenCFG (see csr.py), with explicit stacks;
+near-linear in the number of edges
+=========================================================================== """
+from lib import *
+from cfg import *
+from csr import *
+from csr import _frozen
+with stdlib_imports():
+    import numpy as np
+
+
+""" ======================================================================= """
+""" ==================     PRIVATE FUNCTIONS      ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return FrozenCFG of cfg (CFG or FrozenCFG)
+--------------------------------------------------------------------------- '''
+def _frozen_of(cfg):
+    return cfg if isinstance(cfg, FrozenCFG) else freeze_CFG(cfg)
+
+''' ---------------------------------------------------------------------------
+Return nodes reachable from root in reverse post-order, following CSR
+(offsets, targets); iterative DFS
+--------------------------------------------------------------------------- '''
+def _reverse_post_order(offsets, targets, root, n):
+    post    = []
+    visited = [False] * n
+    visited[root] = True
+    calls   = [(root, offsets[root])] # (node, next successor position)
+    while calls:
+        v, pos = calls[-1]
+        if pos < offsets[v + 1]:
+            calls[-1] = (v, pos + 1)
+            w = targets[pos]
+            if not visited[w]:
+                visited[w] = True
+                calls.append((w, offsets[w]))
+            continue
+        calls.pop()
+        post.append(v)
+    post.reverse()
+    return post
+
+""" ======================================================================= """
+""" ==================      CLASSES               ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define the dominator tree of a FrozenCFG; rooted at entry, or for post-
+dominators (post) at exit, over the reversed edges. Nodes are the FrozenCFG's
+indices; nodes not reachable from the root have no immediate dominator (-1)
+--------------------------------------------------------------------------- '''
+class DominatorTree():
+    def __init__(self, frozen, post=False):
+        n = frozen.numNodes()
+        self._root = frozen.getExit() if post else frozen.getEntry()
+        succ_offsets, succ_targets, _ = frozen.getPredecessorCSR() if post else \
+                                        frozen.getSuccessorCSR()
+        pred_offsets, pred_targets, _ = frozen.getSuccessorCSR() if post else \
+                                        frozen.getPredecessorCSR()
+        succ_offsets, succ_targets = succ_offsets.tolist(), succ_targets.tolist()
+        pred_offsets, pred_targets = pred_offsets.tolist(), pred_targets.tolist()
+
+        idom = [-1] * n
+        rpo  = [n] * n # Reverse post-order number; n if unreachable
+        order = []
+        if n > 0 and self._root >= 0:
+            order = _reverse_post_order(succ_offsets, succ_targets, self._root, n)
+            for i, v in enumerate(order):
+                rpo[v] = i
+            idom[self._root] = self._root
+
+        # Iterate to a fixed point; two passes for CFGs without irreducible loops
+        changed = True
+        while changed:
+            changed = False
+            for b in order[1:]:
+                new_idom = -1
+                for p in pred_targets[pred_offsets[b] : pred_offsets[b + 1]]:
+                    if idom[p] == -1:
+                        continue
+                    if new_idom == -1:
+                        new_idom = p
+                        continue
+                    # Intersect; walk both up the tree until they meet
+                    a = p
+                    while a != new_idom:
+                        while rpo[a] > rpo[new_idom]:
+                            a = idom[a]
+                        while rpo[new_idom] > rpo[a]:
+                            new_idom = idom[new_idom]
+                if idom[b] != new_idom:
+                    idom[b] = new_idom
+                    changed = True
+
+        self._order = order
+        self._rpo   = rpo
+        self._idom  = idom
+        self._number_tree(n)
+
+    ''' -----------------------------------------------------------------------
+    Number the dominator tree in DFS pre/ post order, so dominates is O(1)
+    ----------------------------------------------------------------------- '''
+    def _number_tree(self, n):
+        children = [[] for _ in range(n)]
+        for v in self._order[1:]:
+            children[self._idom[v]].append(v)
+
+        self._pre  = [-1] * n
+        self._post = [-1] * n
+        counter = 0
+        stack   = [(self._root, False)] if self._order else []
+        while stack:
+            v, done = stack.pop()
+            if done:
+                self._post[v] = counter
+                counter += 1
+                continue
+            self._pre[v] = counter
+            counter += 1
+            stack.append((v, True))
+            for w in children[v]:
+                stack.append((w, False))
+
+    def getRoot(self):
+        return self._root
+
+    # Return immediate dominator of node i; root for root, -1 if unreachable
+    def getIDom(self, i):
+        return self._idom[i]
+
+    # Return array of immediate dominators (see getIDom)
+    def getIDoms(self):
+        return _frozen(self._idom, np.int32)
+
+    # Return reachable nodes in reverse post-order (from the root)
+    def getOrder(self):
+        return self._order
+
+    # Return reverse post-order number of node i; numNodes if unreachable
+    def getOrderNumber(self, i):
+        return self._rpo[i]
+
+    def isReachable(self, i):
+        return self._idom[i] != -1
+
+    # Return True if node a dominates node b (every node dominates itself)
+    def dominates(self, a, b):
+        if self._idom[a] == -1 or self._idom[b] == -1:
+            return False
+        return self._pre[a] <= self._pre[b] and self._post[b] <= self._post[a]
+
+''' ---------------------------------------------------------------------------
+Define the loop-nesting forest of a FrozenCFG:
+    - A retreating edge u -> h (h not after u in reverse post-order) is a
+      back edge if h dominates u; h is then a loop header, and its natural
+      loop the nodes that reach u without passing h
+    - Other retreating edges are irreducible (none in CFGs of While programs)
+    - Loops of the same header are merged; each loop is nested in the
+      innermost loop holding its header
+--------------------------------------------------------------------------- '''
+class LoopForest():
+    def __init__(self, frozen, dom=None):
+        dom = dom or DominatorTree(frozen)
+        n   = frozen.numNodes()
+        sources, targets = [a.tolist() for a in frozen.getEdgeArrays()]
+        pred_offsets, pred_targets, _ = frozen.getPredecessorCSR()
+        pred_offsets, pred_targets = pred_offsets.tolist(), pred_targets.tolist()
+
+        # Classify retreating edges
+        self._back_edges  = []
+        self._irreducible = []
+        latches = {} # Header -> sources of its back edges
+        for e in range(len(sources)):
+            u, h = sources[e], targets[e]
+            if not dom.isReachable(u) or dom.getOrderNumber(h) > dom.getOrderNumber(u):
+                continue
+            if dom.dominates(h, u):
+                self._back_edges.append(e)
+                latches.setdefault(h, []).append(u)
+            else:
+                self._irreducible.append(e)
+
+        # Collect loop bodies, innermost headers first (they come later in
+        # reverse post-order); a found loop is collapsed into its header by
+        # union-find, so outer loops step over it in one hop
+        self._header = [-1] * n # Innermost header of node's loop
+        self._parent = [-1] * n # Header of loop enclosing header's loop
+        rep  = list(range(n))
+        mark = [-1] * n
+        def _find(v):
+            root = v
+            while rep[root] != root:
+                root = rep[root]
+            while rep[v] != root:
+                rep[v], v = root, rep[v]
+            return root
+
+        self._headers = sorted(latches, key=dom.getOrderNumber, reverse=True)
+        for h in self._headers:
+            self._header[h] = h
+            mark[h] = h
+            stack = list(latches[h])
+            while stack:
+                x = _find(stack.pop())
+                if mark[x] == h:
+                    continue
+                mark[x] = h
+                rep[x]  = h
+                if self._header[x] == x:
+                    self._parent[x] = h # Inner loop, already collected
+                else:
+                    self._header[x] = h
+                for p in pred_targets[pred_offsets[x] : pred_offsets[x + 1]]:
+                    if dom.dominates(h, p):
+                        stack.append(p)
+        self._headers.reverse() # Outer headers first
+
+        # Loop depth of each header; outer headers are numbered first
+        self._depth = [0] * n
+        for h in self._headers:
+            parent = self._parent[h]
+            self._depth[h] = 1 + (self._depth[parent] if parent != -1 else 0)
+
+    # Return loop headers; outer headers first (reverse post-order)
+    def getHeaders(self):
+        return self._headers
+
+    def numLoops(self):
+        return len(self._headers)
+
+    # Return innermost loop header of node i; -1 if in no loop
+    def getHeader(self, i):
+        return self._header[i]
+
+    # Return header of the loop enclosing header h's loop; -1 if outermost
+    def getParent(self, h):
+        return self._parent[h]
+
+    # Return number of loops node i is in
+    def getDepth(self, i):
+        h = self._header[i]
+        return self._depth[h] if h != -1 else 0
+
+    # Return edge ids of back edges
+    def getBackEdges(self):
+        return self._back_edges
+
+    # Return edge ids of irreducible retreating edges
+    def getIrreducibleEdges(self):
+        return self._irreducible
+
+    def isReducible(self):
+        return len(self._irreducible) == 0
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return dominator tree (DominatorTree) of given CFG (or FrozenCFG); nodes are
+the indices of its FrozenCFG
+--------------------------------------------------------------------------- '''
+def get_dominators(cfg):
+    return DominatorTree(_frozen_of(cfg))
+
+''' ---------------------------------------------------------------------------
+Return post-dominator tree (DominatorTree) of given CFG (or FrozenCFG)
+--------------------------------------------------------------------------- '''
+def get_post_dominators(cfg):
+    return DominatorTree(_frozen_of(cfg), post=True)
+
+''' ---------------------------------------------------------------------------
+Return loop-nesting forest (LoopForest) of given CFG (or FrozenCFG)
+--------------------------------------------------------------------------- '''
+def get_loop_forest(cfg):
+    return LoopForest(_frozen_of(cfg))
@@ -6,9 +6,22 @@ Author : Harman Sran
 Helper functions for visualizing AST/ CFG and define constant keywords
 =========================================================================== """
 from io import StringIO
-from graphviz import Digraph
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import contextmanager
+from enum import IntEnum
+import contextvars
+import hashlib
+import itertools
+import json
 import os
+import re
+import shutil
+import subprocess
 import sys
+import threading
+import time
 
 
 """ ======================================================================= """
@@ -45,62 +58,158 @@ BI_EXPRS = [EQ, NEQ, GT, LT, GEQ, LEQ]
 
 AST_NODES = ATOMS + EXPRS
 
-# Special edge types; used for CFG to AST conversion
-LOOP_BACK  = "LOOP_BACK_EDGE"
-LOOP_ENTRY = "LOOP_ENTRY_EDGE"
-AMB_SPLIT  = "AMB_SPLIT_EDGE"
-AMB_JOIN   = "AMB_JOIN_EDGE"
-SEQ_TRANS  = "SEQ_EDGE"
-
+# Edge types; special types are used for CFG to AST conversion, and labeled
+# edges have type LABELED. Still ints (so edges compare and index by type
+# cheaply, and type arrays hold them as is), printed by name
+class EdgeType(IntEnum):
+    LABELED    = 0
+    LOOP_BACK  = 1
+    LOOP_ENTRY = 2
+    AMB_SPLIT  = 3
+    AMB_JOIN   = 4
+    SEQ_TRANS  = 5
+
+LABELED    = EdgeType.LABELED
+LOOP_BACK  = EdgeType.LOOP_BACK
+LOOP_ENTRY = EdgeType.LOOP_ENTRY
+AMB_SPLIT  = EdgeType.AMB_SPLIT
+AMB_JOIN   = EdgeType.AMB_JOIN
+SEQ_TRANS  = EdgeType.SEQ_TRANS
+
+# Special edge types
 EDGE_TYPES = [LOOP_BACK, LOOP_ENTRY, AMB_SPLIT, AMB_JOIN, SEQ_TRANS]
 
 # IMPORTANT: Variable names beginning with _flag are invalid
 flag_name = "_flag"
 """ ======================================================================= """
-""" ================== NODE ID HELPER   =================================== """
+""" ================== THIRD-PARTY IMPORTS ================================ """
+""" ======================================================================= """
+
+# Folder of these modules
+_CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+''' ---------------------------------------------------------------------------
+Import third-party modules (e.g. numpy) in this context: ast.py here shadows
+the standard library's ast module when run from this folder (as test.py is),
+and such modules import it (e.g. through inspect). Until the with block ends,
+this folder is taken off sys.path and the local ast module out of
+sys.modules, so they get the standard library's
+--------------------------------------------------------------------------- '''
+@contextmanager
+def stdlib_imports():
+    local = sys.modules.pop("ast", None)
+    path  = sys.path[:]
+    sys.path[:] = [p for p in path if os.path.abspath(p or os.curdir) != _CODE_DIR]
+    try:
+        yield
+    finally:
+        sys.path[:] = path
+        if local is None:
+            sys.modules.pop("ast", None)
+        else:
+            sys.modules["ast"] = local
+
 """ ======================================================================= """
+""" ================== PIPELINE CONTEXT =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define the state of one pipeline run (parse, CFG, conversion, normalization):
+    - Node ID allocator; IDs are unique over all ASTs/ CFGs made in it
+    - Flag name allocator; flag variables are unique over all normalizations
+    - Options, read by the stages (e.g. memoize for get_CFG; verbose for
+      normalize_ast)
+Each concurrent pipeline (thread, or asyncio task) runs in its own context,
+so they do not share IDs or flags. Given a namespace option, node IDs are
+"<namespace>:<n>"; so graphs of contexts with distinct namespaces never share
+node IDs, and can be drawn in one DOT document
+--------------------------------------------------------------------------- '''
+class PipelineContext():
+    def __init__(self, **options):
+        self._node_ids  = itertools.count() # next() is atomic; safe across threads
+        self._flag_ids  = itertools.count()
+        self._options   = options
+        self._namespace = options.get("namespace")
+
+    def nextNodeID(self):
+        if self._namespace is not None:
+            return self._namespace + ":" + str(next(self._node_ids))
+        return next(self._node_ids)
+
+    def resetNodeID(self):
+        self._node_ids = itertools.count()
+
+    def nextFlagName(self):
+        return flag_name + "_" + str(next(self._flag_ids))
+
+    def resetFlags(self):
+        self._flag_ids = itertools.count()
+
+    def getOption(self, name, default=None):
+        return self._options.get(name, default)
+
+# Context used when none is given; shared, and reset by each stage as it
+# starts, so programs processed one at a time get IDs/ flags from 0
+_g_context = PipelineContext()
+
+# Context the running thread/ task is in
+_current_context = contextvars.ContextVar("pipeline_context", default=_g_context)
+
+# Return context of the running thread/ task
+def current_context():
+    return _current_context.get()
+
+''' ---------------------------------------------------------------------------
+Run the enclosed code in context ctx (restored to the previous one after)
+--------------------------------------------------------------------------- '''
+@contextmanager
+def use_context(ctx):
+    token = _current_context.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current_context.reset(token)
 
-# Global Node ID; used to uniquely identify graph nodes
-_g_NID = 0
+''' ---------------------------------------------------------------------------
+Run a pipeline stage (e.g. get_AST) in context ctx; if None, in the current
+context. The shared default context is reset (node IDs and/ or flags) first,
+as the stages always did; an explicit context never is, so its IDs and flags
+stay unique for its whole run
+--------------------------------------------------------------------------- '''
+@contextmanager
+def pipeline_stage(ctx=None, reset_ids=False, reset_flags=False):
+    ctx = ctx or current_context()
+    if ctx is _g_context:
+        if reset_ids:
+            ctx.resetNodeID()
+        if reset_flags:
+            ctx.resetFlags()
+    with use_context(ctx):
+        yield ctx
 
-# Increment global node ID
-def increment_global_nodeID():
-    global _g_NID
-    _g_NID = _g_NID + 1
+""" ======================================================================= """
+""" ================== NODE ID HELPER   =================================== """
+""" ======================================================================= """
 
-# Get next global node ID; increment to keep unique
+# Get next node ID (of the current context); unique in it
 def nextNodeID():
-    next_id = _g_NID
-    increment_global_nodeID()
-    return next_id
+    return current_context().nextNodeID()
 
-# Reset global node ID
+# Reset node IDs of the current context
 def resetNodeID():
-    global _g_NID
-    _g_NID = 0
+    current_context().resetNodeID()
 
 """ ======================================================================= """
 """ ================== FLAG VAR NAME    =================================== """
 """ ======================================================================= """
 
-# Global Flag variable name; used to add new flag variables
-_g_flag = flag_name + "_0"
-
-# Increment flag variable name
-def increment_global_flag():
-    global _g_flag
-    _g_flag = flag_name + "_" + str(int(_g_flag.split("_")[-1]) + 1)
-
-# Get next global flag name; increment to keep unique
+# Get next flag variable name (of the current context); unique in it
 def nextFlagName():
-    next_flag = _g_flag
-    increment_global_flag()
-    return next_flag
+    return current_context().nextFlagName()
 
-# Reset global flag names
+# Reset flag names of the current context
 def resetFlags():
-    global _g_flag
-    _g_flag = flag_name + "_0"
+    current_context().resetFlags()
 
 """ ======================================================================= """
 """ ================== STRING HELPERS   =================================== """
@@ -143,82 +252,633 @@ def rbody(wp):
     return stmt_split(body(wp))[1]
 
 """ ======================================================================= """
-""" ================== AST VISUALIZATION=================================== """
+""" ================== TOKENIZER        =================================== """
+""" ======================================================================= """
+
+# Token kinds
+TOK_ATOM   = "ATOM"  # Keyword, variable or constant (e.g. SEQ, a, -1, TRUE)
+TOK_OP     = "OP"    # Binary expression operator (e.g. ==)
+TOK_LPAREN = "("
+TOK_RPAREN = ")"
+TOK_COMMA  = ","
+TOK_EOF    = "EOF"
+
+# One token per match, leading whitespace skipped; longest operators first so
+# that ">=" is never split into ">" and "=", and whitespace allowed inside an
+# operator (e.g. "> =") as it is anywhere else
+_TOKEN_PATTERN = r"\s*(?:(" + \
+                 "|".join(r"\s*".join(re.escape(c) for c in op) for op in \
+                          sorted(BI_EXPRS, key=len, reverse=True)) + \
+                 r")|([(),])|([^\s(),=!<>]+)|(\S))"
+_TOKEN_RE       = re.compile(_TOKEN_PATTERN)
+_TOKEN_RE_BYTES = re.compile(_TOKEN_PATTERN.encode("ascii"))
+
+# Decode token text scanned from a bytes-like source
+def _decode(text):
+    return text.decode("utf-8")
+
+''' ---------------------------------------------------------------------------
+Yield (kind, value, offset) tokens of while program wp in a single pass;
+whitespace is insignificant, so an atom or operator split by whitespace is
+yielded as one (e.g. "a b" -> "ab", "> =" -> ">="), and the stream always ends
+with a TOK_EOF token
+
+wp may be a str or any bytes-like buffer (bytes, memoryview, mmap); buffers
+are scanned in place, and only token values are copied out (as str)
+--------------------------------------------------------------------------- '''
+def tokenize(wp):
+    if isinstance(wp, str):
+        token_re, text = _TOKEN_RE, str
+    else:
+        token_re, text = _TOKEN_RE_BYTES, _decode
+
+    atom = None # Pending atom; [parts, offset]
+    for m in token_re.finditer(wp):
+        op, punct, value, bad = m.groups()
+        if value is not None:
+            if atom is None:
+                atom = [[text(value)], m.start(3)]
+            else:
+                atom[0].append(text(value))
+            continue
+
+        if atom is not None:
+            yield (TOK_ATOM, "".join(atom[0]), atom[1])
+            atom = None
+
+        if op is not None:
+            yield (TOK_OP, "".join(text(op).split()), m.start(1))
+        elif punct is not None:
+            yield (text(punct), text(punct), m.start(2))
+        elif bad is not None:
+            raise ValueError("Unexpected character '" + text(bad) + \
+                             "' at offset " + str(m.start(4)))
+
+    if atom is not None:
+        yield (TOK_ATOM, "".join(atom[0]), atom[1])
+    yield (TOK_EOF, None, len(wp))
+
+''' ---------------------------------------------------------------------------
+Define a one-token lookahead cursor over tokenize(wp) for the parser
+--------------------------------------------------------------------------- '''
+class TokenStream():
+    def __init__(self, wp):
+        self._tokens  = tokenize(wp)
+        self._current = next(self._tokens)
+
+    # Return (kind, value, offset) of the next token, without consuming it
+    def peek(self):
+        return self._current
+
+    # Consume and return the next token; TOK_EOF is returned indefinitely
+    def next(self):
+        token = self._current
+        if token[0] != TOK_EOF:
+            self._current = next(self._tokens)
+        return token
+
+    # Consume the next token and return its value; it must be of given kind
+    def expect(self, kind):
+        token = self.next()
+        if token[0] != kind:
+            found = TOK_EOF if token[0] == TOK_EOF else token[1]
+            raise ValueError("Expected " + kind + " but found " + found + \
+                             " at offset " + str(token[2]))
+        return token[1]
+
+""" ======================================================================= """
+""" ================== TRAVERSAL        =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Walk tree under root depth-first with an explicit stack (no recursion), so
+nesting depth is bounded by memory rather than the interpreter's stack:
+    - children(node)              -> list of node's children, walked in order;
+                                     called after enter(node)
+    - enter(node)                 -> state; called before node's children
+    - leave(node, state, results) -> result; called after node's children,
+                                     given the list of their results
+Return result of leave for root
+--------------------------------------------------------------------------- '''
+def walk(root, children, enter=None, leave=None):
+    results = []
+    stack   = [(root, None, None)] # (node, kids, state); kids set once entered
+    while stack:
+        node, kids, state = stack.pop()
+        if kids is None:
+            state = enter(node) if enter else None
+            kids  = children(node)
+            stack.append((node, kids, state))
+            for kid in reversed(kids):
+                stack.append((kid, None, None))
+        else:
+            first        = len(results) - len(kids)
+            kid_results  = results[first:]
+            del results[first:]
+            results.append(leave(node, state, kid_results) if leave else None)
+    return results[0]
+
+# Return child ASTs of ast (left, then right)
+def ast_children(ast):
+    return [child for child in (ast.getLeft(), ast.getRight()) if child]
+
+""" ======================================================================= """
+""" ================== DOT WRITER       =================================== """
 """ ======================================================================= """
 def mkdir(dir):
     if not os.path.exists(dir):
         os.makedirs(dir)
 
+# DOT quoting; as graphviz quotes Digraph IDs and labels, so the text written
+# is the same as Digraph.source. Node IDs are never split into node:port (as
+# Digraph.edge does), so namespaced IDs (e.g. "prog:12") are quoted whole
+_DOT_ID       = re.compile(r"([a-zA-Z_][a-zA-Z0-9_]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))$")
+_DOT_HTML     = re.compile(r"<.*>$", re.DOTALL)
+_DOT_KEYWORDS = {"node", "edge", "graph", "digraph", "subgraph", "strict"}
+_DOT_QUOTE    = re.compile(r'(?P<backslashes>(?:\\{2})*)\\?(?P<quote>")')
+
+# Return DOT ID of string; quoted (with unescaped quotes escaped) if needed
+def _dot_quote(identifier):
+    if _DOT_HTML.match(identifier):
+        return identifier
+    if not _DOT_ID.match(identifier) or identifier.lower() in _DOT_KEYWORDS:
+        return '"' + _DOT_QUOTE.sub(r"\g<backslashes>\\\g<quote>", identifier) + '"'
+    return identifier
+
+# Return DOT attribute list " [k=v ...]" (label first); "" if none
+def _dot_attrs(label=None, attrs=None):
+    items = ["label=" + _dot_quote(label)] if label is not None else []
+    items += [_dot_quote(k) + "=" + _dot_quote(v) for k, v in sorted((attrs or {}).items())]
+    return " [" + " ".join(items) + "]" if items else ""
+
 ''' ---------------------------------------------------------------------------
-Fill dot object with AST node data
+Define a DOT digraph writer; each node/ edge is written to out (anything with
+write; e.g. a file, or socket.makefile("w")) as it is added, rather than held
+as a whole (as by a graphviz Digraph). The text is the same as that of a
+Digraph given the same calls (node_attr given up front)
+    - Subgraphs (e.g. cluster_* blocks) are opened/ closed by beginSubgraph/
+      endSubgraph; nodes and edges go to the innermost open one
+    - Node IDs are written as "<namespace>:<id>" while a namespace is set
+      (setNamespace); so graphs with the same node IDs (e.g. an AST and its
+      CFG) can be written to one document
+    - A SHA-256 of the text written so far is kept (getDigest)
+    - Call close (or use as a context manager) to end the graph
 --------------------------------------------------------------------------- '''
-def ast_to_dot(dot, ast):
-    # Add root
-    dot.node(ast.getID(), ast.getValue())
+class DotWriter():
+    def __init__(self, out, comment=None, node_attr=None):
+        self._out       = out
+        self._hash      = hashlib.sha256()
+        self._indent    = "\t"
+        self._namespace = None
+        if comment is not None:
+            self._write("// " + comment + "\n")
+        self._write("digraph {\n")
+        if node_attr:
+            self._write("\tnode" + _dot_attrs(attrs=node_attr) + "\n")
+
+    def _write(self, text):
+        self._out.write(text)
+        self._hash.update(text.encode("utf-8"))
+
+    # Return DOT ID of node name, in the current namespace
+    def _id(self, name):
+        return _dot_quote(name if self._namespace is None else self._namespace + ":" + name)
+
+    # Set namespace of the node IDs written next; None for none
+    def setNamespace(self, namespace):
+        self._namespace = namespace
+
+    def node(self, name, label=None, attrs=None):
+        self._write(self._indent + self._id(name) + _dot_attrs(label, attrs) + "\n")
+
+    def edge(self, tail, head, label=None, attrs=None):
+        self._write(self._indent + self._id(tail) + " -> " + self._id(head) + \
+                    _dot_attrs(label, attrs) + "\n")
+
+    # Open subgraph name (with graph attributes attrs); cluster_* names are
+    # drawn as boxes by dot
+    def beginSubgraph(self, name, attrs=None):
+        self._write(self._indent + "subgraph " + _dot_quote(name) + " {\n")
+        self._indent += "\t"
+        if attrs:
+            self._write(self._indent + _dot_attrs(attrs=attrs)[2:-1] + "\n")
+
+    def endSubgraph(self):
+        assert len(self._indent) > 1
+        self._indent = self._indent[:-1]
+        self._write(self._indent + "}\n")
+
+    def close(self):
+        self._write("}\n")
+
+    # Return hex SHA-256 of the text written so far
+    def getDigest(self):
+        return self._hash.hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+''' ---------------------------------------------------------------------------
+Run dot_binary (dot) on DOT file gv_path; write gv_path.fmt, and return its
+path. Raise CalledProcessError if dot fails (FileNotFoundError if missing)
+--------------------------------------------------------------------------- '''
+def _run_dot(gv_path, fmt="pdf", dot_binary="dot"):
+    out_path = gv_path + "." + fmt
+    subprocess.run([dot_binary, "-T" + fmt, "-o", out_path, gv_path], \
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return out_path
+
+""" ======================================================================= """
+""" ================== RENDER QUEUE     =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define a queue of Graphviz render jobs, run by a pool of worker threads; each
+job runs dot on a .gv file (written first from DOT source, if given): folder/
+name.gv -> folder/name.gv.pdf. At most workers dot processes run at once; the
+threads only wait on them, so the caller keeps working meanwhile
+    - submit returns a Future of the rendered file's path; a dot that fails
+      (or is missing) raises its error (e.g. CalledProcessError) from it.
+      asyncio code can await it with asyncio.wrap_future
+    - dot_binary is the dot executable (e.g. a stub, for testing), and fmt
+      the output format
+--------------------------------------------------------------------------- '''
+class RenderQueue():
+    def __init__(self, workers=None, dot_binary="dot", fmt="pdf"):
+        self._pool       = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self._dot_binary = dot_binary
+        self._fmt        = fmt
+        self._futures    = []
+
+    ''' -----------------------------------------------------------------------
+    Queue rendering of DOT source (None: already in gv_path) to gv_path.fmt;
+    return Future of the rendered path. If given, then(rendered path) is
+    called by the job once rendered (before the Future is done)
+    ----------------------------------------------------------------------- '''
+    def submit(self, source, gv_path, then=None):
+        future = self._pool.submit(self._render, source, gv_path, then)
+        self._futures.append(future)
+        return future
+
+    def getFormat(self):
+        return self._fmt
+
+    def _render(self, source, gv_path, then):
+        if source is not None:
+            with open(gv_path, "w", encoding="utf-8") as f:
+                f.write(source)
+        out_path = _run_dot(gv_path, self._fmt, self._dot_binary)
+        if then is not None:
+            then(out_path)
+        return out_path
+
+    ''' -----------------------------------------------------------------------
+    Wait for all jobs queued so far; return their rendered paths, in order.
+    Raise the error of the first failed job (after all have finished)
+    ----------------------------------------------------------------------- '''
+    def join(self):
+        futures, self._futures = self._futures, []
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    # Wait for queued jobs (their errors are left in their futures)
+    def __exit__(self, *exc):
+        self.shutdown()
+
+""" ======================================================================= """
+""" ================== RENDER CACHE     =================================== """
+""" ======================================================================= """
 
-    # Add left child to root
-    lchild = ast.getLeft()
-    if lchild:        
-        ast_to_dot(dot, lchild)
-        dot.edge(ast.getID(), lchild.getID())
+''' ---------------------------------------------------------------------------
+Define a content-hash cache of rendered graphs, kept in folder:
+    - A render's key is the hash of its DOT source (its digest) and render
+      options (e.g. show_epsilons, output format)
+    - If a graph's output pair (.gv and rendered file) already holds the
+      render of its key, nothing is done; if the key was rendered before (to
+      any output), the rendered file is restored from the cache; dot is run
+      only for new keys
+    - Rendered files are kept by key; once they total over max_bytes, the
+      least recently used are evicted
+    - A manifest (folder/manifest.json) records each key's size and last use,
+      and the key each output pair holds; written by save (or on exit, as a
+      context manager)
+Safe to use from the worker threads of a RenderQueue
+--------------------------------------------------------------------------- '''
+class RenderCache():
+    def __init__(self, folder=".render_cache/", max_bytes=256 << 20):
+        self._folder    = folder
+        self._max_bytes = max_bytes
+        self._lock      = threading.Lock()
+        self._entries   = {} # Key -> {"size": bytes, "used": time of last use}
+        self._outputs   = {} # Output .gv path (absolute) -> key of its render
+        self._hits      = 0
+        self._misses    = 0
+        mkdir(folder)
+        if os.path.exists(self._manifestPath()):
+            with open(self._manifestPath()) as f:
+                manifest = json.load(f)
+            self._entries = manifest["entries"]
+            self._outputs = manifest["outputs"]
+
+    def _manifestPath(self):
+        return os.path.join(self._folder, "manifest.json")
+
+    # Return path of the cached render of key
+    def _storedPath(self, key, fmt):
+        return os.path.join(self._folder, key + "." + fmt)
+
+    # Return key of a render of DOT source (given its digest) with options
+    def key(self, digest, options):
+        h = hashlib.sha256(digest.encode("utf-8"))
+        h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    ''' -----------------------------------------------------------------------
+    Return rendered path (gv_path.fmt) of the render of key (its source in
+    gv_path), if up to date or restored from the cache; else None
+    ----------------------------------------------------------------------- '''
+    def fetch(self, key, gv_path, fmt):
+        out_path = gv_path + "." + fmt
+        with self._lock:
+            current = self._outputs.get(os.path.abspath(gv_path)) == key and \
+                      os.path.exists(out_path)
+            if not current:
+                if key not in self._entries or not os.path.exists(self._storedPath(key, fmt)):
+                    self._misses += 1
+                    return None
+                shutil.copyfile(self._storedPath(key, fmt), out_path)
+                self._outputs[os.path.abspath(gv_path)] = key
+            if key in self._entries:
+                self._entries[key]["used"] = time.time()
+            self._hits += 1
+            return out_path
+
+    ''' -----------------------------------------------------------------------
+    Add the render of key (just rendered to gv_path.fmt) to the cache; evict
+    least recently used renders over max_bytes
+    ----------------------------------------------------------------------- '''
+    def add(self, key, gv_path, fmt):
+        out_path = gv_path + "." + fmt
+        with self._lock:
+            shutil.copyfile(out_path, self._storedPath(key, fmt))
+            self._entries[key] = {"size": os.path.getsize(out_path), "used": time.time(), "format": fmt}
+            self._outputs[os.path.abspath(gv_path)] = key
+            self._evict()
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["used"]):
+            if total <= self._max_bytes:
+                break
+            entry = self._entries.pop(key)
+            total -= entry["size"]
+            stored = self._storedPath(key, entry["format"])
+            if os.path.exists(stored):
+                os.remove(stored)
+
+    # Return (hits, misses) since created
+    def getStats(self):
+        return self._hits, self._misses
+
+    # Return total size of cached renders (bytes)
+    def getSize(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._entries.values())
+
+    # Write manifest (replacing the old one at once)
+    def save(self):
+        with self._lock:
+            tmp_path = self._manifestPath() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": self._entries, "outputs": self._outputs}, f)
+            os.replace(tmp_path, self._manifestPath())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+# Cache used by visualize_ast/ visualize_cfg when none is given; None for none
+_g_render_cache = None
+
+# Set cache used by default (None for none); return the previous one
+def set_render_cache(cache):
+    global _g_render_cache
+    previous, _g_render_cache = _g_render_cache, cache
+    return previous
 
-    # Add right child to root
-    rchild = ast.getRight()
-    if rchild:
-        ast_to_dot(dot, rchild)
-        dot.edge(ast.getID(), rchild.getID())
+''' ---------------------------------------------------------------------------
+Render DOT file graph (a .gv path; its source's digest given), with given
+render options; through cache (if any; else the default cache) and queue (if
+any). Return rendered path, or its Future if queued (already done if cached)
+--------------------------------------------------------------------------- '''
+def _render_gv(graph, digest, options, queue=None, cache=None):
+    cache = cache or _g_render_cache
+    fmt   = queue.getFormat() if queue is not None else "pdf"
+    key   = None
+    if cache is not None:
+        key = cache.key(digest, dict(options, format=fmt))
+        out_path = cache.fetch(key, graph, fmt)
+        if out_path is not None:
+            if queue is None:
+                return out_path
+            future = Future()
+            future.set_result(out_path)
+            return future
+
+    if queue is not None:
+        then = (lambda out_path: cache.add(key, graph, fmt)) if key is not None else None
+        return queue.submit(None, graph, then)
+    _run_dot(graph, fmt)
+    if key is not None:
+        cache.add(key, graph, fmt)
+    return graph + "." + fmt
 
 ''' ---------------------------------------------------------------------------
-Use graphViz to render AST and save in folder as name
+Write a graph to folder/name.gv (creating folder) with write_fn(out), which
+returns the digest of the text written, and render it with given render
+options (see _render_gv). Return rendered path, or its Future if queued; the
+.gv path if not render
 --------------------------------------------------------------------------- '''
-def visualize_ast(ast, name="ast", folder="asts/"):
-    # Create folder, and sub-folder for this ast - unless exists
-    afolder = folder + name + "/"
+def _visualize(write_fn, name, folder, options, queue, cache, render):
     mkdir(folder)
-    mkdir(afolder)
+    graph = folder + name + ".gv"
+    with open(graph, "w", encoding="utf-8") as f:
+        digest = write_fn(f)
+    if not render:
+        return graph
+    return _render_gv(graph, digest, options, queue, cache)
+
+""" ======================================================================= """
+""" ================== AST VISUALIZATION=================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Fill dot object (DotWriter, or graphviz Digraph) with AST node data; a node
+shared by several parents (e.g. after hash_cons, or normalize_ast_direct) is
+written once, with an edge from each parent
+--------------------------------------------------------------------------- '''
+def ast_to_dot(dot, ast):
+    written = set()
+    stack   = [ast] # AST node to write (with its sub-tree), or (parent, child) edge
+
+    # Same order as a recursive walk: node, then per child its sub-tree and the
+    # edge to it; a shared node's sub-tree only under the first parent
+    while stack:
+        item = stack.pop()
+        if isinstance(item, tuple):
+            dot.edge(item[0].getID(), item[1].getID())
+        elif item not in written:
+            written.add(item)
+            dot.node(item.getID(), item.getValue())
+            for child in reversed(ast_children(item)):
+                stack.append((item, child))
+                stack.append(child)
 
-    # Generate DOT format graph, given AST
-    dot = Digraph(comment=name)
-    ast_to_dot(dot, ast)
+''' ---------------------------------------------------------------------------
+Write AST in DOT format to out (see DotWriter), as it is walked; return digest
+of the text written
+--------------------------------------------------------------------------- '''
+def write_ast_dot(ast, out, name="ast"):
+    with DotWriter(out, comment=name) as dot:
+        ast_to_dot(dot, ast)
+    return dot.getDigest()
 
-    # Render graph and save as { folder/name/name.gv; folder/name/name.pdf }
-    graph = afolder + name + ".gv"
-    dot.render(graph)
-    print("\nAST \'" + name + "\' saved to " + graph)
+''' ---------------------------------------------------------------------------
+Use graphViz to render AST and save in folder as name; return the rendered
+path, or if a RenderQueue is given (rendering is queued on it) its Future.
+Renders unchanged since the last run are skipped, with a RenderCache (cache,
+or the default). If not render, only the .gv file is written (and its path
+returned)
+--------------------------------------------------------------------------- '''
+def visualize_ast(ast, name="ast", folder="asts/", queue=None, cache=None, render=True):
+    # Write DOT format graph, given AST, to folder/name/name.gv; and render it
+    # as folder/name/name.gv.pdf
+    result = _visualize(lambda out: write_ast_dot(ast, out, name), \
+                        name, folder + name + "/", {}, queue, cache, render)
+    if render and queue is None:
+        print("\nAST \'" + name + "\' saved to " + result)
+    return result
 
 """ ======================================================================= """
 """ ================== CFG VISUALIZATION=================================== """
 """ ======================================================================= """
 
+# Sort key of edges; by source, then endpoint node ID (then label)
+def _edge_order(e):
+    return (e.getSource().getID(), e.getEndpoint().getID(), e.getData())
+
 ''' ---------------------------------------------------------------------------
-Fill dot object with edge data
+Fill dot object (DotWriter, or graphviz Digraph) with edge data
 --------------------------------------------------------------------------- '''
 def populate_dot(dot, edges, show_eps):
     for e in edges:
         dot.edge(e.getSource().getID(), e.getEndpoint().getID(), \
-                 # Hide epsilons
-                 label= "" if (e.getData() == EPS) and not show_eps else \
-                        " " + e.getData() + " ")
+                 label=_edge_label(e, show_eps))
+
+# Return DOT label of edge
+def _edge_label(e, show_eps):
+    # Hide epsilons
+    return "" if (e.getData() == EPS) and not show_eps else " " + e.getData() + " "
+
+''' ---------------------------------------------------------------------------
+Write CFG in DOT format to out (see DotWriter), edge by edge; return digest of
+the text written. Edges are written in node ID order, so an unchanged CFG
+gives the same text
+--------------------------------------------------------------------------- '''
+def write_cfg_dot(cfg, out, name="cfg", show_epsilons=True, show_node_labels=True):
+    # Hide node labels
+    node_attr = {} if show_node_labels else {"label": ""}
+    with DotWriter(out, comment=name, node_attr=node_attr) as dot:
+        populate_dot(dot, sorted(cfg.getEdgeSet(), key=_edge_order), show_epsilons)
+    return dot.getDigest()
 
 ''' ---------------------------------------------------------------------------
-Use graphViz to render graph cfg and save in folder as name
+Use graphViz to render graph cfg and save in folder as name; return the
+rendered path, or if a RenderQueue is given (rendering is queued on it) its
+Future. Renders unchanged since the last run are skipped, with a RenderCache
+(cache, or the default). If not render, only the .gv file is written (and
+its path returned)
 --------------------------------------------------------------------------- '''
 def visualize_cfg(cfg, name="cfg", folder="cfgs/", \
-                  show_epsilons=True, show_node_labels=True):
-    # Create folder, and sub-folder for this graph - unless exists
-    gfolder = folder + name + "/"
-    mkdir(folder)
-    mkdir(gfolder)
+                  show_epsilons=True, show_node_labels=True, queue=None, cache=None, \
+                  render=True):
+    # Write DOT format graph, given cfg's Edge set, to folder/name/name.gv; and
+    # render it as folder/name/name.gv.pdf
+    options = {"show_epsilons": show_epsilons, "show_node_labels": show_node_labels}
+    result  = _visualize(lambda out: write_cfg_dot(cfg, out, name, show_epsilons, show_node_labels), \
+                         name, folder + name + "/", options, queue, cache, render)
+    if render and queue is None:
+        print("\nCFG \'" + name + "\' saved to " + result)
+    return result
+
+""" ======================================================================= """
+""" ================== BATCH VISUALIZATION ================================ """
+""" ======================================================================= """
 
-    # Generate DOT format graph, given cfg's Edge set
-    dot = Digraph(comment=name)
-    populate_dot(dot, cfg.getEdgeSet(), show_epsilons)
+''' ---------------------------------------------------------------------------
+Write graphs ((name, AST or CFG) pairs; any iterable, consumed one at a time)
+in DOT format to out as one document; each graph is a cluster (labeled with
+its name), with its node IDs in namespace name. Return digest of the text
+written. Raise ValueError if two graphs have the same name
+--------------------------------------------------------------------------- '''
+def write_graphs_dot(graphs, out, name="batch", show_epsilons=True, show_node_labels=True):
+    # Hide node labels (of CFGs; AST nodes are labeled explicitly)
+    node_attr = {} if show_node_labels else {"label": ""}
+    names     = set()
+    with DotWriter(out, comment=name, node_attr=node_attr) as dot:
+        for graph_name, graph in graphs:
+            if graph_name in names:
+                raise ValueError("Graph name used twice in one batch: " + graph_name)
+            names.add(graph_name)
+
+            dot.beginSubgraph("cluster_" + graph_name, {"label": graph_name})
+            dot.setNamespace(graph_name)
+            if hasattr(graph, "getEdgeSet"): # CFG
+                populate_dot(dot, sorted(graph.getEdgeSet(), key=_edge_order), show_epsilons)
+            else:
+                ast_to_dot(dot, graph)
+            dot.setNamespace(None)
+            dot.endSubgraph()
+    return dot.getDigest()
 
-    # Hide node labels
-    if not show_node_labels:
-        dot.node_attr["label"] = ""
+''' ---------------------------------------------------------------------------
+Use graphViz to render many graphs ((name, AST or CFG) pairs) with one dot
+run per per_file graphs, rather than one per graph; saved in folder as
+{ folder/name/name_<k>.gv; folder/name/name_<k>.gv.pdf }, for k = 0, 1, ...
+Graphs are written as they are taken from graphs (any iterable). Return the
+rendered paths (or their Futures, with a RenderQueue); the .gv paths if not
+render
+--------------------------------------------------------------------------- '''
+def visualize_batch(graphs, name="batch", folder="batches/", per_file=64, \
+                    show_epsilons=True, show_node_labels=True, queue=None, cache=None, \
+                    render=True):
+    bfolder = folder + name + "/"
+    options = {"show_epsilons": show_epsilons, "show_node_labels": show_node_labels}
+    results = []
+    graphs  = iter(graphs)
+    for k in itertools.count():
+        first = next(graphs, None)
+        if first is None:
+            break
+        group = itertools.chain([first], itertools.islice(graphs, per_file - 1))
+
+        # Write DOT format document of this group to folder/name/name_<k>.gv;
+        # and render it
+        gname = name + "_" + str(k)
+        results.append(_visualize(lambda out: write_graphs_dot(group, out, gname, show_epsilons, show_node_labels), \
+                                  gname, bfolder, options, queue, cache, render))
+    if render and queue is None:
+        print("\nBatch \'" + name + "\' (" + str(len(results)) + " files) saved to " + bfolder)
+    return results
 
-    # Render graph and save as { folder/name/name.gv; folder/name/name.pdf }
-    graph = gfolder + name + ".gv"
-    dot.render(graph)
-    print("\nCFG \'" + name + "\' saved to " + graph)
\ No newline at end of file
@@ -12,12 +12,26 @@ from lib import *
 from ast import *
 from cfg import *
 from conv import _get_next_seq
+from conv import _get_end_node
 from conv import to_ast
+from region import get_region_tree
+from cfg import _stmt_children
+from cfg import _generate_ASSIGN_CFG
+from cfg import _generate_ASSUME_CFG
+from collections import deque
 
 """ ======================================================================= """
 """ ==================     PRIVATE FUNCTIONS      ========================= """
 """ ======================================================================= """
 
+''' ---------------------------------------------------------------------------
+Define the error the site rewrites (_normalize_cfg) raise for a program shape
+they do not handle; the CFG is then left equivalent to the given one, so the
+caller may normalize it another way. Any other error is a real failure
+--------------------------------------------------------------------------- '''
+class _UnsupportedShapeError(ValueError):
+    pass
+
 ''' ---------------------------------------------------------------------------
 Return edges in set that are not LOOP_BACK or AMB_JOIN
 --------------------------------------------------------------------------- '''
@@ -25,40 +39,36 @@ def _get_valid_edges(edges):
     return [e for e in edges if e.getType() not in [LOOP_BACK, AMB_JOIN]]
 
 ''' ---------------------------------------------------------------------------
-Return the LOOP_ENTRY edge in set
+Return the LOOP_ENTRY edge of LOOP node; must exist
 --------------------------------------------------------------------------- '''
 def _get_loop_entry_edge(node):
-    for e in node.getOutgoingEdges():
-        if e.getType() == LOOP_ENTRY:
-            return e
-    raise ValueError("Calling _get_loop_entry_edge when no LOOP_ENTRY edge exists in set!")
+    if node.getLoopEntryEdge() is None:
+        raise ValueError("Calling _get_loop_entry_edge when no LOOP_ENTRY edge exists in set!")
+    return node.getLoopEntryEdge()
 
 ''' ---------------------------------------------------------------------------
-Return the LOOP_OUT (not LOOP_ENTRY) edge in set; must exist
+Return the LOOP_OUT (not LOOP_ENTRY) edge of LOOP node; must exist
 --------------------------------------------------------------------------- '''
 def _get_loop_out_edge(node):
-    for e in node.getOutgoingEdges():
-        if e.getType() != LOOP_ENTRY:
-            return e
-    raise ValueError("Calling _get_loop_out_edge when no LOOP_OUT edge exists in set!")
+    if node.getLoopOutEdge() is None:
+        raise ValueError("Calling _get_loop_out_edge when no LOOP_OUT edge exists in set!")
+    return node.getLoopOutEdge()
 
 ''' ---------------------------------------------------------------------------
-Return the LOOP_IN (not LOOP_BACK) edge in set; must exist
+Return the LOOP_IN (not LOOP_BACK) edge of LOOP node; must exist
 --------------------------------------------------------------------------- '''
 def _get_loop_in_edge(node):
-    for e in node.getIncomingEdges():
-        if e.getType() != LOOP_BACK:
-            return e
-    raise ValueError("Calling _get_loop_in_edge when no LOOP_IN edge exists in set!")
+    if node.getLoopInEdge() is None:
+        raise ValueError("Calling _get_loop_in_edge when no LOOP_IN edge exists in set!")
+    return node.getLoopInEdge()
 
 ''' ---------------------------------------------------------------------------
-Return the LOOP_BACK edge in set; must exist
+Return the LOOP_BACK edge of LOOP node; must exist
 --------------------------------------------------------------------------- '''
 def _get_loop_back_edge(node):
-    for e in node.getIncomingEdges():
-        if e.getType() == LOOP_BACK:
-            return e
-    raise ValueError("Calling _get_loop_back_edge when no LOOP_BACK edge exists in set!")
+    if node.getLoopBackEdge() is None:
+        raise ValueError("Calling _get_loop_back_edge when no LOOP_BACK edge exists in set!")
+    return node.getLoopBackEdge()
 
 ''' ---------------------------------------------------------------------------
 Return the previous node (for non-LOOP node)
@@ -69,6 +79,18 @@ def _get_prev(node):
     for e in in_edges:
         return e.getSource()
 
+''' ---------------------------------------------------------------------------
+Raise _UnsupportedShapeError unless LOOP node is padded; a statement (not a
+LOOP) right before and after it in its block, linked by SEQ transitions. The
+rewrites cut the program at these edges, so check before modifying the CFG
+--------------------------------------------------------------------------- '''
+def _check_padded(node):
+    in_edge  = node.getLoopInEdge()
+    out_edge = node.getLoopOutEdge()
+    if in_edge is None or in_edge.getType() != SEQ_TRANS or in_edge.getSource().getType() == LOOP or \
+       out_edge is None or out_edge.getType() != SEQ_TRANS or out_edge.getEndpoint().getType() == LOOP:
+        raise _UnsupportedShapeError("LOOP node " + node.getID() + " is not padded by a statement before and after it")
+
 ''' ---------------------------------------------------------------------------
 Remove all 4 edges (LOOP_ENTRY, LOOP_OUT; and LOOP_BACK, LOOP_IN)
 --------------------------------------------------------------------------- '''
@@ -77,13 +99,13 @@ def _nuke_while_node(cfg, node):
     assert len(loop_in_edges) == 2
     for e in loop_in_edges:
         e.getSource().delOutgoingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
     loop_out_edges = node.getOutgoingEdges()
     assert len(loop_out_edges) == 2
     for e in loop_out_edges:
         e.getEndpoint().delIncomingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
 ''' ---------------------------------------------------------------------------
 Remove all 4 edges (2x AMB_SPLIT, 2x AMB_JOIN)
@@ -94,11 +116,11 @@ def _nuke_amb_node(cfg, node):
     for e in amb_split_edges:
         assert e.getType() == AMB_SPLIT
         e.getEndpoint().delIncomingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
     for e in node.getIncomingEdges():
         e.getSource().delOutgoingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
     exit_node = node.getAMBExit()
     amb_join_edges = exit_node.getIncomingEdges()
@@ -106,11 +128,11 @@ def _nuke_amb_node(cfg, node):
     for e in amb_join_edges:
         assert e.getType() == AMB_JOIN
         e.getSource().delOutgoingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
     for e in exit_node.getOutgoingEdges():
         e.getEndpoint().delIncomingEdge(e)
-        cfg.removeEdges(set([e]))
+        cfg.removeEdge(e)
 
 
 ''' ---------------------------------------------------------------------------
@@ -126,7 +148,7 @@ def _flag_cfg(cfg, flag, t, val):
     flag_cfg.setEntryNode(entryNode)
     flag_cfg.setExitNode(exitNode)
 
-    cfg.unionEdges(set([edge]))
+    cfg.addEdge(edge)
 
     return flag_cfg, entryNode, exitNode
 
@@ -137,7 +159,7 @@ def _connect(cfg, src, dst):
     epsilonEdge = Edge(EPS, src, dst, SEQ_TRANS)
     src.addOutgoingEdge(epsilonEdge)
     dst.addIncomingEdge(epsilonEdge)
-    cfg.unionEdges(set([epsilonEdge]))
+    cfg.addEdge(epsilonEdge)
 
 ''' ---------------------------------------------------------------------------
 Chain two CFGs together with epsilon edge _chain(cfg, first_cfg, second_cfg)
@@ -178,7 +200,7 @@ def _create_amb(cfg, lcfg, rcfg):
     amb_cfg.setEntryNode(entryNode)
     amb_cfg.setExitNode(exitNode)
 
-    cfg.unionEdges(set([entryLeftOutEdge, entryRightOutEdge, exitLeftInEdge, exitRightInEdge]))
+    cfg.unionEdges([entryLeftOutEdge, entryRightOutEdge, exitLeftInEdge, exitRightInEdge])
 
     return amb_cfg
 
@@ -203,7 +225,7 @@ def _create_loop(cfg, body_cfg):
     while_cfg.setEntryNode(whileNode)
     while_cfg.setExitNode(whileNode)
 
-    cfg.unionEdges(set([loopEntryEdge, loopBackEdge]))
+    cfg.unionEdges([loopEntryEdge, loopBackEdge])
 
     return while_cfg
 
@@ -211,6 +233,7 @@ def _create_loop(cfg, body_cfg):
 ''' ---------------------------------------------------------------------------
 Reduce all back edges on the top-level of the program (ignoring inside LOOP/ AMB)
 into one back edge - this function SHOULD NOT be recursively called, passes once
+- Raise _UnsupportedShapeError (before merging them) if two LOOPs are not padded
 --------------------------------------------------------------------------- '''
 def _normalize_seq_cfg(cfg):
     node = cfg.getEntryNode()
@@ -221,6 +244,8 @@ def _normalize_seq_cfg(cfg):
         if node.getType() == LOOP:
             if first_while_node:
                 second_while_node = node
+                _check_padded(first_while_node)
+                _check_padded(second_while_node)
                 flag = nextFlagName()
                 ''' Pre-algorithm Construction Phase '''
                 # Construct <pre1>
@@ -264,22 +289,20 @@ def _normalize_seq_cfg(cfg):
                     _connect(cfg, pre1.getExitNode(), flagEntry_1)
 
                 # while * do
-                #   if flag ∧ * then flag := false
-                #                    <post1>
-                #                    <pre2>
-                #   if flag then <body1>
-                #           else <body2>
+                #   either [flag]      <body1>
+                #   or     [flag]      flag := false
+                #                      <post1>
+                #                      <pre2>
+                #   or     [not flag]  <body2>
                 flag_cfg_2, flagEntry_2, flagExit_2 = _flag_cfg(cfg, flag, ASSUME, TRUE)
                 flag_cfg_3, flagEntry_3, flagExit_3 = _flag_cfg(cfg, flag, ASSIGN, FALSE)
-                flag_cfg_4, flagEntry_4, flagExit_4 = _flag_cfg(cfg, flag, ASSUME, FALSE)
                 flag_cfg_5, flagEntry_5, flagExit_5 = _flag_cfg(cfg, flag, ASSUME, TRUE)
                 flag_cfg_6, flagEntry_6, flagExit_6 = _flag_cfg(cfg, flag, ASSUME, FALSE)
 
-                single_loop_cfg = _create_loop(cfg, _chain(cfg, _create_amb(cfg, \
-                                                                            _chain(cfg, _chain(cfg, flag_cfg_2, flag_cfg_3), inter), \
-                                                                           flag_cfg_4),
+                single_loop_cfg = _create_loop(cfg, _create_amb(cfg, \
+                                                                _chain(cfg, flag_cfg_5, body1), \
                                                                 _create_amb(cfg, \
-                                                                            _chain(cfg, flag_cfg_5, body1), \
+                                                                            _chain(cfg, _chain(cfg, flag_cfg_2, flag_cfg_3), inter), \
                                                                             _chain(cfg, flag_cfg_6, body2))))
 
                 _connect(cfg, flagExit_1, single_loop_cfg.getEntryNode())
@@ -297,271 +320,523 @@ def _normalize_seq_cfg(cfg):
         node = _get_next_seq(node, node.getType())
 
 ''' ---------------------------------------------------------------------------
-Return first LOOP node on this branch of AMB, if exists
---------------------------------------------------------------------------- '''
-def _get_while_on_branch(amb_branch_node):
-    start_node = amb_branch_node
-    while amb_branch_node and (AMB_JOIN not in [e.getType() for e in amb_branch_node.getOutgoingEdges()]):
-        if amb_branch_node.getType() == LOOP:
-            # Get exit node of this amb branch too
-            final_node = amb_branch_node
-            n = _get_next_seq(final_node, final_node.getType())
-            while n:
-                final_node = n
-                n = _get_next_seq(final_node, final_node.getType())
-            if amb_branch_node == final_node:
-                print("WARNING: A LOOP node is terminating an AMB branch, pad LOOP after with ASSUME(TRUE)")
-            if amb_branch_node == start_node:
-                print("WARNING: A LOOP node is starting an AMB branch, pad LOOP before with ASSUME(TRUE)")
-            return amb_branch_node, start_node, final_node
-        amb_branch_node = _get_next_seq(amb_branch_node, amb_branch_node.getType())
-    return None, None, None
-
-''' ---------------------------------------------------------------------------
-Scan for branching back edges in all sub-structures (e.g. in AMBs and LOOPs)
-... and reduce to a single back edge per sub-structure
-- CFG modified in place
-- Transplant the AMB block
+Return first LOOP node on this branch (region) of AMB, with the branch's entry
+and exit nodes; if exists
+--------------------------------------------------------------------------- '''
+def _get_while_on_branch(branch):
+    while_node = branch.getFirstLoop()
+    if while_node is None:
+        return None, None, None
+    start_node = branch.getEntry()
+    final_node = _get_end_node(branch.getLast(), branch.getLast().getType())
+    return while_node, start_node, final_node
+
+''' ---------------------------------------------------------------------------
+Rewrite AMB site node, if both of its branches hold a LOOP on their top-level,
+into one back edge (transplant the AMB block around a single LOOP):
+- CFG, and its region tree, modified in place
+- Return list of new sites (LOOP/ AMB nodes) the rewrite may have exposed;
+  empty if node was left as is
 - Does not handle a while loop on a single branch
+- Raise _UnsupportedShapeError (before any change) if either LOOP is not padded
 --------------------------------------------------------------------------- '''
-def _normalize_amb_cfg(cfg):
-    node = cfg.getEntryNode()
+def _rewrite_amb_site(cfg, tree, node):
+    while_nodes = []
+    for branch in tree.getSubRegions(node):
+        while_node, start_node, final_node = _get_while_on_branch(branch)
+        if while_node and start_node and final_node:
+            while_nodes.append([while_node, start_node, final_node])
+    if len(while_nodes) != 2:
+        return []
+    _check_padded(while_nodes[0][0])
+    _check_padded(while_nodes[1][0])
+
+    l_while     = while_nodes[0][0]
+    l_amb_entry = while_nodes[0][1]
+    l_amb_exit  = while_nodes[0][2]
+
+    r_while     = while_nodes[1][0]
+    r_amb_entry = while_nodes[1][1]
+    r_amb_exit  = while_nodes[1][2]
+
+    flag = nextFlagName()
+    ''' Pre-algorithm Construction Phase '''
+    # pre1, body1, post1, pre2, body2, post2
+    before = None
+    if cfg.getEntryNode() != node:
+        before = CFG()
+        before.setEntryNode(cfg.getEntryNode())
+        before.setExitNode(_get_prev(node))
+
+    pre1 = CFG()
+    pre1.setEntryNode(l_amb_entry)
+    pre1.setExitNode(_get_loop_in_edge(l_while).getSource())
+
+    body1 = CFG()
+    body1.setEntryNode(_get_loop_entry_edge(l_while).getEndpoint())
+    body1.setExitNode(_get_loop_back_edge(l_while).getSource())
+
+    post1 = CFG()
+    post1.setEntryNode(_get_loop_out_edge(l_while).getEndpoint())
+    post1.setExitNode(l_amb_exit)
+
+    pre2 = CFG()
+    pre2.setEntryNode(r_amb_entry)
+    pre2.setExitNode(_get_loop_in_edge(r_while).getSource())
+
+    body2 = CFG()
+    body2.setEntryNode(_get_loop_entry_edge(r_while).getEndpoint())
+    body2.setExitNode(_get_loop_back_edge(r_while).getSource())
+
+    post2 = CFG()
+    post2.setEntryNode(_get_loop_out_edge(r_while).getEndpoint())
+    post2.setExitNode(r_amb_exit)
+
+    after = None
+    if cfg.getExitNode() != node.getAMBExit():
+        after = CFG()
+        after.setEntryNode(_get_next_seq(node, node.getType()))
+        after.setExitNode(cfg.getExitNode())
+
+    ''' Algorithm phase; repoint above CFGs '''
+    _nuke_while_node(cfg, l_while)
+    _nuke_while_node(cfg, r_while)
+    _nuke_amb_node(cfg, node)
+
+    flag_cfg_1, flagEntry_1, flagExit_1 = _flag_cfg(cfg, flag, ASSIGN, TRUE)
+    flag_cfg_2, flagEntry_2, flagExit_2 = _flag_cfg(cfg, flag, ASSIGN, FALSE)
+
+    flag_cfg_3, flagEntry_3, flagExit_3 = _flag_cfg(cfg, flag, ASSUME, TRUE)
+    flag_cfg_4, flagEntry_4, flagExit_4 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+
+    flag_cfg_5, flagEntry_5, flagExit_5 = _flag_cfg(cfg, flag, ASSUME, TRUE)
+    flag_cfg_6, flagEntry_6, flagExit_6 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+
+    if_cfg_1 = _create_amb(cfg, 
+                           _chain(cfg, flag_cfg_1, pre1),
+                           _chain(cfg, flag_cfg_2, pre2))
+
+    if before:
+        _connect(cfg, before.getExitNode(), if_cfg_1.getEntryNode())
+    else:
+        cfg.setEntryNode(if_cfg_1.getEntryNode())
 
-    while node:
-        if node.getType() == AMB:
-            # Temporarily snip the AMB_JOINS
-            for e in node.getAMBExit().getIncomingEdges():
-                e.getSource().delOutgoingEdge(e)
-            while_nodes = []
-            for e in node.getOutgoingEdges():
-                while_node, start_node, final_node = _get_while_on_branch(e.getEndpoint())
-                if while_node and start_node and final_node:
-                    while_nodes.append([while_node, start_node, final_node])
-            # Restore the AMB_JOINS
-            for e in node.getAMBExit().getIncomingEdges():
-                e.getSource().addOutgoingEdge(e)
-            if len(while_nodes) == 2:
-                l_while     = while_nodes[0][0]
-                l_amb_entry = while_nodes[0][1]
-                l_amb_exit  = while_nodes[0][2]
-
-                r_while     = while_nodes[1][0]
-                r_amb_entry = while_nodes[1][1]
-                r_amb_exit  = while_nodes[1][2]
+    while_cfg = _create_loop(cfg,
+                             _create_amb(cfg, 
+                                         _chain(cfg, flag_cfg_3, body1),
+                                         _chain(cfg, flag_cfg_4, body2)))
 
-                flag = nextFlagName()
-                ''' Pre-algorithm Construction Phase '''
-                # pre1, body1, post1, pre2, body2, post2
-                before = None
-                if cfg.getEntryNode() != node:
-                    before = CFG()
-                    before.setEntryNode(cfg.getEntryNode())
-                    before.setExitNode(_get_prev(node))
+    _connect(cfg, if_cfg_1.getExitNode(), while_cfg.getEntryNode())
 
-                pre1 = CFG()
-                pre1.setEntryNode(l_amb_entry)
-                pre1.setExitNode(_get_loop_in_edge(l_while).getSource())
+    if_cfg_2 = _create_amb(cfg,
+                           _chain(cfg, flag_cfg_5, post1),
+                           _chain(cfg, flag_cfg_6, post2))
 
-                body1 = CFG()
-                body1.setEntryNode(_get_loop_entry_edge(l_while).getEndpoint())
-                body1.setExitNode(_get_loop_back_edge(l_while).getSource())
+    _connect(cfg, while_cfg.getExitNode(), if_cfg_2.getEntryNode())
 
-                post1 = CFG()
-                post1.setEntryNode(_get_loop_out_edge(l_while).getEndpoint())
-                post1.setExitNode(l_amb_exit)
+    if after:
+        _connect(cfg, if_cfg_2.getExitNode(), after.getEntryNode())
+    else:
+        cfg.setExitNode(if_cfg_2.getExitNode())
+    tree.replace(node, if_cfg_1.getEntryNode(), if_cfg_2.getEntryNode())
 
-                pre2 = CFG()
-                pre2.setEntryNode(r_amb_entry)
-                pre2.setExitNode(_get_loop_in_edge(r_while).getSource())
+    # if_cfg_2 holds what follows each LOOP, which may hold another LOOP
+    return [while_cfg.getEntryNode(), if_cfg_2.getEntryNode()]
 
-                body2 = CFG()
-                body2.setEntryNode(_get_loop_entry_edge(r_while).getEndpoint())
-                body2.setExitNode(_get_loop_back_edge(r_while).getSource())
+''' ---------------------------------------------------------------------------
+Rewrite LOOP site node, if its body holds a LOOP on its top-level, into one
+back edge (transplant the LOOP block):
+- CFG, and its region tree, modified in place
+- Return list of new sites (LOOP/ AMB nodes) the rewrite may have exposed;
+  empty if node was left as is
+- Does not handle a nesting deeper than 2
+- Raise _UnsupportedShapeError (before any change) if either LOOP is not padded
+--------------------------------------------------------------------------- '''
+def _rewrite_loop_site(cfg, tree, node):
+    # Find an inner while on the top-level of the body
+    inner_node = tree.getBody(node).getFirstLoop()
+    if inner_node is None:
+        return []
+    _check_padded(node)
+    _check_padded(inner_node)
+
+    # We have both node (outer while) and inner_node (inner while)
+
+    flag = nextFlagName()
+    ''' Pre-algorithm Construction Phase '''
+    # Construct <pre1>
+    before = None
+    if cfg.getEntryNode() != node:
+        before = CFG()
+        before.setEntryNode(cfg.getEntryNode())
+        before.setExitNode(_get_loop_in_edge(node).getSource())
+
+    # pre
+    pre = CFG()
+    pre.setEntryNode(_get_loop_entry_edge(node).getEndpoint())
+    pre.setExitNode(_get_loop_in_edge(inner_node).getSource())
+
+    # body
+    body = CFG()
+    body.setEntryNode(_get_loop_entry_edge(inner_node).getEndpoint())
+    body.setExitNode(_get_loop_back_edge(inner_node).getSource())
+
+    # post
+    post = CFG()
+    post.setEntryNode(_get_loop_out_edge(inner_node).getEndpoint())
+    post.setExitNode(_get_loop_back_edge(node).getSource())
+
+    after = None
+    if cfg.getExitNode() != node:
+        after = CFG()
+        after.setEntryNode(_get_loop_out_edge(node).getEndpoint())
+        after.setExitNode(cfg.getExitNode())
+
+    ''' Algorithm phase; repoint above CFGs '''
+    # 'nuke' the two while nodes (remove all 4 edges and discard the node ptrs)
+    _nuke_while_node(cfg, node)
+    _nuke_while_node(cfg, inner_node)
+
+    pre_copy, _  = cfg.getRegionCopy(pre.getEntryNode(), pre.getExitNode(), cfg.getEdgeSet())
+    post_copy, _ = cfg.getRegionCopy(post.getEntryNode(), post.getExitNode(), cfg.getEdgeSet())
+
+    # Chain together nodes per algorithm
+    flag_cfg_1, flagEntry_1, flagExit_1 = _flag_cfg(cfg, flag, ASSIGN, TRUE)
+    flag_cfg_2, flagEntry_2, flagExit_2 = _flag_cfg(cfg, flag, ASSIGN, FALSE)
+
+    # Both branches need flag; with flag false (outer LOOP never entered) the
+    # new LOOP cannot run <body> without <pre>
+    flag_cfg_3, flagEntry_3, flagExit_3 = _flag_cfg(cfg, flag, ASSUME, TRUE)
+    flag_cfg_4, flagEntry_4, flagExit_4 = _flag_cfg(cfg, flag, ASSUME, TRUE)
+
+    flag_cfg_5, flagEntry_5, flagExit_5 = _flag_cfg(cfg, flag, ASSUME, TRUE)
+    flag_cfg_6, flagEntry_6, flagExit_6 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+
+    if_cfg_1 = _create_amb(cfg,
+                            _chain(cfg, flag_cfg_1, pre),
+                            flag_cfg_2)
+    if before:
+        _connect(cfg, before.getExitNode(), if_cfg_1.getEntryNode())
+    else:
+        cfg.setEntryNode(if_cfg_1.getEntryNode())
 
-                post2 = CFG()
-                post2.setEntryNode(_get_loop_out_edge(r_while).getEndpoint())
-                post2.setExitNode(r_amb_exit)
+    new_while = _create_loop(cfg,
+                             _create_amb(cfg,
+                                         _chain(cfg, _chain(cfg, flag_cfg_3, post), pre_copy),
+                                         _chain(cfg, flag_cfg_4, body)))
+    if_cfg_2 = _create_amb(cfg,
+                           _chain(cfg, flag_cfg_5, post_copy),
+                           flag_cfg_6)
 
-                after = None
-                if cfg.getExitNode() != node.getAMBExit():
-                    after = CFG()
-                    after.setEntryNode(_get_next_seq(node, node.getType()))
-                    after.setExitNode(cfg.getExitNode())
+    _connect(cfg, if_cfg_1.getExitNode(), new_while.getEntryNode())
+    _connect(cfg, new_while.getExitNode(), if_cfg_2.getEntryNode())
 
-                ''' Algorithm phase; repoint above CFGs '''
-                _nuke_while_node(cfg, l_while)
-                _nuke_while_node(cfg, r_while)
-                _nuke_amb_node(cfg, node)
+    if after:
+        _connect(cfg, if_cfg_2.getExitNode(), after.getEntryNode())
+    else:
+        cfg.setExitNode(if_cfg_2.getExitNode())
+    tree.replace(node, if_cfg_1.getEntryNode(), if_cfg_2.getEntryNode())
 
-                flag_cfg_1, flagEntry_1, flagExit_1 = _flag_cfg(cfg, flag, ASSIGN, TRUE)
-                flag_cfg_2, flagEntry_2, flagExit_2 = _flag_cfg(cfg, flag, ASSIGN, FALSE)
+    return [new_while.getEntryNode()]
 
-                flag_cfg_3, flagEntry_3, flagExit_3 = _flag_cfg(cfg, flag, ASSUME, TRUE)
-                flag_cfg_4, flagEntry_4, flagExit_4 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+''' ---------------------------------------------------------------------------
+Return number of backedges in the CFG
+--------------------------------------------------------------------------- '''
+def _num_back_edges(cfg):
+    return cfg.getEdgeCount(LOOP_BACK)
 
-                flag_cfg_5, flagEntry_5, flagExit_5 = _flag_cfg(cfg, flag, ASSUME, TRUE)
-                flag_cfg_6, flagEntry_6, flagExit_6 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+''' ---------------------------------------------------------------------------
+Return deepest LOOP nesting in region tree; 0 if no LOOP, 1 if no LOOP is in
+another
+--------------------------------------------------------------------------- '''
+def _max_loop_nesting(tree):
+    depth   = 0
+    regions = [tree.getRoot()]
+    while regions:
+        region = regions.pop()
+        if region.getFirstLoop() is not None:
+            depth = max(depth, region.getLoopDepth() + 1)
+        regions.extend(tree.getChildren(region))
+    return depth
 
-                if_cfg_1 = _create_amb(cfg, 
-                                       _chain(cfg, flag_cfg_1, pre1),
-                                       _chain(cfg, flag_cfg_2, pre2))
+''' ---------------------------------------------------------------------------
+Return LOOP and AMB nodes on the top-level of the program, in order
+--------------------------------------------------------------------------- '''
+def _top_level_sites(tree):
+    return [n for n in tree.getRoot().getNodes() if n.getType() in [LOOP, AMB]]
 
-                if before:
-                    _connect(cfg, before.getExitNode(), if_cfg_1.getEntryNode())
+''' ---------------------------------------------------------------------------
+Rewrite given cfg (in place) to an equivalent CFG with at most one back edge:
+- Worklist of top-level LOOP/ AMB sites, from the program's region tree
+  (built in one walk of the program)
+- Nested LOOPs and LOOPs on both AMB branches are rewritten site by site; a
+  rewrite only queues the sites it creates, and updates the region tree
+  where it rewrote, rather than rescanning
+- The LOOPs then left on the top-level are merged in one last pass
+- Raise _UnsupportedShapeError for a shape it does not handle: a LOOP it
+  would rewrite that is not padded (see _check_padded), a nesting deeper than
+  2 LOOPs, or a LOOP on only one AMB branch. Each rewrite checks before it
+  modifies the CFG, so the CFG is left equivalent to the given one (maybe
+  partly normalized)
+--------------------------------------------------------------------------- '''
+def _normalize_cfg(cfg):
+    tree = get_region_tree(cfg)
+    if _max_loop_nesting(tree) > 2:
+        raise _UnsupportedShapeError("LOOPs nested deeper than 2 are not supported")
 
-                while_cfg = _create_loop(cfg,
-                                         _create_amb(cfg, 
-                                                     _chain(cfg, flag_cfg_3, body1),
-                                                     _chain(cfg, flag_cfg_4, body2)))
+    worklist = deque(_top_level_sites(tree))
+    while worklist and _num_back_edges(cfg) > 1:
+        node = worklist.popleft()
+        if node.getType() == LOOP:
+            worklist.extend(_rewrite_loop_site(cfg, tree, node))
+        else:
+            worklist.extend(_rewrite_amb_site(cfg, tree, node))
 
-                _connect(cfg, if_cfg_1.getExitNode(), while_cfg.getEntryNode())
+    if _num_back_edges(cfg) > 1:
+        _normalize_seq_cfg(cfg)
 
-                if_cfg_2 = _create_amb(cfg,
-                                       _chain(cfg, flag_cfg_5, post1),
-                                       _chain(cfg, flag_cfg_6, post2))
+    if _num_back_edges(cfg) > 1:
+        raise _UnsupportedShapeError("Cannot normalize to one back edge (" + \
+                                     str(_num_back_edges(cfg)) + " left); LOOPs " + \
+                                     "on a single AMB branch are not supported")
 
-                _connect(cfg, while_cfg.getExitNode(), if_cfg_2.getEntryNode())
+""" ======================================================================= """
+""" ==================     BOTTOM-UP NORMALIZATION ======================== """
+""" ======================================================================= """
 
-                if after:
-                    _connect(cfg, if_cfg_2.getExitNode(), after.getEntryNode())
-                return
-                #node = while_cfg.getExitNode()
-
-        # Get next node in sequence after node
-        node = _get_next_seq(node, node.getType())
+# A summary of a normalized sub-program is a list [pre, body, post] of
+# loop-free fragments, meaning:     <pre> LOOP(<body>) <post>
+# pre/ post are None if empty; body is None if the sub-program is loop-free
+# (then pre holds all of it)
+#
+# Fragments are made by a builder; CFG fragments (_CFGBuilder) or ASTs
+# (_ASTBuilder), so the same rewrite schemes produce either
 
 ''' ---------------------------------------------------------------------------
-Scan for nested back edges in all sub-structures (e.g. in AMBs and LOOPs)
-... and reduce to a single back edge per sub-structure
-- CFG modified in place
-- Transplant the LOOP block
-- Does not handle a nesting deeper than 2
+Define a builder of CFG fragments, all sharing the edge set of one CFG (cfg,
+or a new one)
 --------------------------------------------------------------------------- '''
-def _normalize_loop_cfg(cfg):
-    node = cfg.getEntryNode()
-
-    while node:
-        if node.getType() == LOOP:
-            # Temporarily snip off back edge
-            outer_back_edge = None
-            for e in node.getIncomingEdges():
-                if e.getType() == LOOP_BACK:
-                    outer_back_edge = e
-                    e.getSource().delOutgoingEdge(e)
-            assert outer_back_edge is not None
-
-            # Walk through inner node and try to find an inner while
-            inner_node = _get_loop_entry_edge(node).getEndpoint()
-            inner_while_found = False
-            while inner_node:
-                if inner_node.getType() == LOOP:
-                    inner_while_found = True
-                    break
-                inner_node = _get_next_seq(inner_node, inner_node.getType())
-            # Restore back edge
-            restored_back_edge = False
-            for e in node.getIncomingEdges():
-                if e.getType() == LOOP_BACK:
-                    outer_back_edge = e
-                    e.getSource().addOutgoingEdge(e)
-                    restored_back_edge = True
-            assert restored_back_edge
-            if inner_while_found:
-                # We have both node (outer while) and inner_node (inner while)
-
-                flag = nextFlagName()
-                ''' Pre-algorithm Construction Phase '''
-                # Construct <pre1>
-                before = None
-                if cfg.getEntryNode() != node:
-                    before = CFG()
-                    before.setEntryNode(cfg.getEntryNode())
-                    before.setExitNode(_get_loop_in_edge(node).getSource())
-
-                # pre
-                pre = CFG()
-                pre.setEntryNode(_get_loop_entry_edge(node).getEndpoint())
-                pre.setExitNode(_get_loop_in_edge(inner_node).getSource())
-
-                # body
-                body = CFG()
-                body.setEntryNode(_get_loop_entry_edge(inner_node).getEndpoint())
-                body.setExitNode(_get_loop_back_edge(inner_node).getSource())
-
-                # post
-                post = CFG()
-                post.setEntryNode(_get_loop_out_edge(inner_node).getEndpoint())
-                post.setExitNode(_get_loop_back_edge(node).getSource())
-                
-                after = None
-                if cfg.getExitNode() != node:
-                    after = CFG()
-                    after.setEntryNode(_get_loop_out_edge(node).getEndpoint())
-                    after.setExitNode(cfg.getExitNode())
+class _CFGBuilder():
+    def __init__(self, cfg=None):
+        self._cfg = CFG() if cfg is None else cfg
+
+    def getCFG(self):
+        return self._cfg
+
+    # Return fragment of atomic statement ast (ASSIGN/ ASSUME)
+    def atom(self, ast):
+        if ast.getValue() == ASSIGN:
+            return _generate_ASSIGN_CFG(ast, self._cfg.getEdgeSet())
+        return _generate_ASSUME_CFG(ast, self._cfg.getEdgeSet())
+
+    # Return fragments chained in order (None ones skipped)
+    def seq(self, *frags):
+        ret = None
+        for frag in frags:
+            if ret is None:
+                ret = frag
+            elif frag is not None:
+                ret = _chain(self._cfg, ret, frag)
+        return ret
+
+    def amb(self, left, right):
+        return _create_amb(self._cfg, left, right)
+
+    def loop(self, body):
+        return _create_loop(self._cfg, body)
+
+    # Return fragment "flag = val"
+    def setFlag(self, flag, val):
+        return _flag_cfg(self._cfg, flag, ASSIGN, val)[0]
+
+    # Return fragment "flag == val"
+    def testFlag(self, flag, val):
+        return _flag_cfg(self._cfg, flag, ASSUME, val)[0]
 
-                ''' Algorithm phase; repoint above CFGs '''
-                # 'nuke' the two while nodes (remove all 4 edges and discard the node ptrs)
-                _nuke_while_node(cfg, node)
-                _nuke_while_node(cfg, inner_node)
-
-                pre_copy = pre.getCopy()
-                post_copy = post.getCopy()
-
-                # Chain together nodes per algorithm
-                flag_cfg_1, flagEntry_1, flagExit_1 = _flag_cfg(cfg, flag, ASSIGN, TRUE)
-                flag_cfg_2, flagEntry_2, flagExit_2 = _flag_cfg(cfg, flag, ASSIGN, FALSE)
+''' ---------------------------------------------------------------------------
+Define a builder of ASTs; no CFG Node/ Edge objects are made
+--------------------------------------------------------------------------- '''
+class _ASTBuilder():
+    def atom(self, ast):
+        return ast
+
+    # Return fragments in a SEQ chain (None ones skipped)
+    def seq(self, *frags):
+        ret = None
+        for frag in reversed(frags):
+            if ret is None:
+                ret = frag
+            elif frag is not None:
+                ret = self._node(SEQ, frag, ret)
+        return ret
+
+    def amb(self, left, right):
+        return self._node(AMB, left, right)
+
+    def loop(self, body):
+        return self._node(LOOP, body)
+
+    # Return AST "flag = val"
+    def setFlag(self, flag, val):
+        return get_assignment_ast(flag + " = " + val)
+
+    # Return AST "flag == val"
+    def testFlag(self, flag, val):
+        return get_assumption_ast(flag + " == " + val)
+
+    def _node(self, value, left, right=None):
+        ast = AST(value)
+        ast.setLeft(left)
+        ast.setRight(right)
+        return ast
 
-                flag_cfg_3, flagEntry_3, flagExit_3 = _flag_cfg(cfg, flag, ASSUME, TRUE)
-                flag_cfg_4, flagEntry_4, flagExit_4 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+''' ---------------------------------------------------------------------------
+Return summary of SEQ(left, right), given summaries of left and right:
+    <pre1> LOOP(<body1>) <post1> <pre2> LOOP(<body2>) <post2>
+==> <pre1> flag := true
+    LOOP(either [flag]      <body1>
+         or     [flag]      flag := false; <post1> <pre2>
+         or     [not flag]  <body2>)
+    [not flag] <post2>
+--------------------------------------------------------------------------- '''
+def _summarize_seq(build, left, right):
+    pre1, body1, post1 = left
+    pre2, body2, post2 = right
+
+    if body1 is None:
+        return [build.seq(pre1, pre2), body2, post2]
+    if body2 is None:
+        return [pre1, body1, build.seq(post1, pre2)]
+
+    flag = nextFlagName()
+    body = build.amb(build.seq(build.testFlag(flag, TRUE), body1),
+                     build.amb(build.seq(build.testFlag(flag, TRUE),
+                                         build.setFlag(flag, FALSE), post1, pre2),
+                               build.seq(build.testFlag(flag, FALSE), body2)))
+    return [build.seq(pre1, build.setFlag(flag, TRUE)),
+            body,
+            build.seq(build.testFlag(flag, FALSE), post2)]
 
-                flag_cfg_5, flagEntry_5, flagExit_5 = _flag_cfg(cfg, flag, ASSUME, TRUE)
-                flag_cfg_6, flagEntry_6, flagExit_6 = _flag_cfg(cfg, flag, ASSUME, FALSE)
+''' ---------------------------------------------------------------------------
+Return summary of AMB(left, right), given summaries of left and right:
+    AMB(<pre1> LOOP(<body1>) <post1>, <pre2> LOOP(<body2>) <post2>)
+==> AMB(flag := true; <pre1>, flag := false; <pre2>)
+    LOOP(AMB([flag] <body1>, [not flag] <body2>))
+    AMB([flag] <post1>, [not flag] <post2>)
+A loop-free branch has no LOOP body, so its side of the new LOOP is left out
+--------------------------------------------------------------------------- '''
+def _summarize_amb(build, left, right):
+    pre1, body1, post1 = left
+    pre2, body2, post2 = right
+
+    if body1 is None and body2 is None:
+        return [build.amb(pre1, pre2), None, None]
+
+    flag = nextFlagName()
+    pre  = build.amb(build.seq(build.setFlag(flag, TRUE), pre1),
+                     build.seq(build.setFlag(flag, FALSE), pre2))
+    post = build.amb(build.seq(build.testFlag(flag, TRUE), post1),
+                     build.seq(build.testFlag(flag, FALSE), post2))
+
+    if body2 is None:
+        body = build.seq(build.testFlag(flag, TRUE), body1)
+    elif body1 is None:
+        body = build.seq(build.testFlag(flag, FALSE), body2)
+    else:
+        body = build.amb(build.seq(build.testFlag(flag, TRUE), body1),
+                         build.seq(build.testFlag(flag, FALSE), body2))
+    return [pre, body, post]
 
-                if_cfg_1 = _create_amb(cfg,
-                                        _chain(cfg, flag_cfg_1, pre),
-                                        flag_cfg_2)
-                if before:
-                    _connect(cfg, before.getExitNode(), if_cfg_1.getEntryNode())
+''' ---------------------------------------------------------------------------
+Return summary of LOOP(stmt), given summary of stmt:
+    LOOP(<pre> LOOP(<body>) <post>)
+==> flag := false
+    LOOP(either [not flag]  <pre> flag := true
+         or     [flag]      <body>
+         or     [flag]      <post> flag := false)
+    [not flag]
+flag is true inside an iteration of the outer LOOP. <pre> and <post> occur
+once, and the new <pre>/ <post> are a single statement each, so each nesting
+level adds a bounded amount of work
+--------------------------------------------------------------------------- '''
+def _summarize_loop(build, inner):
+    pre, body, post = inner
 
-                new_while = _create_loop(cfg,
-                                         _create_amb(cfg,
-                                                     _chain(cfg, _chain(cfg, flag_cfg_3, post), pre_copy),
-                                                     _chain(cfg, flag_cfg_4, body)))
-                if_cfg_2 = _create_amb(cfg,
-                                       _chain(cfg, flag_cfg_5, post_copy),
-                                       flag_cfg_6)
+    # LOOP(<stmt>), or LOOP(LOOP(<body>)) == LOOP(<body>)
+    if body is None:
+        return [None, pre, None]
+    if pre is None and post is None:
+        return [None, body, None]
 
-                _connect(cfg, if_cfg_1.getExitNode(), new_while.getEntryNode())
-                _connect(cfg, new_while.getExitNode(), if_cfg_2.getEntryNode())
+    flag = nextFlagName()
+    body = build.amb(build.seq(build.testFlag(flag, FALSE), pre, build.setFlag(flag, TRUE)),
+                     build.amb(build.seq(build.testFlag(flag, TRUE), body),
+                               build.seq(build.testFlag(flag, TRUE), post, build.setFlag(flag, FALSE))))
+    return [build.setFlag(flag, FALSE), body, build.testFlag(flag, FALSE)]
 
-                if after:
-                    _connect(cfg, if_cfg_2.getExitNode(), after.getEntryNode())
+''' ---------------------------------------------------------------------------
+Return fragment (made by build) of the program equivalent to well-formed AST
+object, with at most one LOOP:
+- Statements are summarized bottom-up (innermost LOOPs first) by an explicit-
+  stack walk; each SEQ/ AMB/ LOOP combines the summaries of its children with
+  one of the three rewrite schemes, so any nesting of LOOP/ AMB is handled
+- Work is constant per statement; no fragment is copied, so the result is
+  linear in the size of AST at any nesting depth
+--------------------------------------------------------------------------- '''
+def _normalize_bottom_up(ast, build):
+    def _summarize(ast, state, summaries):
+        ast_type = ast.getValue()
+        if ast_type in [ASSIGN, ASSUME]:
+            return [build.atom(ast), None, None]
+        elif ast_type == SEQ:
+            return _summarize_seq(build, summaries[0], summaries[1])
+        elif ast_type == AMB:
+            return _summarize_amb(build, summaries[0], summaries[1])
+        elif ast_type == LOOP:
+            return _summarize_loop(build, summaries[0])
+        raise ValueError("Attempt to normalize unsupported AST atom: " + ast_type)
+
+    pre, body, post = walk(ast, _stmt_children, leave=_summarize)
+    return build.seq(pre, None if body is None else build.loop(body), post)
 
-                node = new_while.getEntryNode()
-            
-        node = _get_next_seq(node, node.getType())
+''' ---------------------------------------------------------------------------
+Rewrite cfg in place to the equivalent CFG normalized bottom-up from ast (its
+AST; converted from cfg if None); its edges (and entry/ exit) are replaced by
+those of the new CFG
+--------------------------------------------------------------------------- '''
+def _normalize_cfg_bottom_up(cfg, ast=None):
+    if ast is None:
+        ast = to_ast(cfg)
+    cfg.removeEdges(list(cfg.getEdgeSet()))
+    program = _normalize_bottom_up(ast, _CFGBuilder(cfg))
+    cfg.setEntryNode(program.getEntryNode())
+    cfg.setExitNode(program.getExitNode())
 
 ''' ---------------------------------------------------------------------------
-Return number of backedges in the CFG
+Rewrite cfg in place to an equivalent CFG with at most one back edge: by the
+site rewrites over its region tree (see _normalize_cfg), for the shapes they
+handle; else bottom-up from ast (see _normalize_cfg_bottom_up)
 --------------------------------------------------------------------------- '''
-def _num_back_edges(cfg):
-    return sum(e.getType() == LOOP_BACK for e in cfg.getEdgeSet())
+def _normalize_any_cfg(cfg, ast=None):
+    try:
+        _normalize_cfg(cfg)
+    except _UnsupportedShapeError:
+        _normalize_cfg_bottom_up(cfg, ast)
 
 ''' ---------------------------------------------------------------------------
-Return equivalent CFG to given cfg that has at most one back edge
+Return True if AST has more than limit LOOP statements; stops at the first
+LOOP past limit
 --------------------------------------------------------------------------- '''
-def _normalize_cfg(cfg):
-    back_edge_count = _num_back_edges(cfg)
-    while back_edge_count > 1:
-        # Three passes focused on different normalizations
-        _normalize_seq_cfg(cfg)
-        _normalize_loop_cfg(cfg)
-        _normalize_amb_cfg(cfg)        
-        
-        # Loop invariant to guarantee termination
-        old_back_edge_count    = back_edge_count
-        back_edge_count        =  _num_back_edges(cfg)
-        assert back_edge_count < old_back_edge_count
+def _has_more_loops(ast, limit):
+    stack = [ast]
+    while stack:
+        ast = stack.pop()
+        if ast.getValue() == LOOP:
+            limit -= 1
+            if limit < 0:
+                return True
+        stack.extend(_stmt_children(ast))
+    return False
 
 """ ======================================================================= """
 """ ================== PUBLIC INTERFACE =================================== """
@@ -569,18 +844,55 @@ def _normalize_cfg(cfg):
 
 ''' ---------------------------------------------------------------------------
 Return normalized AST representation, AST*, of given AST; AST* is equivalent
-to given AST except that it has at most one LOOP construct.
+to given AST except that it has at most one LOOP construct. The CFG of AST is
+rewritten site by site where it can be (see normalize_cfg), else normalized
+bottom-up from AST
 
 Optionally returns normalized CFG
+
+Node IDs and flags come from context ctx (see PipelineContext); by default the
+shared context, with flags reset first. Back-edge counts are printed unless
+the context's verbose option is False
 --------------------------------------------------------------------------- '''
-def normalize_ast(ast, ret_norm_cfg=False):
-    resetFlags() # Ensure unique flag names
-    cfg = get_CFG(ast)
-    print("\n--------------------------------------------------------------------------------")
-    print(str(_num_back_edges(cfg)) + " back-edge(s) detected.")
-    _normalize_cfg(cfg)
-    print(str(_num_back_edges(cfg)) + " back-edge(s) after normalization.")
-    if ret_norm_cfg:
-        return to_ast(cfg), cfg
-    else:
-        return to_ast(cfg)
\ No newline at end of file
+def normalize_ast(ast, ret_norm_cfg=False, ctx=None):
+    with pipeline_stage(ctx, reset_flags=True) as ctx: # Ensure unique flag names
+        verbose = ctx.getOption("verbose", True)
+        cfg     = get_CFG(ast, ctx=ctx)
+        if verbose:
+            print("\n--------------------------------------------------------------------------------")
+            print(str(_num_back_edges(cfg)) + " back-edge(s) detected.")
+        _normalize_any_cfg(cfg, ast)
+        if verbose:
+            print(str(_num_back_edges(cfg)) + " back-edge(s) after normalization.")
+        if ret_norm_cfg:
+            return to_ast(cfg), cfg
+        else:
+            return to_ast(cfg)
+
+''' ---------------------------------------------------------------------------
+Return normalized AST representation, AST*, of given AST, built directly as
+an AST (no CFG round trip) by the bottom-up normalization; for programs with
+more than one LOOP, it is the program normalize_ast returns for the shapes
+the site rewrites do not handle. Programs with at most one LOOP are already
+normal, and returned as is
+Sub-trees of ast are shared rather than copied, so do not modify ast
+afterwards
+
+Node IDs and flags come from context ctx, as for normalize_ast
+--------------------------------------------------------------------------- '''
+def normalize_ast_direct(ast, ctx=None):
+    if not _has_more_loops(ast, 1):
+        return ast
+    with pipeline_stage(ctx, reset_flags=True): # Ensure unique flag names
+        return _normalize_bottom_up(ast, _ASTBuilder())
+
+''' ---------------------------------------------------------------------------
+Rewrite given CFG (e.g. from get_CFG) in place to an equivalent CFG with at
+most one back edge. Shapes the site rewrites do not handle (see _normalize_cfg)
+are finished bottom-up instead, from the CFG's AST; the CFG's edges are then
+replaced. Node IDs and flags come from context ctx, as for normalize_ast
+--------------------------------------------------------------------------- '''
+def normalize_cfg(cfg, ctx=None):
+    with pipeline_stage(ctx, reset_flags=True): # Ensure unique flag names
+        _normalize_any_cfg(cfg)
+        return cfg
@@ -0,0 +1,247 @@
+""" ===========================================================================
+File   : region.py
+CSC410 : Project 6: Program Normalizer and Control Flow Graph Visualizer
+Author : Harman Sran
+
+Defines RegionTree; the program structure tree of a CFG. Each single-entry/
+single-exit region is a SEQ chain of statement nodes (ASSIGN, ASSUME, AMB,
+LOOP heads):
+    - The root region is the program's top-level
+    - Each AMB node opens two regions (its branches); each LOOP node one (its
+      body); these are the children of the region holding the node
+    - Each region knows its parent, its loop depth, its first LOOP node and
+      the number of LOOP nodes under it
+
+The tree is built in one walk of the CFG, then kept up to date by replace
+as a statement is rewritten; so "first LOOP in this branch" is O(1), and
+"innermost LOOP under this one" O(depth)
+=========================================================================== """
+from lib import *
+from cfg import *
+from conv import _get_next_seq
+
+
+""" ======================================================================= """
+""" ==================      CLASSES               ========================= """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Define a region; a SEQ chain of statement nodes, opened by owner (an AMB or
+LOOP node; None for the root region)
+--------------------------------------------------------------------------- '''
+class Region():
+    def __init__(self, owner=None, parent=None):
+        self._owner  = owner
+        self._parent = parent
+        self._nodes  = []   # Statement nodes, in SEQ order
+        self._loops  = []   # LOOP nodes among _nodes, in SEQ order; None until
+                            # recomputed, after a replace
+        self._num_loops = 0 # LOOP nodes in this region, and all under it
+
+        # LOOP depth; LOOP bodies are one deeper than the region holding them
+        self._depth = 0
+        if parent is not None:
+            self._depth = parent.getLoopDepth() + (owner.getType() == LOOP)
+
+    def getOwner(self):
+        return self._owner
+
+    def getParent(self):
+        return self._parent
+
+    def getNodes(self):
+        return self._nodes
+
+    def getEntry(self):
+        return self._nodes[0]
+
+    def getLast(self):
+        return self._nodes[-1]
+
+    def getLoopDepth(self):
+        return self._depth
+
+    # Return first LOOP node in this region's SEQ; None if none
+    def getFirstLoop(self):
+        loops = self._getLoops()
+        return loops[0] if loops else None
+
+    # Return True if a LOOP node is in this region, or any region under it
+    def containsLoop(self):
+        return self._num_loops > 0
+
+    def getLoopCount(self):
+        return self._num_loops
+
+    def _setNodes(self, nodes):
+        self._nodes = nodes
+        self._loops = [n for n in nodes if n.getType() == LOOP]
+
+    def _getLoops(self):
+        if self._loops is None:
+            self._loops = [n for n in self._nodes if n.getType() == LOOP]
+        return self._loops
+
+    # Replace statement node by new_nodes, in place
+    def _splice(self, node, new_nodes):
+        i = self._nodes.index(node)
+        self._nodes[i : i + 1] = new_nodes
+        self._loops = None
+
+''' ---------------------------------------------------------------------------
+Define the region tree of a CFG; see header
+--------------------------------------------------------------------------- '''
+class RegionTree():
+    def __init__(self, cfg):
+        self._region_of = {} # Statement node -> region holding it
+        self._sub       = {} # AMB/ LOOP node -> regions it opens
+        self._root      = Region()
+        self._build(self._root, cfg.getEntryNode())
+
+    def getRoot(self):
+        return self._root
+
+    # Return region whose SEQ holds statement node
+    def getRegion(self, node):
+        return self._region_of[node]
+
+    # Return regions opened by node; AMB branches (left first), or LOOP body
+    def getSubRegions(self, node):
+        return self._sub.get(node, [])
+
+    # Return regions directly under region, in SEQ order
+    def getChildren(self, region):
+        return [r for n in region.getNodes() for r in self.getSubRegions(n)]
+
+    # Return LOOP body region of LOOP node
+    def getBody(self, node):
+        assert node.getType() == LOOP
+        return self._sub[node][0]
+
+    ''' -----------------------------------------------------------------------
+    Return innermost LOOP node under LOOP node (following the first LOOP at
+    each level); node itself if its body holds no LOOP. O(depth), plus the
+    AMB branches looked at on the way
+    ----------------------------------------------------------------------- '''
+    def getInnermostLoop(self, node):
+        region = self.getBody(node)
+        while region.containsLoop():
+            if region.getFirstLoop() is not None:
+                node   = region.getFirstLoop()
+                region = self.getBody(node)
+                continue
+            # The LOOPs are in AMB branches of this region
+            for n in region.getNodes():
+                branches = [r for r in self.getSubRegions(n) if r.containsLoop()]
+                if branches:
+                    region = branches[0]
+                    break
+        return node
+
+    ''' -----------------------------------------------------------------------
+    Update the tree after statement node was rewritten (in the CFG) into the
+    SEQ of statements first .. last; the regions under node are dropped, and
+    regions for the new statements built. Cost is the size of the dropped
+    and new regions, plus node's depth; and a list splice of node's region
+    (its LOOPs are found again when next asked for)
+    ----------------------------------------------------------------------- '''
+    def replace(self, node, first, last):
+        region = self._region_of[node]
+        dropped = self._drop(node)
+
+        # New statements, and the regions under them
+        new_nodes = []
+        n = first
+        while True:
+            new_nodes.append(n)
+            if n is last:
+                break
+            n = _get_next_seq(n, n.getType())
+            assert n is not None
+        added = self._fill(region, new_nodes)
+
+        region._splice(node, new_nodes)
+
+        # Update LOOP counts up the tree
+        delta = added - dropped
+        while region is not None:
+            region._num_loops += delta
+            region = region.getParent()
+
+    ''' -----------------------------------------------------------------------
+    Build region (empty) from the SEQ starting at entry node
+    ----------------------------------------------------------------------- '''
+    def _build(self, region, entry):
+        nodes = []
+        n = entry
+        while n is not None:
+            nodes.append(n)
+            n = _get_next_seq(n, n.getType())
+        region._setNodes(nodes)
+        region._num_loops = self._fill(region, nodes)
+
+    ''' -----------------------------------------------------------------------
+    Register nodes in region, and build the regions they open (explicit
+    stack; no recursion); return number of LOOP nodes among and under nodes
+    ----------------------------------------------------------------------- '''
+    def _fill(self, region, nodes):
+        top   = region
+        count = len([n for n in nodes if n.getType() == LOOP])
+        built = [] # Regions built; each after the region holding its owner
+        stack = [(region, nodes)]
+        while stack:
+            region, nodes = stack.pop()
+            for n in nodes:
+                self._region_of[n] = region
+                if n.getType() == AMB:
+                    heads = [e.getEndpoint() for e in n.getAMBSplitEdges()]
+                elif n.getType() == LOOP:
+                    heads = [n.getLoopEntryEdge().getEndpoint()]
+                else:
+                    continue
+                self._sub[n] = []
+                for head in heads:
+                    sub = Region(n, region)
+                    sub_nodes = []
+                    while head is not None:
+                        sub_nodes.append(head)
+                        head = _get_next_seq(head, head.getType())
+                    sub._setNodes(sub_nodes)
+                    sub._num_loops = len(sub._getLoops())
+                    self._sub[n].append(sub)
+                    built.append(sub)
+                    stack.append((sub, sub_nodes))
+
+        # LOOP counts; sum each region's count into its parent, deepest first
+        for sub in reversed(built):
+            if sub.getParent() is top:
+                count += sub._num_loops
+            else:
+                sub.getParent()._num_loops += sub._num_loops
+        return count
+
+    ''' -----------------------------------------------------------------------
+    Unregister statement node and the regions under it; return the number
+    of LOOP nodes dropped
+    ----------------------------------------------------------------------- '''
+    def _drop(self, node):
+        dropped = int(node.getType() == LOOP)
+        del self._region_of[node]
+        stack = [node]
+        while stack:
+            for sub in self._sub.pop(stack.pop(), []):
+                dropped += len(sub._getLoops())
+                for n in sub.getNodes():
+                    del self._region_of[n]
+                    stack.append(n)
+        return dropped
+
+""" ======================================================================= """
+""" ================== PUBLIC INTERFACE =================================== """
+""" ======================================================================= """
+
+''' ---------------------------------------------------------------------------
+Return region tree (RegionTree) of given CFG
+--------------------------------------------------------------------------- '''
+def get_region_tree(cfg):
+    return RegionTree(cfg)
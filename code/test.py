@@ -15,6 +15,29 @@ from ast import *
 from cfg import *
 from conv import *
 from norm import *
+from csr import *
+from region import *
+from dom import *
+from arena import *
+from cluster import *
+from batch import *
+from batch import _digest
+from norm import _normalize_cfg
+from norm import _UnsupportedShapeError
+from norm import _normalize_cfg_bottom_up
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import shutil
+import tempfile
+from bench import gen_chain_program
+from bench import gen_repetitive_program
+from bench import gen_nested_loop_program
+from bench import gen_mixed_nesting_program
+from bench import gen_random_program
+from cfg import _stmt_children
+import operator
+import random
 
 # ADD SAMPLE ASTs TO THIS LIST FOR AUTO-TESTING IN 'test.py'
 # IMPORTANT: File path must be relative to this dir (code/)
@@ -62,6 +85,30 @@ def test_CFG_to_AST_conversion(ast_files):
                       name=ast_path.split("/")[-1].split(".")[0], \
                       folder="conv_asts/")
 
+''' ---------------------------------------------------------------------------
+Return snapshot of cfg's edges (the edge set, and each node's edge links)
+--------------------------------------------------------------------------- '''
+def _edge_links(cfg):
+    return set(cfg.getEdgeSet()), \
+           dict((n, (set(n.getIncomingEdges()), set(n.getOutgoingEdges()))) \
+                for n in cfg.getNodes())
+
+''' ---------------------------------------------------------------------------
+Validates that CFG to AST conversion only reads the CFG: edges and node links
+are unchanged, and converting again gives the same AST
+--------------------------------------------------------------------------- '''
+def test_read_only_conversion(ast_paths):
+    print("\nBeginning read-only CFG to AST conversion test [Components 3 and 4]")
+    wps = ast_paths + \
+          [b"LOOP(ASSIGN(x, 1))", gen_mixed_nesting_program(5).encode()]
+    for wp in wps:
+        cfg    = get_CFG(get_AST(wp))
+        before = _edge_links(cfg)
+        ast    = to_ast(cfg)
+        assert _edge_links(cfg) == before
+        assert str(to_ast(cfg)) == str(ast)
+    print("\nRead-only conversion test passed for " + str(len(wps)) + " programs")
+
 ''' ---------------------------------------------------------------------------
 Validates AST normalization by normalizing (removing all but one back edge)
 of all ASTs passed in
@@ -81,6 +128,942 @@ def test_AST_normalization(ast_files):
                       folder="norm_asts/")
         print("")
 
+''' ---------------------------------------------------------------------------
+Return number of nodes of each value in ast
+--------------------------------------------------------------------------- '''
+def _count_values(ast):
+    counts = {}
+    def _count(node):
+        counts[node.getValue()] = counts.get(node.getValue(), 0) + 1
+    walk(ast, ast_children, _count)
+    return counts
+
+''' ---------------------------------------------------------------------------
+Validates that programs nested far deeper than Python's recursion limit go
+through every component (parse, CFG, CFG to AST, normalization, printing)
+--------------------------------------------------------------------------- '''
+def test_deep_nesting(num_stmts=100000):
+    print("\nBeginning deep nesting test [Components -1, 1, 3 and 4, 5]")
+    wp  = gen_chain_program(num_stmts, loop_every=1000, amb_every=100)
+    ast = get_AST(wp.encode())
+
+    # Printing indents by depth, so its output is quadratic; print fewer
+    str(get_AST(gen_chain_program(2000).encode()))
+
+    # CFG to AST conversion must restore the same statements
+    assert _count_values(to_ast(get_CFG(ast))) == _count_values(ast)
+
+    n_ast = normalize_ast(ast)
+    assert _count_values(n_ast).get(LOOP, 0) == 1
+    print("\nDeep nesting test passed for " + str(num_stmts) + " nested statements")
+
+''' ---------------------------------------------------------------------------
+Validates that whitespace is insignificant inside operators, as anywhere else
+(e.g. "a > = b" is "a >= b"), while a lone "=" is still rejected
+--------------------------------------------------------------------------- '''
+def test_operator_whitespace():
+    print("\nBeginning operator whitespace test [Component -1]")
+    for op in BI_EXPRS:
+        expected = str(get_AST(("ASSUME(a " + op + " b)").encode()))
+        for spaced in [" ".join(op), "\n\t".join(op), op]:
+            assert str(get_AST(("ASSUME(a" + spaced + "b)").encode())) == expected
+            assert str(get_compact_AST(("ASSUME(a " + spaced + " b)").encode())) == expected
+    try:
+        get_AST(b"ASSUME(a = b)")
+        assert False, "Lone '=' parsed"
+    except ValueError:
+        pass
+    print("\nOperator whitespace test passed for " + str(len(BI_EXPRS)) + " operators")
+
+''' ---------------------------------------------------------------------------
+Validates that a hash-consed AST's memoized CFG (sub-CFGs copied for repeated
+sub-trees) converts back to the same statements as the original AST; and that
+the hash-consed AST is drawn with each shared node once
+--------------------------------------------------------------------------- '''
+def test_memoized_CFG(num_loops=50):
+    print("\nBeginning memoized CFG test [Components 1, 3 and 4]")
+    wp     = gen_repetitive_program(num_loops).encode()
+    counts = _count_values(get_AST(wp))
+    shared = hash_cons(get_AST(wp))
+    cfg    = get_CFG(shared, memoize=True)
+    assert len(set(n.getID() for n in cfg.getNodes())) == len(cfg.getNodes())
+    assert _count_values(to_ast(cfg)) == counts
+
+    # Template copies match a rebuild, ports included (normalization reads them)
+    assert str(to_ast(cfg)) == str(to_ast(get_CFG(get_AST(wp))))
+    memo_cfg = normalize_cfg(get_CFG(shared, memoize=True), ctx=PipelineContext(verbose=False))
+    cfg_2    = normalize_cfg(get_CFG(get_AST(wp)), ctx=PipelineContext(verbose=False))
+    assert str(to_ast(memo_cfg)) == str(to_ast(cfg_2))
+
+    # One line per distinct node, and one edge per parent-child link
+    nodes, stack = set(), [shared]
+    while stack:
+        node = stack.pop()
+        if node not in nodes:
+            nodes.add(node)
+            stack.extend(ast_children(node))
+    out = StringIO()
+    write_ast_dot(shared, out)
+    lines = out.getvalue().split("\n")
+    assert len(nodes) < sum(counts.values())
+    assert sum("[label=" in line for line in lines) == len(nodes)
+    assert sum(" -> " in line for line in lines) == sum(len(ast_children(n)) for n in nodes)
+    print("\nMemoized CFG test passed for " + str(num_loops) + " repeated LOOPs")
+
+''' ---------------------------------------------------------------------------
+Validates compact (arena) ASTs; parsed into an ASTArena, or packed from an AST
+object tree, they go through every component (CFG, CFG to AST, normalization,
+DOT output) with the same output as the AST object tree
+--------------------------------------------------------------------------- '''
+def test_compact_AST(ast_paths, depths=[2, 5, 10]):
+    print("\nBeginning compact AST test [Components -1, 1, 3 and 4, 5, 6]")
+    wps = ast_paths + [gen_mixed_nesting_program(depth).encode() for depth in depths]
+    for wp in wps:
+        ast     = get_AST(wp)
+        outputs = []
+        for tree in [ast, get_compact_AST(wp), pack_AST(ast)]:
+            ctx = PipelineContext(verbose=False)
+            cfg = get_CFG(tree, ctx=ctx)
+            ast_dot, cfg_dot = StringIO(), StringIO()
+            write_ast_dot(tree, ast_dot)
+            write_cfg_dot(cfg, cfg_dot)
+            outputs.append((str(tree), ast_dot.getvalue(), cfg_dot.getvalue(), \
+                            str(to_ast(cfg)), str(normalize_ast(tree, ctx=ctx))))
+        assert outputs[1] == outputs[0] and outputs[2] == outputs[0]
+    print("\nCompact AST test passed for " + str(len(wps)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates that a program with many nested LOOP blocks (each a rewrite site) is
+normalized to a single LOOP in one call
+--------------------------------------------------------------------------- '''
+def test_normalize_sites(num_blocks=100):
+    print("\nBeginning many-site normalization test [Component 5]")
+    n_ast = normalize_ast(get_AST(gen_nested_loop_program(num_blocks).encode()))
+    assert _count_values(n_ast).get(LOOP, 0) == 1
+    print("\nMany-site normalization test passed for " + str(num_blocks) + " nested LOOP blocks")
+
+''' ---------------------------------------------------------------------------
+Validates that programs nesting LOOPs (and LOOPs on a single AMB branch) to
+any depth are normalized to a single LOOP in one call
+--------------------------------------------------------------------------- '''
+def test_nested_normalization(depths=[3, 4, 10, 25, 50]):
+    print("\nBeginning nested normalization test [Component 5]")
+    for depth in depths:
+        for wp in [gen_nested_loop_program(3, depth), gen_mixed_nesting_program(depth)]:
+            n_ast = normalize_ast(get_AST(wp.encode()))
+            assert _count_values(n_ast).get(LOOP, 0) == 1
+    print("\nNested normalization test passed for depths " + str(depths))
+
+''' ---------------------------------------------------------------------------
+Validates that normalizing directly on the AST gives the same statements as
+normalizing bottom-up through the CFG, and leaves programs with one LOOP as
+they are
+--------------------------------------------------------------------------- '''
+def test_direct_normalization(ast_paths, depths=[2, 5, 10]):
+    print("\nBeginning direct normalization test [Component 5]")
+    asts = [get_AST(ast_path) for ast_path in ast_paths] + \
+           [get_AST(gen_mixed_nesting_program(depth).encode()) for depth in depths]
+    for ast in asts:
+        d_ast = normalize_ast_direct(ast)
+        if _count_values(ast).get(LOOP, 0) <= 1:
+            assert d_ast is ast
+        else:
+            with pipeline_stage(reset_flags=True):
+                cfg = CFG()
+                _normalize_cfg_bottom_up(cfg, ast)
+            assert _count_values(d_ast) == _count_values(to_ast(cfg))
+    print("\nDirect normalization test passed for " + str(len(asts)) + " programs")
+
+# Comparison of each BI_EXPR
+_BI_OPS = {EQ: operator.eq, NEQ: operator.ne, GT: operator.gt, \
+           LT: operator.lt, GEQ: operator.ge, LEQ: operator.le}
+
+''' ---------------------------------------------------------------------------
+Return value of expression AST in state (dict); TRUE/ FALSE are booleans,
+constants integers, and variables not yet assigned 0
+--------------------------------------------------------------------------- '''
+def _eval(expr, state):
+    value = expr.getValue()
+    if value == NOT:
+        return not _eval(expr.getLeft(), state)
+    elif value in BI_EXPRS:
+        return _BI_OPS[value](_eval(expr.getLeft(), state), _eval(expr.getRight(), state))
+    elif value in [TRUE, FALSE]:
+        return value == TRUE
+    try:
+        return int(value)
+    except ValueError:
+        return state.get(value, 0)
+
+''' ---------------------------------------------------------------------------
+Return set of final states program AST (a tree, or a DAG) reaches from the
+states in states; a state is a tuple of sorted (variable, value) pairs. AMB
+takes either branch, and LOOP runs its body any number of times (to a fixed
+point; programs without arithmetic have finitely many states)
+--------------------------------------------------------------------------- '''
+def _reachable_states(ast, states):
+    def _assign(var, expr):
+        def _run(states):
+            return set(tuple(sorted({**dict(s), var: _eval(expr, dict(s))}.items())) for s in states)
+        return _run
+
+    def _loop(body):
+        def _run(states):
+            reached, new = set(states), set(states)
+            while new:
+                new = body(new) - reached
+                reached |= new
+            return reached
+        return _run
+
+    # Compile each statement to a function of a set of states, bottom-up
+    def _compile(ast, state, runs):
+        ast_type = ast.getValue()
+        if ast_type == ASSIGN:
+            return _assign(ast.getLeft().getValue(), ast.getRight())
+        elif ast_type == ASSUME:
+            return lambda states: set(s for s in states if _eval(ast.getLeft(), dict(s)))
+        elif ast_type == SEQ:
+            return lambda states: runs[1](runs[0](states))
+        elif ast_type == AMB:
+            return lambda states: runs[0](states) | runs[1](states)
+        return _loop(runs[0])
+
+    return walk(ast, _stmt_children, leave=_compile)(set(states))
+
+''' ---------------------------------------------------------------------------
+Return final states of program AST from the initial states (every variable 0,
+and every variable 1), with flag variables projected out
+--------------------------------------------------------------------------- '''
+def _final_states(ast):
+    variables = set()
+    def _add_variable(node):
+        value = node.getValue()
+        if value not in AST_NODES and not value.lstrip("-").isdigit():
+            variables.add(value)
+    walk(ast, ast_children, _add_variable)
+
+    initial = [(), tuple((var, 1) for var in sorted(variables))]
+    return set(tuple((var, val) for var, val in s if not var.startswith(flag_name)) \
+               for s in _reachable_states(ast, initial))
+
+''' ---------------------------------------------------------------------------
+Validates that normalization preserves meaning; the program normalize_ast, and
+normalize_ast_direct, returns reaches the same final states as the original
+(flag variables projected out), for the samples, generated nested programs,
+and random programs
+--------------------------------------------------------------------------- '''
+def test_normalization_semantics(ast_paths, depths=[2, 3, 4, 7], num_random=300, seed=410):
+    print("\nBeginning normalization semantics test [Component 5]")
+    rng = random.Random(seed)
+    wps = [gen_nested_loop_program(4)] + \
+          [gen_nested_loop_program(2, depth) for depth in depths] + \
+          [gen_mixed_nesting_program(depth) for depth in depths] + \
+          [gen_random_program(rng, 6) for _ in range(num_random)]
+    wps = ast_paths + [wp.encode() for wp in wps]
+    for wp in wps:
+        ctx      = PipelineContext(verbose=False)
+        ast      = get_AST(wp, ctx)
+        expected = _final_states(ast)
+        for n_ast in [normalize_ast(ast, ctx=ctx), normalize_ast_direct(ast, ctx)]:
+            assert _count_values(n_ast).get(LOOP, 0) <= 1
+            assert _final_states(n_ast) == expected
+    print("\nNormalization semantics test passed for " + str(len(wps)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates that the in-place site rewrites (_normalize_cfg) handle padded LOOPs,
+and raise _UnsupportedShapeError (not an assert), leaving an equivalent CFG, on
+the shapes they do not handle (a too deep nest before any change); that
+normalize_ast takes them where they apply; and that normalize_cfg, which
+falls back to a bottom-up rebuild on the others, yields one back edge and
+the same final states on each
+--------------------------------------------------------------------------- '''
+def test_normalize_cfg_shapes(num_random=300, seed=411):
+    print("\nBeginning normalize_cfg shapes test [Component 5]")
+    supported = [gen_nested_loop_program(3),
+                 "SEQ(ASSIGN(a, 0), SEQ(LOOP(ASSIGN(a, 1)), SEQ(ASSIGN(c, 0), " + \
+                 "SEQ(LOOP(ASSIGN(b, 1)), ASSIGN(b, 0)))))"]
+    rejected  = ["SEQ(ASSIGN(a, 0), SEQ(LOOP(ASSIGN(a, 1)), SEQ(LOOP(ASSIGN(b, 1)), ASSIGN(b, 0))))",
+                 "SEQ(LOOP(ASSIGN(a, 1)), LOOP(ASSIGN(b, 1)))",
+                 "LOOP(LOOP(ASSIGN(a, 1)))",
+                 gen_mixed_nesting_program(3), # LOOP on one AMB branch, in a LOOP
+                 gen_nested_loop_program(1, 3)]
+    for wp in supported + rejected:
+        ctx   = PipelineContext(verbose=False)
+        ast   = get_AST(wp.encode(), ctx)
+        cfg   = get_CFG(ast, ctx=ctx)
+        edges = set(cfg.getEdgeSet())
+        try:
+            with pipeline_stage(ctx, reset_flags=True):
+                _normalize_cfg(cfg)
+            assert wp in supported
+            assert str(normalize_ast(ast, ctx=PipelineContext(verbose=False))) == str(to_ast(cfg))
+        except _UnsupportedShapeError:
+            assert wp in rejected
+            assert wp != rejected[-1] or set(cfg.getEdgeSet()) == edges
+        assert _final_states(to_ast(cfg)) == _final_states(ast)
+
+    rng = random.Random(seed)
+    wps = supported + rejected + [gen_random_program(rng, 6) for _ in range(num_random)]
+    for wp in wps:
+        ctx = PipelineContext(verbose=False)
+        ast = get_AST(wp.encode(), ctx)
+        cfg = normalize_cfg(get_CFG(ast, ctx=ctx), ctx)
+        assert cfg.getEdgeCount(LOOP_BACK) <= 1
+        assert _final_states(to_ast(cfg)) == _final_states(ast)
+    print("\nnormalize_cfg shapes test passed for " + str(len(wps)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates that each sample CFG's frozen (CSR) snapshot has the same edges, of
+the same types, and that every node is reachable from entry, and reaches exit
+--------------------------------------------------------------------------- '''
+def test_frozen_CFG(ast_paths):
+    print("\nBeginning frozen CFG test [Component 1]")
+    for ast_path in ast_paths:
+        cfg    = get_CFG(get_AST(ast_path))
+        frozen = freeze_CFG(cfg)
+        assert frozen.numEdges() == len(cfg.getEdgeSet())
+        for edge_type in EdgeType:
+            assert len(frozen.getEdgesOfType(edge_type)) == cfg.getEdgeCount(edge_type)
+        assert frozen.getEdgeType(frozen.getEdgesOfType(LABELED)[0]) is LABELED
+
+        # None still names the labeled edges
+        assert cfg.getEdgesOfType(None) == cfg.getEdgesOfType(LABELED)
+        assert list(frozen.getEdgesOfType(None)) == list(frozen.getEdgesOfType(LABELED))
+        assert Edge(EPS, cfg.getEntryNode(), cfg.getExitNode(), None).getType() is LABELED
+        for e in cfg.getEdgeSet():
+            src = frozen.getIndex(e.getSource().getID())
+            dst = frozen.getIndex(e.getEndpoint().getID())
+            assert dst in frozen.getSuccessors(src)
+            assert src in frozen.getPredecessors(dst)
+        assert frozen.reachable().all()
+        assert frozen.reachable(frozen.getExit(), reverse=True).all()
+    print("\nFrozen CFG test passed for " + str(len(ast_paths)) + " samples")
+
+''' ---------------------------------------------------------------------------
+Validates that each node's edge ports name the same edges as a scan of its
+edge sets, for the sample CFGs and their normalized CFGs
+--------------------------------------------------------------------------- '''
+def test_edge_ports(ast_paths):
+    print("\nBeginning edge port test [Components 1, 5]")
+    def _of_type(edges, edge_type):
+        return [e for e in edges if e.getType() == edge_type] or [None]
+
+    cfgs = [get_CFG(get_AST(ast_path)) for ast_path in ast_paths] + \
+           [normalize_ast(get_AST(ast_path), ret_norm_cfg=True)[1] for ast_path in ast_paths]
+    for cfg in cfgs:
+        for n in cfg.getNodes():
+            ins, outs = n.getIncomingEdges(), n.getOutgoingEdges()
+            assert [n.getLoopEntryEdge()] == _of_type(outs, LOOP_ENTRY)
+            assert [n.getLoopBackEdge()]  == _of_type(ins, LOOP_BACK)
+            assert [n.getAMBJoinEdge()]   == _of_type(outs, AMB_JOIN)
+            assert [n.getSeqNextEdge()]   == _of_type(outs, SEQ_TRANS)
+            assert set(n.getAMBSplitEdges()) == set(_of_type(outs, AMB_SPLIT)) - set([None])
+            if n.getType() == LOOP:
+                assert set([n.getLoopOutEdge(), n.getLoopEntryEdge()]) - set([None]) == outs
+                assert set([n.getLoopInEdge(), n.getLoopBackEdge()]) - set([None]) == ins
+    print("\nEdge port test passed for " + str(len(cfgs)) + " CFGs")
+
+''' ---------------------------------------------------------------------------
+Return set of nodes reachable from cfg's entry by edges in its edge set
+--------------------------------------------------------------------------- '''
+def _reachable(cfg):
+    nodes   = set([cfg.getEntryNode()])
+    edges   = set(cfg.getEdgeSet())
+    reached = nodes
+    while reached:
+        reached = set(e.getEndpoint() for e in edges if e.getSource() in reached) - nodes
+        nodes  |= reached
+    return nodes
+
+''' ---------------------------------------------------------------------------
+Validates the edge set's node registry, and the lazy CFG traversals; the
+registry holds exactly the nodes the edges touch (as edges are removed and
+added back, and as normalize_cfg rewrites), and DFS/ BFS yield each node
+reachable from entry once
+--------------------------------------------------------------------------- '''
+def test_cfg_traversals(ast_paths, depths=[3, 6]):
+    print("\nBeginning CFG traversal test [Component 1]")
+    def _check(cfg):
+        ends = set(n for e in cfg.getEdgeSet() for n in (e.getSource(), e.getEndpoint()))
+        assert cfg.getNodes() == ends and set(cfg.iterNodes()) == ends
+        assert cfg.getNodeCount() == len(ends)
+        assert sorted(cfg.iterEdges(), key=id) == sorted(cfg.getEdgeSet(), key=id)
+        for order in [list(cfg.iterDFS()), list(cfg.iterBFS())]:
+            assert order[0] is cfg.getEntryNode()
+            assert len(order) == len(set(order)) and set(order) == _reachable(cfg)
+
+    cfgs = [get_CFG(get_AST(ast_path)) for ast_path in ast_paths] + \
+           [get_CFG(get_AST(gen_mixed_nesting_program(depth).encode())) for depth in depths]
+    for cfg in cfgs:
+        _check(cfg)
+
+        # Remove every other edge (leaving nodes untouched, and parts of the
+        # graph unreachable) one at a time, then add them back
+        edges = sorted(cfg.getEdgeSet(), key=lambda e: (e.getSource().getID(), e.getEndpoint().getID()))
+        for e in edges[::2]:
+            cfg.removeEdge(e)
+            _check(cfg)
+        cfg.removeEdges(edges[::2]) # Absent edges are skipped
+        cfg.unionEdges(edges)
+        _check(cfg)
+        cfg.addEdge(edges[0]) # Present edges are not counted twice
+        _check(cfg)
+
+    cfg = get_CFG(get_AST(gen_nested_loop_program(3).encode()))
+    normalize_cfg(cfg)
+    _check(cfg)
+    print("\nCFG traversal test passed for " + str(len(cfgs) + 1) + " CFGs")
+
+''' ---------------------------------------------------------------------------
+Validates CFG copies; of a whole CFG (getCopy), and of the body of a LOOP
+(getRegionCopy; also a body ending in a LOOP), with fresh node IDs, a complete
+edge map, and AMB_SPLIT ports in order. The original is left as is, unless its
+edge set is given as the one to copy into
+--------------------------------------------------------------------------- '''
+def test_cfg_copy(ast_paths, depths=[3, 6]):
+    print("\nBeginning CFG copy test [Component 1]")
+    wps  = ast_paths + [b"LOOP(ASSIGN(x, 1))", b"SEQ(ASSIGN(a, 0), LOOP(ASSIGN(a, 1)))"] + \
+           [gen_mixed_nesting_program(depth).encode() for depth in depths]
+    for wp in wps:
+        # Program as the body of a LOOP; so the CFG ends in a LOOP
+        ast  = get_AST(wp)
+        loop = AST(LOOP)
+        loop.setLeft(ast)
+        cfg    = get_CFG(loop)
+        before = _edge_links(cfg)
+        ids    = set(n.getID() for n in cfg.getNodes())
+        head   = cfg.getEntryNode()
+        entry  = head.getLoopEntryEdge().getEndpoint()
+        exit   = head.getLoopBackEdge().getSource()
+
+        copy = cfg.getCopy()
+        region, edge_map = cfg.getRegionCopy(entry, exit)
+        assert str(to_ast(copy)) == str(loop) and str(to_ast(region)) == str(ast)
+        for c in [copy, region]:
+            assert not ids & set(n.getID() for n in c.getNodes() | set([c.getEntryNode(), c.getExitNode()]))
+        assert len(copy.getEdgeSet()) == len(cfg.getEdgeSet())
+
+        # Every edge of the body is mapped, to an edge of the copy alone
+        assert set(edge_map) == set(cfg.getEdgeSet()) - set([head.getLoopEntryEdge(), head.getLoopBackEdge()])
+        assert set(edge_map.values()) == set(region.getEdgeSet())
+        nodes = {} # Original node -> copy, as the edge map links them
+        for e, e_copy in edge_map.items():
+            assert (e_copy.getData(), e_copy.getType()) == (e.getData(), e.getType())
+            for n, n_copy in [(e.getSource(), e_copy.getSource()), (e.getEndpoint(), e_copy.getEndpoint())]:
+                assert nodes.setdefault(n, n_copy) is n_copy and n_copy.getType() == n.getType()
+        for n, n_copy in nodes.items():
+            if n.getType() == AMB:
+                assert [edge_map[e] for e in n.getAMBSplitEdges()] == n_copy.getAMBSplitEdges()
+                assert nodes[n.getAMBExit()] is n_copy.getAMBExit()
+        assert _edge_links(cfg) == before
+
+        # Copied into the CFG's own edge set
+        region = cfg.getRegionCopy(entry, exit, cfg.getEdgeSet())[0]
+        assert len(cfg.getEdgeSet()) == len(before[0]) + len(edge_map)
+        assert region.getEdgeSet() is cfg.getEdgeSet()
+    print("\nCFG copy test passed for " + str(len(wps)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates the region tree of programs nesting LOOPs (and AMBs): LOOP counts and
+depths, innermost LOOP lookup, and that normalizing a CFG in place (which
+updates its region tree as it rewrites) leaves one back edge
+--------------------------------------------------------------------------- '''
+def test_region_tree(depths=[1, 5, 11, 25], num_blocks=50):
+    print("\nBeginning region tree test [Components 1, 5]")
+    for depth in depths:
+        ast  = get_AST(gen_mixed_nesting_program(depth).encode())
+        tree = get_region_tree(get_CFG(ast))
+        num_loops = _count_values(ast).get(LOOP, 0)
+        assert tree.getRoot().getLoopCount() == num_loops
+
+        # Odd depths; the outermost statement is a LOOP
+        innermost = tree.getInnermostLoop(tree.getRoot().getFirstLoop())
+        assert tree.getBody(innermost).getLoopDepth() == num_loops
+        assert not tree.getBody(innermost).containsLoop()
+
+    cfg = get_CFG(get_AST(gen_nested_loop_program(num_blocks).encode()))
+    assert get_region_tree(cfg).getRoot().getLoopCount() == 2 * num_blocks
+    assert normalize_cfg(cfg).getEdgeCount(LOOP_BACK) == 1
+    print("\nRegion tree test passed for depths " + str(depths))
+
+''' ---------------------------------------------------------------------------
+Validates that the loop analysis (which does not read edge types) finds the
+LOOP_BACK edges as back edges and the LOOP nodes as headers, at the depths
+the region tree gives; and that entry dominates, and exit post-dominates,
+every node
+--------------------------------------------------------------------------- '''
+def test_loop_forest(ast_paths, depths=[3, 10, 25]):
+    print("\nBeginning loop forest test [Components 1, 5]")
+    cfgs = [get_CFG(get_AST(ast_path)) for ast_path in ast_paths] + \
+           [get_CFG(get_AST(gen_mixed_nesting_program(depth).encode())) for depth in depths] + \
+           [normalize_ast(get_AST(ast_path), ret_norm_cfg=True)[1] for ast_path in ast_paths]
+    for cfg in cfgs:
+        frozen = freeze_CFG(cfg)
+        dom    = DominatorTree(frozen)
+        pdom   = DominatorTree(frozen, post=True)
+        forest = LoopForest(frozen, dom)
+        for i in range(frozen.numNodes()):
+            assert dom.dominates(frozen.getEntry(), i)
+            assert pdom.dominates(frozen.getExit(), i)
+
+        assert forest.isReducible()
+        assert sorted(forest.getBackEdges()) == sorted(frozen.getEdgesOfType(LOOP_BACK))
+        tree = get_region_tree(cfg)
+        for n in cfg.getNodes():
+            if n.getType() == LOOP:
+                h = frozen.getIndex(n.getID())
+                assert forest.getHeader(h) == h
+                assert forest.getDepth(h) == tree.getBody(n).getLoopDepth()
+        assert forest.numLoops() == cfg.getEdgeCount(LOOP_BACK)
+    print("\nLoop forest test passed for " + str(len(cfgs)) + " CFGs")
+
+''' ---------------------------------------------------------------------------
+Run the pipeline (parse, CFG, normalization) on program wp in its own context;
+return (normalized AST as string, True if all node IDs made were unique)
+--------------------------------------------------------------------------- '''
+def _run_pipeline(wp):
+    ctx   = PipelineContext(verbose=False)
+    ast   = get_AST(wp, ctx)
+    cfg   = get_CFG(ast, ctx=ctx)
+    n_ast = normalize_ast(ast, ctx=ctx)
+    ids   = [n.getID() for n in cfg.getNodes()]
+    for root in [ast, n_ast]:
+        walk(root, ast_children, lambda node: ids.append(node.getID()))
+    return str(n_ast), len(set(ids)) == len(ids)
+
+''' ---------------------------------------------------------------------------
+Validates that pipelines run concurrently (each in its own PipelineContext)
+give the same results as run one at a time, with node IDs unique across
+each pipeline's stages
+--------------------------------------------------------------------------- '''
+def test_concurrent_pipelines(ast_paths, depths=range(1, 16), num_threads=8):
+    print("\nBeginning concurrent pipelines test [Components -1, 1, 3 and 4, 5]")
+    wps = ast_paths + [gen_mixed_nesting_program(depth).encode() for depth in depths]
+    serial = [_run_pipeline(wp) for wp in wps]
+    with ThreadPoolExecutor(num_threads) as pool:
+        assert list(pool.map(_run_pipeline, wps)) == serial
+    assert all(unique for _, unique in serial)
+    print("\nConcurrent pipelines test passed for " + str(len(wps)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates the batch driver; programs found by glob and manifest are each
+recorded once (failures with their stage), with the same normalized ASTs as
+normalize_ast gives them one at a time
+--------------------------------------------------------------------------- '''
+def test_batch_driver(ast_paths, depths=range(1, 9), workers=2, chunk_size=3):
+    print("\nBeginning batch driver test [Components -1, 1, 5]")
+    with tempfile.TemporaryDirectory() as folder:
+        for depth in depths:
+            with open(os.path.join(folder, "mixed_" + str(depth) + ".txt"), "w") as f:
+                f.write(gen_mixed_nesting_program(depth))
+        with open(os.path.join(folder, "broken.txt"), "w") as f:
+            f.write("SEQ(ASSIGN(a, 1)")
+        manifest = os.path.join(folder, "manifest")
+        with open(manifest, "w") as f:
+            f.write("# samples\n" + "\n".join(os.path.abspath(p) for p in ast_paths) + "\n")
+
+        paths = discover([os.path.join(folder, "*.txt"), "@" + manifest, ast_paths[0]])
+        assert len(paths) == len(depths) + 1 + len(ast_paths)
+        out   = os.path.join(folder, "results.jsonl")
+        stats = run_batch(paths, out, workers, chunk_size)
+        with open(out) as f:
+            records = {r["path"]: r for r in map(json.loads, f)}
+
+        assert sorted(records) == paths
+        assert stats["programs"] == len(paths) and stats["failed"] == 1
+        for path, record in records.items():
+            if path.endswith("broken.txt"):
+                assert not record["ok"] and record["stage"] == "parse"
+                continue
+            ctx = PipelineContext(verbose=False)
+            assert record["ok"] and record["digest"] == _digest(normalize_ast(get_AST(path, ctx), ctx=ctx))
+    print("\nBatch driver test passed for " + str(len(paths)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Validates sharded batch runs; each program is run by exactly one shard (by
+path, or content), the same one wherever the corpus is mounted, and the
+merged shards give the same results as one run; shards run at different mount
+points are matched by corpus-relative path
+--------------------------------------------------------------------------- '''
+def test_sharded_batch(ast_paths, depths=range(1, 9), num_shards=3):
+    print("\nBeginning sharded batch test [Components -1, 1, 5]")
+    with tempfile.TemporaryDirectory() as folder:
+        for depth in depths:
+            with open(os.path.join(folder, "mixed_" + str(depth) + ".txt"), "w") as f:
+                f.write(gen_mixed_nesting_program(depth))
+        patterns = [os.path.join(folder, "*.txt")] + ast_paths
+        paths    = discover(patterns)
+        root     = corpus_root(patterns)
+        out      = os.path.join(folder, "results.jsonl")
+        run_batch(paths, out, workers=1, root=root)
+        with open(out) as f:
+            expected = sorted(f, key=lambda line: json.loads(line)["path"])
+
+        for by in SHARD_KEYS:
+            shards = [select_shard(paths, i, num_shards, by, root) for i in range(num_shards)]
+            assert sorted(p for shard in shards for p in shard) == paths
+            assert shards == [select_shard(paths, i, num_shards, by, root) for i in range(num_shards)]
+            for i, shard in enumerate(shards):
+                run_batch(shard, shard_path(out, i, num_shards), workers=1, root=root)
+
+            stats = merge_shards(out, num_shards)
+            with open(out) as f:
+                merged = sorted(f, key=lambda line: json.loads(line)["path"])
+            assert stats["programs"] == len(paths) and stats["shards"] == num_shards
+            assert [{**json.loads(line), "times": None} for line in merged] == \
+                   [{**json.loads(line), "times": None} for line in expected]
+
+        # The same corpus at two mount points (and a manifest) is split alike
+        partitions = []
+        corpora    = [os.path.join(folder, mount, "corpus") for mount in ["mnt_a", os.path.join("mnt_b", "nested")]]
+        for corpus in corpora:
+            shutil.copytree(folder, corpus, ignore=shutil.ignore_patterns("mnt_*", "results*"))
+            with open(os.path.join(corpus, "manifest"), "w") as f:
+                f.write("*.txt\n")
+            for patterns in [[os.path.join(corpus, "**", "*.txt")], ["@" + os.path.join(corpus, "manifest")]]:
+                root  = corpus_root(patterns)
+                found = discover(patterns)
+                partitions.append([sorted(os.path.relpath(p, root) for p in select_shard(found, i, num_shards, "path", root))
+                                   for i in range(num_shards)])
+        assert all(partition == partitions[0] for partition in partitions)
+        assert sum(len(shard) for shard in partitions[0]) == len(depths)
+
+        # Shards run at either mount point merge (by corpus-relative path); a
+        # program run at both is caught. Shard i runs the programs of shard
+        # selected, at corpus
+        def _run_shard(i, selected, corpus):
+            patterns = [os.path.join(corpus, "**", "*.txt")]
+            root     = corpus_root(patterns)
+            found    = select_shard(discover(patterns), selected, num_shards, "path", root)
+            run_batch(found, shard_path(out, i, num_shards), workers=1, root=root)
+
+        for i in range(num_shards):
+            _run_shard(i, i, corpora[i % 2])
+        assert merge_shards(out, num_shards)["programs"] == len(depths)
+        with open(out) as f:
+            assert sorted(json.loads(line)["relpath"] for line in f) == \
+                   sorted("mixed_" + str(depth) + ".txt" for depth in depths)
+        _run_shard(0, 0, corpora[0])
+        _run_shard(1, 0, corpora[1])
+        try:
+            merge_shards(out, num_shards)
+            assert False, "Program merged from two shards"
+        except ValueError:
+            pass
+    print("\nSharded batch test passed for " + str(len(paths)) + " programs")
+
+''' ---------------------------------------------------------------------------
+Write stub dot executable to folder; it copies its input to its output after
+delay seconds, logging start/ end times, and fails on sources holding "FAIL"
+--------------------------------------------------------------------------- '''
+def _write_stub_dot(folder, delay):
+    stub = os.path.join(folder, "dot")
+    log  = os.path.join(folder, "dot.log")
+    with open(stub, "w") as f:
+        f.write("#!" + sys.executable + "\n" + \
+                "import sys, time\n" + \
+                "out, src = sys.argv[sys.argv.index('-o') + 1], sys.argv[-1]\n" + \
+                "log = lambda e: open(" + repr(log) + ", 'a').write(e + ' %r\\n' % time.time())\n" + \
+                "log('start'); time.sleep(" + repr(delay) + ")\n" + \
+                "text = open(src).read()\n" + \
+                "sys.exit(1) if 'FAIL' in text else open(out, 'w').write(text)\n" + \
+                "log('end')\n")
+    os.chmod(stub, 0o755)
+    return stub, log
+
+''' ---------------------------------------------------------------------------
+Validates the render queue (with a stub dot); ASTs and CFGs are rendered as
+queued, with at most workers dot processes at once, while the caller goes on
+--------------------------------------------------------------------------- '''
+def test_render_queue(ast_paths, workers=3, delay=0.2):
+    print("\nBeginning render queue test [Component 6]")
+    previous = set_render_cache(None) # Render every graph
+    with tempfile.TemporaryDirectory() as folder:
+        stub, log = _write_stub_dot(folder, delay)
+        with RenderQueue(workers, dot_binary=stub) as queue:
+            futures = []
+            for path in ast_paths:
+                name = path.split("/")[-1].split(".")[0]
+                ast  = get_AST(path)
+                futures.append(visualize_ast(ast, name, folder + "/asts/", queue=queue))
+                futures.append(visualize_cfg(get_CFG(ast), name, folder + "/cfgs/", queue=queue))
+            assert not all(future.done() for future in futures) # Caller not blocked
+            rendered = queue.join()
+            assert rendered == [future.result() for future in futures]
+            for out in rendered:
+                with open(out) as f, open(out[:-len(".pdf")]) as g:
+                    assert f.read() == g.read()
+
+            failed = queue.submit("digraph { FAIL }", folder + "/fail.gv")
+            assert isinstance(failed.exception(), subprocess.CalledProcessError)
+
+        # Concurrency is bounded by workers, and used; ends before starts at ties
+        with open(log) as f:
+            events = sorted((float(t), e == "start") for e, t in map(str.split, f))
+        running, most = 0, 0
+        for _, start in events:
+            running += 1 if start else -1
+            most = max(most, running)
+        assert 1 < most <= workers
+    set_render_cache(previous)
+    print("\nRender queue test passed for " + str(len(rendered)) + " graphs")
+
+''' ---------------------------------------------------------------------------
+Validates the render cache (with a stub dot); unchanged graphs are not
+re-rendered, renders of other options are kept apart, deleted outputs are
+restored from the cache, and the cache stays within its size bound
+--------------------------------------------------------------------------- '''
+def test_render_cache(ast_paths):
+    print("\nBeginning render cache test [Component 6]")
+    with tempfile.TemporaryDirectory() as folder:
+        stub, log = _write_stub_dot(folder, 0)
+        def _num_renders():
+            if not os.path.exists(log):
+                return 0
+            with open(log) as f:
+                return len([line for line in f if line.startswith("start")])
+
+        def _render_all(cache, show_epsilons=True):
+            with RenderQueue(dot_binary=stub) as queue:
+                futures = []
+                for path in ast_paths:
+                    name = path.split("/")[-1].split(".")[0]
+                    ast  = get_AST(path)
+                    futures.append(visualize_ast(ast, name, folder + "/asts/", queue, cache))
+                    futures.append(visualize_cfg(get_CFG(ast), name, folder + "/cfgs/", \
+                                                 show_epsilons, True, queue, cache))
+                return [future.result() for future in futures]
+
+        # Rendered once; then unchanged (also for a new cache of the same folder)
+        with RenderCache(folder + "/cache/") as cache:
+            rendered = _render_all(cache)
+            assert _num_renders() == len(rendered)
+            assert _render_all(cache) == rendered and _num_renders() == len(rendered)
+        with RenderCache(folder + "/cache/") as cache:
+            assert _render_all(cache) == rendered and _num_renders() == len(rendered)
+            assert cache.getStats() == (len(rendered), 0)
+
+            # Other options are another render; switching back, or deleting
+            # the outputs, restores them from the cache
+            _render_all(cache, show_epsilons=False)
+            assert _num_renders() == len(rendered) + len(ast_paths)
+            _render_all(cache)
+            shutil.rmtree(folder + "/asts/")
+            shutil.rmtree(folder + "/cfgs/")
+            assert _render_all(cache) == rendered and all(os.path.exists(p) for p in rendered)
+            assert _num_renders() == len(rendered) + len(ast_paths)
+
+        # Least recently used renders are evicted over the size bound
+        max_bytes = 3 * max(os.path.getsize(p) for p in rendered)
+        with RenderCache(folder + "/small_cache/", max_bytes) as cache:
+            _render_all(cache)
+            assert 0 < cache.getSize() <= max_bytes
+            cached = [f for f in os.listdir(folder + "/small_cache/") if f.endswith(".pdf")]
+            assert 0 < len(cached) < len(rendered)
+    print("\nRender cache test passed for " + str(len(rendered)) + " graphs")
+
+''' ---------------------------------------------------------------------------
+Validates the streaming DOT writer; it writes the same text as a graphviz
+Digraph, for ASTs and CFGs (all label options), and for IDs/ labels that
+need quoting or escaping; IDs holding ':' are quoted whole, not as node:port
+--------------------------------------------------------------------------- '''
+def test_dot_writer(ast_paths):
+    print("\nBeginning DOT writer test [Component 6]")
+    from graphviz import Digraph
+
+    def _same(fill, node_attr={}):
+        out = StringIO()
+        with DotWriter(out, comment="g", node_attr=node_attr) as dot:
+            fill(dot)
+        graph = Digraph(comment="g")
+        graph.node_attr.update(node_attr)
+        fill(graph)
+        assert out.getvalue() == graph.source
+        assert dot.getDigest() == hashlib.sha256(graph.source.encode("utf-8")).hexdigest()
+
+    # Recursive drawing, in the order the committed asts/*.gv were written
+    def _recursive_ast_to_dot(dot, ast):
+        dot.node(ast.getID(), ast.getValue())
+        for child in ast_children(ast):
+            _recursive_ast_to_dot(dot, child)
+            dot.edge(ast.getID(), child.getID())
+
+    for path in ast_paths:
+        ast = get_AST(path)
+        cfg = get_CFG(ast)
+        edges = sorted(cfg.getEdgeSet(), key=lambda e: (e.getSource().getID(), e.getEndpoint().getID()))
+        _same(lambda dot: ast_to_dot(dot, ast))
+        out = StringIO()
+        write_ast_dot(ast, out, "g")
+        graph = Digraph(comment="g")
+        _recursive_ast_to_dot(graph, ast)
+        assert out.getvalue() == graph.source
+        for show_epsilons in [True, False]:
+            for node_attr in [{}, {"label": ""}]:
+                _same(lambda dot: populate_dot(dot, edges, show_epsilons), node_attr)
+
+        out = StringIO()
+        write_cfg_dot(cfg, out, "g", False, False)
+        graph = Digraph(comment="g")
+        populate_dot(graph, edges, False)
+        graph.node_attr["label"] = ""
+        assert out.getvalue() == graph.source
+
+    names = ["a", "node", "Graph", "-1.5", "1a", "a b", 'q"uote', 'e\\"sc', "<b>html</b>", "<"]
+    _same(lambda dot: [dot.node(n, label=l) for n in names for l in names])
+    _same(lambda dot: [dot.edge(a, b, label=a) for a in names for b in names])
+    out = StringIO()
+    with DotWriter(out) as dot:
+        dot.edge("x:port:n", "7")
+        dot.setNamespace("g")
+        dot.edge("7", "8")
+    assert '\t"x:port:n" -> 7\n' in out.getvalue() and '\t"g:7" -> "g:8"\n' in out.getvalue()
+    print("\nDOT writer test passed for " + str(len(ast_paths)) + " programs")
+
+# Return regions of region tree, with their depth; outer regions first
+def _regions(tree):
+    regions = [(tree.getRoot(), 0)]
+    for region, depth in regions:
+        regions.extend((sub, depth + 1) for sub in tree.getChildren(region))
+    return regions
+
+''' ---------------------------------------------------------------------------
+Validates level-of-detail CFG visualization; with nothing collapsed every
+edge is drawn (as by write_cfg_dot), with a cluster per region; collapsed
+regions are summarized (statements add up), past max_depth, and kept open if
+expanded
+--------------------------------------------------------------------------- '''
+def test_clustered_cfg(ast_paths, depths=[5, 11], max_depth=1):
+    print("\nBeginning clustered CFG test [Component 6]")
+    cfgs = [get_CFG(get_AST(path)) for path in ast_paths]
+    for depth in depths:
+        ctx = PipelineContext(verbose=False)
+        cfgs.append(normalize_ast(get_AST(gen_mixed_nesting_program(depth).encode(), ctx), True, ctx)[1])
+
+    for cfg in cfgs:
+        out, flat = StringIO(), StringIO()
+        write_cfg_clustered(cfg, out)
+        write_cfg_dot(cfg, flat)
+        edges = lambda text: sorted(line.strip() for line in text.split("\n") if "->" in line)
+        assert edges(out.getvalue()) == edges(flat.getvalue())
+        regions = _regions(ClusterView(cfg).getRegionTree())
+        assert out.getvalue().count("subgraph cluster_") == len(regions) - 1
+
+        # Collapsed past max_depth; statements drawn and summarized add up
+        view = ClusterView(cfg, max_depth=max_depth)
+        regions = _regions(view.getRegionTree())
+        root = regions[0][0]
+        assert all(view.isCollapsed(region) == (depth > max_depth) for region, depth in regions)
+        summarized = [r for r, depth in regions if depth == max_depth + 1]
+        drawn = [r for r, depth in regions if depth <= max_depth]
+        assert view.getStatementCount(root) == \
+               sum(view.getStatementCount(r) for r in summarized) + \
+               sum(len(r.getNodes()) for r in drawn)
+        out = StringIO()
+        view.write(out)
+        assert out.getvalue().count("stmts, ") == len(summarized)
+        assert edges(out.getvalue()) == sorted(set(edges(out.getvalue())))
+
+        # Expanded on demand; the deepest region, and those holding it
+        view   = ClusterView(cfg, max_depth=0, expand=[view.getName(regions[-1][0])])
+        region = _regions(view.getRegionTree())[-1][0]
+        out    = StringIO()
+        view.write(out)
+        assert region.getParent() is None or "cluster_" + view.getName(region) in out.getvalue()
+        while region is not None:
+            assert not view.isCollapsed(region)
+            region = region.getParent()
+
+    # Node budget; large normalized CFG laid out in bounded size
+    ctx  = PipelineContext(verbose=False)
+    cfg  = normalize_ast(get_AST(gen_mixed_nesting_program(25).encode(), ctx), True, ctx)[1]
+    full = ClusterView(cfg).getDrawnCount()
+    assert ClusterView(cfg, max_nodes=full // 4).getDrawnCount() < full // 2
+    print("\nClustered CFG test passed for " + str(len(cfgs)) + " CFGs")
+
+# Return node IDs of AST, or of CFG
+def _graph_ids(graph):
+    if hasattr(graph, "getNodes"):
+        return {node.getID() for node in graph.getNodes()}
+    ids, stack = set(), [graph]
+    while stack:
+        node = stack.pop()
+        ids.add(node.getID())
+        stack.extend(ast_children(node))
+    return ids
+
+# Return node IDs of DOT text (as written by DotWriter), quotes removed
+def _dot_node_ids(text):
+    ids = set()
+    for line in text.split("\n"):
+        line = line.strip()
+        if line.startswith(("digraph", "subgraph", "graph", "node", "label")) or \
+           line[:1] in ["", "/", "}"]:
+            continue
+        ends = line.split(" [")[0].split(" -> ")
+        ids.update(end[1:-1] if end.startswith('"') else end for end in ends)
+    return ids
+
+''' ---------------------------------------------------------------------------
+Validates multi-graph rendering (with a stub dot); ASTs and CFGs with the
+same node IDs are packed into shared DOT documents without clashing, one dot
+run per document; and namespaced contexts give IDs unique across programs
+--------------------------------------------------------------------------- '''
+def test_batch_render(ast_paths, per_file=5):
+    print("\nBeginning batch render test [Component 6]")
+    graphs = []
+    for path in ast_paths:
+        name = path.split("/")[-1].split(".")[0]
+        ast  = get_AST(path)
+        cfg  = get_CFG(ast)
+        graphs += [(name + "_ast", ast), (name + "_cfg", cfg)]
+
+    # Each graph in its own cluster and namespace; IDs of the graphs overlap
+    out = StringIO()
+    write_graphs_dot(graphs, out)
+    expected = set()
+    for name, graph in graphs:
+        expected.update(name + ":" + id for id in _graph_ids(graph))
+    assert _dot_node_ids(out.getvalue()) == expected
+    assert len(expected) == sum(len(_graph_ids(graph)) for _, graph in graphs)
+    assert out.getvalue().count("subgraph cluster_") == len(graphs)
+    try:
+        write_graphs_dot(graphs[:1] * 2, StringIO())
+        assert False
+    except ValueError:
+        pass
+
+    # One dot run per document of at most per_file graphs
+    previous = set_render_cache(None) # Render every document
+    with tempfile.TemporaryDirectory() as folder:
+        stub, log = _write_stub_dot(folder, 0)
+        with RenderQueue(dot_binary=stub) as queue:
+            futures = visualize_batch(iter(graphs), "samples", folder + "/batches/", per_file, queue=queue)
+            rendered = [future.result() for future in futures]
+        assert len(rendered) == -(-len(graphs) // per_file)
+        with open(log) as f:
+            assert sum(line.startswith("start") for line in f) == len(rendered)
+        ids = set()
+        for out in rendered:
+            with open(out) as f:
+                ids |= _dot_node_ids(f.read())
+        assert ids == expected
+    set_render_cache(previous)
+
+    # Namespaced contexts; no IDs shared by the graphs of different programs
+    ids = set()
+    for i, path in enumerate(ast_paths):
+        ctx   = PipelineContext(namespace="p" + str(i), verbose=False)
+        ast   = get_AST(path, ctx)
+        cfg   = get_CFG(ast, ctx=ctx)
+        graph = _graph_ids(ast) | _graph_ids(cfg)
+        assert len(graph) == len(_graph_ids(ast)) + len(_graph_ids(cfg))
+        assert all(id.startswith("p" + str(i) + ":") for id in graph)
+        assert not ids & graph
+        ids |= graph
+    print("\nBatch render test passed for " + str(len(graphs)) + " graphs")
+
 # Run tests to validate component functionality
 if __name__=='__main__':
 
@@ -96,6 +1079,10 @@ if __name__=='__main__':
         show_epsilons   = "e" in sys.argv[1]
         show_node_labels = "n" in sys.argv[1]
 
+    # Skip re-rendering graphs unchanged since the last run
+    render_cache = RenderCache(".render_cache/")
+    set_render_cache(render_cache)
+
     print("\n========== Beginning Program Normalizer and AST/ CFG Visualizer Tests ==========")
     print("\nBuilt with Python 3.63 and Windows GV installation; Python 2.* not supported.")
     print("\nNote that all AST file paths (in test.py) should be relative to test.py!")
@@ -113,12 +1100,43 @@ if __name__=='__main__':
     test_AST_to_CFG_conversion(sample_asts, show_epsilons, show_node_labels)
     print("\n================================================================================")
 
+    # Component 1; frozen snapshot
+    test_frozen_CFG(sample_asts)
+    test_edge_ports(sample_asts)
+    test_cfg_traversals(sample_asts)
+    test_cfg_copy(sample_asts)
+    print("\n================================================================================")
+
     # Component 3 and 4
     test_CFG_to_AST_conversion(sample_asts)
+    test_read_only_conversion(sample_asts)
     print("\n================================================================================")
 
     # Component 5
     test_AST_normalization(sample_asts)
     print("\n================================================================================")
     
+    # Components -1 to 5 on deeply nested programs
+    test_deep_nesting()
+    test_operator_whitespace()
+    test_memoized_CFG()
+    test_compact_AST(sample_asts)
+    test_normalize_sites()
+    test_nested_normalization()
+    test_direct_normalization(sample_asts)
+    test_normalization_semantics(sample_asts)
+    test_normalize_cfg_shapes()
+    test_region_tree()
+    test_loop_forest(sample_asts)
+    test_concurrent_pipelines(sample_asts)
+    test_batch_driver(sample_asts)
+    test_sharded_batch(sample_asts)
+    test_render_queue(sample_asts)
+    test_render_cache(sample_asts)
+    test_dot_writer(sample_asts)
+    test_clustered_cfg(sample_asts)
+    test_batch_render(sample_asts)
+    print("\n================================================================================")
+    render_cache.save()
+
     # Component 6 tested in all the above
\ No newline at end of file